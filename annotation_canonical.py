@@ -0,0 +1,138 @@
+import copy
+import json
+import math
+import re
+from collections import Counter
+
+# Canonical form of submitted annotations. Coordinates are normalised to the
+# image (0..1), as the labelling page sends them.
+#
+# - bbox becomes [x, y, w, h] floats, with negative sizes flipped (a box drawn
+#   right-to-left, as rectify_bbox does for the dataset) and the box clipped
+#   to the image.
+# - gaze becomes [x, y] floats and is never moved; 'gaze_in_frame' says
+#   whether it lies inside the image.
+# - 'scale' stays as typed; 'scale_value' holds it parsed: metres as a number,
+#   'very_far', or None when unset or unreadable.
+#
+# Values that cannot be read at all are left alone and reported. This module
+# only uses the standard library, so the app, merge_annotations.py and the
+# analysis scripts can all import it; annotation_validation.py is the CLI
+# that re-checks a store with it.
+
+VERY_FAR = 'very_far'
+_SCALE_NUMBER = re.compile(r'^~?\s*(\d+(?:\.\d*)?|\.\d+)\s*(?:m|meters?|metres?)?$', re.IGNORECASE)
+EPS = 1e-9
+
+# Problems that leave an annotation unusable. The rest are informational:
+# flipped and clipped boxes are canonicalised, and gaze outside the frame is
+# a legitimate label (recorded as gaze_in_frame).
+ERRORS = frozenset({'bbox_invalid', 'bbox_empty', 'gaze_invalid', 'scale_invalid'})
+
+
+def parse_vec(value, n):
+    """Parse a list or a comma-separated string (older annotations) into n floats, or None."""
+    if isinstance(value, str):
+        value = value.split(',')
+    if not isinstance(value, (list, tuple)) or len(value) < n:
+        return None
+    try:
+        return [float(v) for v in value[:n]]
+    except (TypeError, ValueError):
+        return None
+
+
+def _finite_vec(value, n):
+    vec = parse_vec(value, n)
+    return vec if vec is not None and all(math.isfinite(v) for v in vec) else None
+
+
+def parse_scale(value):
+    """(scale_value, ok): metres as a float, VERY_FAR or None; ok is False for text that is not a distance."""
+    if value is None:
+        return None, True
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return (float(value), True) if math.isfinite(value) and value >= 0 else (None, False)
+    text = str(value).strip()
+    if not text:
+        return None, True
+    if text.lower().startswith('very far'):
+        return VERY_FAR, True
+    match = _SCALE_NUMBER.match(text)
+    if match:
+        return float(match.group(1)), True
+    return None, False
+
+
+def _canonical_bbox(bbox):
+    """(canonical [x, y, w, h], problems) for a readable box."""
+    x, y, w, h = bbox
+    corners = [min(x, x + w), min(y, y + h), max(x, x + w), max(y, y + h)]
+    clipped_corners = [min(max(c, 0.0), 1.0) for c in corners]
+    problems = []
+    if w < 0 or h < 0:
+        problems.append('bbox_flipped')
+    if any(abs(a - b) > EPS for a, b in zip(clipped_corners, corners)):
+        problems.append('bbox_clipped')
+    if problems:
+        # Boxes that needed no change keep their exact values
+        x0, y0, x1, y1 = clipped_corners
+        bbox = [x0, y0, x1 - x0, y1 - y0]
+    if bbox[2] <= EPS or bbox[3] <= EPS:
+        problems.append('bbox_empty')
+    return bbox, problems
+
+
+def canonicalize(annotations):
+    """Canonical copies of annotation dicts plus (position, problem) pairs.
+
+    Non-dict items are passed through unchanged. Problems are 'bbox_invalid',
+    'bbox_flipped', 'bbox_clipped', 'bbox_empty', 'gaze_invalid',
+    'gaze_out_of_frame' and 'scale_invalid'; the annotation is still returned
+    (canonicalised where possible) for each of them.
+    """
+    result = list(annotations)
+    problems = []
+    scales = {}  # scale strings repeat a lot; parse each distinct one once
+    for pos, ann in enumerate(annotations):
+        if not isinstance(ann, dict):
+            continue
+        new_ann = copy.copy(ann)
+        bbox = _finite_vec(ann.get('bbox'), 4)
+        if bbox is None:
+            problems.append((pos, 'bbox_invalid'))
+        else:
+            new_ann['bbox'], bbox_problems = _canonical_bbox(bbox)
+            problems.extend((pos, name) for name in bbox_problems)
+        gaze = _finite_vec(ann.get('gaze'), 2)
+        if gaze is None:
+            problems.append((pos, 'gaze_invalid'))
+        else:
+            new_ann['gaze'] = gaze
+            new_ann['gaze_in_frame'] = all(0.0 <= v <= 1.0 for v in gaze)
+            if not new_ann['gaze_in_frame']:
+                problems.append((pos, 'gaze_out_of_frame'))
+        scale_key = json.dumps(ann.get('scale'))
+        if scale_key not in scales:
+            scales[scale_key] = parse_scale(ann.get('scale'))
+        new_ann['scale_value'], scale_ok = scales[scale_key]
+        if not scale_ok:
+            problems.append((pos, 'scale_invalid'))
+        result[pos] = new_ann
+    problems.sort()
+    return result, problems
+
+
+def canonicalize_entries(entries):
+    """Canonicalise the annotations of every {index, annotations} entry.
+
+    Returns (new entries, Counter of problem names); entries are shallow-copied.
+    """
+    result, counts = [], Counter()
+    for entry in entries:
+        if isinstance(entry, dict) and isinstance(entry.get('annotations'), list):
+            entry = dict(entry)
+            entry['annotations'], problems = canonicalize(entry['annotations'])
+            counts.update(name for _, name in problems)
+        result.append(entry)
+    return result, counts
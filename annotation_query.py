@@ -0,0 +1,111 @@
+import bisect
+import threading
+
+# Filters accepted by /api/annotations. 'annotator' matches the entry's uid
+# (or an annotation's annotator_id); the rest match annotation fields.
+QUERY_FIELDS = ('image_path', 'annotator', 'target_type', 'farther_closer', 'object_detection')
+
+
+class AnnotationIndex:
+    """Secondary indexes over the annotations store for filtered, paged reads.
+
+    Entries are keyed by their position in the store (AnnotationStore.key),
+    which never changes: saves replace an entry in place or append. Each
+    (field, value) pair maps to a sorted list of positions, so a query walks
+    the shortest matching list from the cursor and checks the remaining
+    filters per annotation. The cursor is the last position returned. Like
+    AnnotationStats, the index is seeded once and then updated on each save.
+    """
+
+    def __init__(self):
+        self._entries = {}  # position -> entry with at least one annotation
+        self._positions = []  # sorted positions in _entries
+        self._postings = {}  # (field, value) -> sorted positions
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _values(entry, ann, field):
+        if field == 'annotator':
+            return {str(v) for v in (entry.get('uid'), ann.get('annotator_id')) if v not in (None, '')}
+        if field == 'image_path':
+            value = ann.get('image_path') or entry.get('image_path')
+        else:
+            value = ann.get(field)
+        return set() if value in (None, '') else {str(value)}
+
+    @classmethod
+    def _keys(cls, entry):
+        keys = set()
+        for ann in entry.get('annotations') or []:
+            if isinstance(ann, dict):
+                for field in QUERY_FIELDS:
+                    keys.update((field, value) for value in cls._values(entry, ann, field))
+        return keys
+
+    @staticmethod
+    def _remove(positions, position):
+        i = bisect.bisect_left(positions, position)
+        if i < len(positions) and positions[i] == position:
+            del positions[i]
+
+    def _put(self, position, entry):
+        old = self._entries.pop(position, None)
+        if old is not None:
+            self._remove(self._positions, position)
+            for key in self._keys(old):
+                self._remove(self._postings[key], position)
+                if not self._postings[key]:
+                    del self._postings[key]
+        anns = entry.get('annotations') if isinstance(entry, dict) else None
+        if not anns or not any(isinstance(ann, dict) for ann in anns):
+            return
+        self._entries[position] = entry
+        bisect.insort(self._positions, position)
+        for key in self._keys(entry):
+            bisect.insort(self._postings.setdefault(key, []), position)
+
+    def seed(self, items):
+        """Index (position, entry) pairs already in the store."""
+        with self._lock:
+            for position, entry in items:
+                self._put(position, entry)
+
+    def replace(self, position, entry):
+        """Index entry as the new content of the store at position."""
+        with self._lock:
+            self._put(position, entry)
+
+    def replace_shard(self, shard, shards, items):
+        """Re-index one shard from its (position, entry) pairs; returns the entries it held before."""
+        with self._lock:
+            old = [(position, entry) for position, entry in self._entries.items() if position % shards == shard]
+            for position, _ in old:
+                self._put(position, None)
+            for position, entry in items:
+                self._put(position, entry)
+            return [entry for _, entry in old]
+
+    def query(self, filters, cursor=-1, limit=100):
+        """Up to limit matching entries after cursor, and the cursor for the next page.
+
+        filters maps QUERY_FIELDS to a value. Each result holds the entry's
+        position, index, uid and saved_at, and only the annotations that
+        match every filter. The next cursor is None once there are no more.
+        """
+        filters = {field: str(value) for field, value in filters.items() if value not in (None, '')}
+        with self._lock:
+            lists = [self._postings.get(item, []) for item in filters.items()]
+            positions = min(lists, key=len) if lists else self._positions
+            results = []
+            for i in range(bisect.bisect_right(positions, cursor), len(positions)):
+                position = positions[i]
+                entry = self._entries[position]
+                anns = [ann for ann in entry['annotations'] if isinstance(ann, dict) and
+                        all(value in self._values(entry, ann, field) for field, value in filters.items())]
+                if not anns:
+                    continue
+                results.append({'position': position, 'index': entry.get('index'), 'uid': entry.get('uid'),
+                                'saved_at': entry.get('saved_at'), 'annotations': anns})
+                if len(results) == limit:
+                    return results, (position if i + 1 < len(positions) else None)
+            return results, None
@@ -0,0 +1,132 @@
+import threading
+import time
+from collections import Counter
+
+from image_resolver import is_gazefollow_path
+
+
+class AnnotationStats:
+    """Running collection statistics, updated on every write to the store.
+
+    The store is scanned once to seed the counters; after that each save
+    calls replace(old_entry, new_entry), which subtracts what the previous
+    version of the entry contributed and adds the new one. snapshot() never
+    touches the file, so its cost depends on the number of annotators and
+    time buckets, not on the size of the store. Entries without annotations
+    (reserved by reserve_annotation_index) are not counted.
+
+    Throughput is the number of non-empty entries per bucket_seconds, keyed
+    by each entry's latest 'saved_at' time (so it agrees with a fresh seed
+    after a restart); only the latest keep_buckets are kept.
+    """
+
+    def __init__(self, bucket_seconds=3600, keep_buckets=168, clock=time.time):
+        self.bucket_seconds = bucket_seconds
+        self.keep_buckets = keep_buckets
+        self.clock = clock
+        self.entries = 0
+        self.annotations = 0
+        self.per_image = Counter()  # image path -> annotations
+        self.images_by_count = Counter()  # annotations on an image -> number of images
+        self.per_annotator = Counter()  # uid -> annotations
+        self.per_source = Counter()  # 'gazefollow' / 'vat' -> annotations
+        self.target_types = Counter()
+        self.throughput = Counter()  # bucket start (unix time) -> entries last saved then
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _annotations(entry):
+        anns = entry.get('annotations') if isinstance(entry, dict) else None
+        if not isinstance(anns, list):
+            return []
+        return [ann for ann in anns if isinstance(ann, dict)]
+
+    def _set_image_count(self, path, delta):
+        before = self.per_image[path]
+        after = before + delta
+        if before:
+            self.images_by_count[before] -= 1
+            if not self.images_by_count[before]:
+                del self.images_by_count[before]
+        if after:
+            self.images_by_count[after] += 1
+            self.per_image[path] = after
+        else:
+            del self.per_image[path]
+
+    def _apply(self, entry, sign):
+        anns = self._annotations(entry)
+        if not anns:
+            return
+        self.entries += sign
+        self.annotations += sign * len(anns)
+        uid = entry.get('uid') or 'unknown'
+        self.per_annotator[uid] += sign * len(anns)
+        if not self.per_annotator[uid]:
+            del self.per_annotator[uid]
+        paths = Counter(ann.get('image_path') or entry.get('image_path') for ann in anns)
+        for path, n in paths.items():
+            self._set_image_count(path, sign * n)
+            self.per_source['gazefollow' if is_gazefollow_path(path) else 'vat'] += sign * n
+        for ann in anns:
+            key = ann.get('target_type') or 'unspecified'
+            self.target_types[key] += sign
+            if not self.target_types[key]:
+                del self.target_types[key]
+
+    def _bucket(self, timestamp):
+        return int(timestamp // self.bucket_seconds * self.bucket_seconds)
+
+    def _count_save(self, entry, sign):
+        if not self._annotations(entry) or not entry.get('saved_at'):
+            return
+        bucket = self._bucket(entry['saved_at'])
+        oldest = self._bucket(self.clock()) - (self.keep_buckets - 1) * self.bucket_seconds
+        if bucket < oldest or (sign < 0 and bucket not in self.throughput):
+            return
+        self.throughput[bucket] += sign
+        if not self.throughput[bucket]:
+            del self.throughput[bucket]
+        if len(self.throughput) > self.keep_buckets:
+            for old in [b for b in self.throughput if b < oldest]:
+                del self.throughput[old]
+
+    def seed(self, entries):
+        """Count entries already in the store (called once at startup)."""
+        with self._lock:
+            for entry in entries:
+                self._apply(entry, 1)
+                self._count_save(entry, 1)
+
+    def replace(self, old_entry, new_entry):
+        """Account for a save that replaced old_entry (None for a new entry) with new_entry."""
+        with self._lock:
+            if old_entry is not None:
+                self._apply(old_entry, -1)
+                self._count_save(old_entry, -1)
+            self._apply(new_entry, 1)
+            self._count_save(new_entry, 1)
+
+    def replace_many(self, old_entries, new_entries):
+        """Account for a shard that was re-read: old_entries were replaced by new_entries."""
+        with self._lock:
+            for entry in old_entries:
+                self._apply(entry, -1)
+                self._count_save(entry, -1)
+            for entry in new_entries:
+                self._apply(entry, 1)
+                self._count_save(entry, 1)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'entries': self.entries,
+                'annotations': self.annotations,
+                'images_annotated': len(self.per_image),
+                'images_by_annotation_count': {str(k): v for k, v in sorted(self.images_by_count.items())},
+                'per_annotator': dict(self.per_annotator.most_common()),
+                'per_source': {k: v for k, v in self.per_source.items() if v},
+                'target_types': dict(self.target_types.most_common()),
+                'bucket_seconds': self.bucket_seconds,
+                'throughput': [[bucket, n] for bucket, n in sorted(self.throughput.items())],
+            }
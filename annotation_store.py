@@ -0,0 +1,277 @@
+import argparse
+import contextlib
+import glob
+import json
+import os
+import sys
+import threading
+import zlib
+
+import portalocker
+
+# The annotations store: one JSON file of [{index, annotations, ...}], or
+# with shards > 1 the same shape split over <stem>.shard-NN<ext> files, each
+# with its own lock. An annotator's reservations all go to the shard picked
+# by their uid, and shard k only hands out indices i with i % shards == k, so
+# the shard of any entry follows from its index and indices stay unique
+# without a store-wide lock. Shard files are valid inputs to
+# merge_annotations.py as they are; read_all() gives the union.
+#
+# Each shard file's (mtime, size) is its version. StoreTracker uses it to tell
+# an in-memory view built from the store (stats, query indexes) when another
+# process, or a tool such as snapshots.py restore, has written the store.
+
+
+def parse_entries(data, path=''):
+    """Entries from a shard file's contents. An empty file is an empty store;
+    anything else that is not a JSON list raises ValueError, so a damaged file
+    is never silently replaced by []."""
+    if not data.strip():
+        return []
+    try:
+        entries = json.loads(data)
+    except ValueError as e:
+        raise ValueError(f"{path or 'annotations file'} is not valid JSON ({e}); restore it from a snapshot") from e
+    if not isinstance(entries, list):
+        raise ValueError(f"{path or 'annotations file'} does not hold a list of entries")
+    return entries
+
+
+def _signature(st):
+    return (st.st_mtime_ns, st.st_size)
+
+
+def _write_locked(f, entries):
+    f.seek(0)
+    f.truncate()
+    json.dump(entries, f)
+    f.flush()
+    try:
+        os.fsync(f.fileno())
+    except Exception:
+        pass
+
+
+class AnnotationStore:
+    def __init__(self, path, shards=1, timeout=10):
+        self.path = path
+        self.shards = max(1, int(shards))
+        self.timeout = timeout
+        self.listeners = []  # called as listener(shard, version before, version after) on each write
+
+    def path_of(self, shard):
+        if self.shards == 1:
+            return self.path
+        stem, ext = os.path.splitext(self.path)
+        return f"{stem}.shard-{shard:02d}{ext or '.json'}"
+
+    def paths(self):
+        return [self.path_of(shard) for shard in range(self.shards)]
+
+    def shard_for_uid(self, uid):
+        return zlib.crc32(str(uid).encode('utf-8')) % self.shards
+
+    def shard_for_index(self, index):
+        try:
+            return int(index) % self.shards
+        except (TypeError, ValueError):
+            return 0
+
+    def key(self, shard, position):
+        """Store-wide key of the entry at position in shard; stable because entries are never removed."""
+        return position * self.shards + shard
+
+    def check_layout(self):
+        """Raise ValueError if the files on disk were written with a different shard count.
+
+        Serving them anyway would restart index numbering next to entries
+        the store cannot see, giving duplicate indices.
+        """
+        stem, ext = os.path.splitext(self.path)
+        found = set(glob.glob(glob.escape(stem) + '.shard-*' + (ext or '.json')))
+        expected = set(self.paths()) if self.shards > 1 else set()
+        if found and found != expected:
+            raise ValueError(f"{self.path} has {len(found)} shard files, but the store is configured with "
+                             f"{self.shards} shard(s); set ANNOTATION_SHARDS={len(found)}, or export and re-split the store")
+        if self.shards > 1 and not found and os.path.exists(self.path):
+            with open(self.path, 'r') as f:
+                if parse_entries(f.read(), self.path):
+                    raise ValueError(f"{self.path} is not sharded; run `python annotation_store.py split {self.path} "
+                                     f"--shards {self.shards}` before starting with ANNOTATION_SHARDS={self.shards}")
+
+    def init_files(self):
+        """Create the store's directory and any missing (empty) files."""
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        for path in self.paths():
+            if not os.path.exists(path):
+                with open(path, 'w') as f:
+                    json.dump([], f)
+
+    @contextlib.contextmanager
+    def edit(self, shard):
+        """Lock one shard and yield its entries; the list is written back when the block exits cleanly."""
+        with portalocker.Lock(self.path_of(shard), 'r+', timeout=self.timeout) as f:
+            before = _signature(os.fstat(f.fileno()))
+            f.seek(0)
+            entries = parse_entries(f.read(), self.path_of(shard))
+            yield entries
+            _write_locked(f, entries)
+            after = _signature(os.fstat(f.fileno()))
+            for listener in self.listeners:
+                listener(shard, before, after)
+
+    def write(self, shard, entries):
+        """Replace a shard's contents under its lock without reading them (e.g. to restore a damaged file)."""
+        with portalocker.Lock(self.path_of(shard), 'r+', timeout=self.timeout) as f:
+            _write_locked(f, entries)
+
+    def version(self, shard):
+        """(mtime_ns, size) of a shard file, or None if it is missing."""
+        try:
+            return _signature(os.stat(self.path_of(shard)))
+        except OSError:
+            return None
+
+    def versions(self):
+        return [self.version(shard) for shard in range(self.shards)]
+
+    def read(self, shard):
+        with portalocker.Lock(self.path_of(shard), 'r+', timeout=self.timeout) as f:
+            return parse_entries(f.read(), self.path_of(shard))
+
+    def read_bytes(self, shard):
+        """Raw contents of a shard, read under its lock (polled often, as writers only hold it briefly)."""
+        with portalocker.Lock(self.path_of(shard), 'rb+', timeout=self.timeout, check_interval=0.01) as f:
+            f.seek(0)
+            return f.read()
+
+    def iter_keyed(self):
+        """(key, entry) for every entry in every shard."""
+        for shard in range(self.shards):
+            for position, entry in enumerate(self.read(shard)):
+                yield self.key(shard, position), entry
+
+    def read_all(self):
+        """Union of all shards in the unsharded [{index, annotations}] shape."""
+        return [entry for _, entry in self.iter_keyed()]
+
+    def next_index(self, entries, shard):
+        """Smallest index above those in a shard's entries that belongs to the shard."""
+        max_index = -1
+        for entry in entries:
+            if isinstance(entry, dict) and 'index' in entry:
+                try:
+                    max_index = max(max_index, int(entry['index']))
+                except Exception:
+                    pass
+        return max_index + 1 + (shard - (max_index + 1)) % self.shards
+
+    def reserve_index(self, uid):
+        """Append an empty entry under a new index in uid's shard and return the index."""
+        shard = self.shard_for_uid(uid)
+        with self.edit(shard) as entries:
+            index = self.next_index(entries, shard)
+            entries.append({'index': index, 'annotations': []})
+        return index
+
+
+class StoreTracker:
+    """Whether an in-memory view of a store still matches the files.
+
+    Call loaded(versions) with store.versions() taken before the view read
+    the store. Writes through the same AnnotationStore object move the
+    tracked version along when they start from it, as the caller applies
+    them to the view itself. Any other write (another worker, a CLI tool)
+    makes stale() true, and stale_shards() name the shards to re-read,
+    until the view catches up.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self._seen = None
+        self._lock = threading.Lock()
+        store.listeners.append(self._written)
+
+    def _written(self, shard, before, after):
+        with self._lock:
+            if self._seen is not None and self._seen[shard] == before:
+                self._seen[shard] = after
+
+    def loaded(self, versions):
+        with self._lock:
+            self._seen = list(versions)
+
+    def stale(self):
+        with self._lock:
+            seen = self._seen
+        return seen is None or self.store.versions() != seen
+
+    def stale_shards(self):
+        """Shards whose files changed since the view last saw them (all of them before loaded())."""
+        with self._lock:
+            seen = self._seen
+        if seen is None:
+            return list(range(self.store.shards))
+        return [shard for shard, version in enumerate(self.store.versions()) if version != seen[shard]]
+
+    def reloaded(self, shard, version):
+        """Record that the view re-read shard at version (taken before the read)."""
+        with self._lock:
+            if self._seen is not None:
+                self._seen[shard] = version
+
+
+def split_store(path, shards):
+    """Move an unsharded annotations file into `shards` shard files (entries go to index % shards).
+
+    Once the shards read back with every entry, the original is renamed to
+    <path>.pre-split, so the store's layout check no longer sees an
+    unsplit file next to the shards.
+    """
+    with open(path, 'r') as f:
+        entries = parse_entries(f.read(), path)
+    store = AnnotationStore(path, shards)
+    if store.shards == 1:
+        raise ValueError("split needs --shards 2 or more")
+    parts = [[] for _ in range(store.shards)]
+    for entry in entries:
+        parts[store.shard_for_index(entry.get('index') if isinstance(entry, dict) else None)].append(entry)
+    for shard, part in enumerate(parts):
+        with open(store.path_of(shard), 'w') as f:
+            json.dump(part, f)
+    written = [store.read(shard) for shard in range(store.shards)]
+    if written != parts:
+        raise ValueError(f"shard files of {path} did not read back as written; {path} is left in place")
+    os.replace(path, path + '.pre-split')
+    return [len(part) for part in parts]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Split a sharded annotations store or export its union.")
+    sub = parser.add_subparsers(dest='command', required=True)
+    split = sub.add_parser('split', help="split an annotations file into shard files")
+    split.add_argument('path')
+    split.add_argument('--shards', type=int, required=True)
+    export = sub.add_parser('export', help="write the union of a sharded store as one file")
+    export.add_argument('path', help="the store's base path, e.g. annotations.json")
+    export.add_argument('--shards', type=int, required=True)
+    export.add_argument('-o', '--output', required=True)
+    args = parser.parse_args(argv)
+
+    if args.command == 'split':
+        counts = split_store(args.path, args.shards)
+        print(f"Split {sum(counts)} entries of {args.path} into {len(counts)} shards: {counts}; "
+              f"the original is now {args.path}.pre-split")
+        return 0
+
+    entries = AnnotationStore(args.path, args.shards).read_all()
+    with open(args.output, 'w') as f:
+        json.dump(entries, f)
+    print(f"Wrote {len(entries)} entries from {args.shards} shards to {args.output}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,37 @@
+import argparse
+import sys
+
+from annotation_canonical import ERRORS, canonicalize_entries
+from annotation_store import AnnotationStore
+
+# Re-check annotations files against the canonical form of
+# annotation_canonical.py, and optionally rewrite them in it. Only the
+# problems in ERRORS make the check fail.
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check, and optionally canonicalise, annotation geometry and scale.")
+    parser.add_argument('files', nargs='+', help="annotations files (shard files of a sharded store are fine)")
+    parser.add_argument('--write', action='store_true', help="rewrite each file in canonical form, under its lock")
+    args = parser.parse_args(argv)
+
+    errors = 0
+    for path in args.files:
+        store = AnnotationStore(path)
+        if args.write:
+            with store.edit(0) as entries:
+                canonical, counts = canonicalize_entries(entries)
+                entries[:] = canonical
+        else:
+            canonical, counts = canonicalize_entries(store.read(0))
+        annotations = sum(len(e['annotations']) for e in canonical if isinstance(e, dict) and isinstance(e.get('annotations'), list))
+        found = ', '.join(f"{name} {count}" for name, count in sorted(counts.items()) if name in ERRORS) or 'no errors'
+        noted = ', '.join(f"{name} {count}" for name, count in sorted(counts.items()) if name not in ERRORS)
+        print(f"{path}: {annotations} annotations; {found}{f' (noted: {noted})' if noted else ''}"
+              f"{' (rewritten)' if args.write else ''}")
+        errors += sum(count for name, count in counts.items() if name in ERRORS)
+    return 1 if errors else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,248 @@
+import os
+import sys
+import json
+
+import numpy as np
+
+from annotation_canonical import parse_vec
+
+
+def _codes(values):
+    """Dictionary-encode strings; empty/missing values get code -1."""
+    table = {}
+    codes = np.full(len(values), -1, dtype=np.int32)
+    for i, v in enumerate(values):
+        if v:
+            codes[i] = table.setdefault(v, len(table))
+    return codes, list(table)
+
+
+def load_annotation_arrays(merged):
+    """Flatten merged annotations into NumPy arrays, one row per face box.
+
+    `merged` is the parsed annotations_merged.json list (or a raw store file).
+    The annotator is the entry's session uid when it has one, else the
+    annotation's annotator_id from --tag-annotator. Boxes are rectified
+    (negative width/height from right-to-left drags) and stored as x1,y1,x2,y2.
+    Annotations without a usable bbox are skipped. Returns a dict of arrays
+    plus the image and annotator tables their integer ids index into.
+    """
+    image_ids, annotator_ids, boxes, gazes, targets, distances = [], [], [], [], [], []
+    images, annotators = {}, {}
+    for entry in merged:
+        if not isinstance(entry, dict):
+            continue
+        for ann in entry.get('annotations') or []:
+            if not isinstance(ann, dict):
+                continue
+            bbox = parse_vec(ann.get('bbox'), 4)
+            if bbox is None:
+                continue
+            gaze = parse_vec(ann.get('gaze'), 2) or [np.nan, np.nan]
+            image_path = ann.get('image_path') or entry.get('image_path') or '__unknown__'
+            annotator = entry.get('uid') or ann.get('annotator_id') or '__unknown__'
+            image_ids.append(images.setdefault(image_path, len(images)))
+            annotator_ids.append(annotators.setdefault(annotator, len(annotators)))
+            boxes.append(bbox)
+            gazes.append(gaze)
+            targets.append(ann.get('target_type') or '')
+            distances.append(ann.get('farther_closer') or '')
+
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+    x1 = np.minimum(boxes[:, 0], boxes[:, 0] + boxes[:, 2])
+    y1 = np.minimum(boxes[:, 1], boxes[:, 1] + boxes[:, 3])
+    xyxy = np.stack([x1, y1, x1 + np.abs(boxes[:, 2]), y1 + np.abs(boxes[:, 3])], axis=1)
+    target_codes, target_table = _codes(targets)
+    distance_codes, distance_table = _codes(distances)
+    return {
+        'image': np.asarray(image_ids, dtype=np.int64),
+        'annotator': np.asarray(annotator_ids, dtype=np.int64),
+        'bbox': xyxy,
+        'gaze': np.asarray(gazes, dtype=np.float64).reshape(-1, 2),
+        'target_type': target_codes,
+        'farther_closer': distance_codes,
+        'images': list(images),
+        'annotators': list(annotators),
+        'target_types': target_table,
+        'farther_closer_values': distance_table,
+    }
+
+
+def candidate_pairs(image, annotator):
+    """All (i, j), i < j, of boxes on the same image from different annotators."""
+    order = np.argsort(image, kind='stable')
+    img = image[order]
+    n = len(img)
+    if n < 2:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    # Position of the end of each row's image group
+    group_end = np.searchsorted(img, img, side='right')
+    counts = group_end - np.arange(n) - 1
+    total = int(counts.sum())
+    first = np.repeat(np.arange(n), counts)
+    offsets = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+    second = first + 1 + offsets
+    i, j = order[first], order[second]
+    keep = annotator[i] != annotator[j]
+    return i[keep], j[keep]
+
+
+def box_iou(a, b):
+    """Row-wise IoU of two (n, 4) x1,y1,x2,y2 arrays."""
+    iw = np.clip(np.minimum(a[:, 2], b[:, 2]) - np.maximum(a[:, 0], b[:, 0]), 0, None)
+    ih = np.clip(np.minimum(a[:, 3], b[:, 3]) - np.maximum(a[:, 1], b[:, 1]), 0, None)
+    inter = iw * ih
+    union = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1]) + (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1]) - inter
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(union > 0, inter / union, 0.0)
+
+
+def _best_per_group(keys, scores):
+    """Boolean mask selecting the highest-scoring row of each key."""
+    order = np.lexsort((-scores, keys))
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = keys[order][1:] != keys[order][:-1]
+    mask = np.zeros(len(keys), dtype=bool)
+    mask[order[first]] = True
+    return mask
+
+
+def match_boxes(arrays, iou_threshold=0.5):
+    """One-to-one face matching across annotators of the same image.
+
+    A pair is matched when each box is the other's best-IoU box among that
+    annotator's boxes on the image (mutual best match) and the IoU reaches
+    iou_threshold. Returns (i, j, iou) for matched pairs.
+    """
+    i, j = candidate_pairs(arrays['image'], arrays['annotator'])
+    iou = box_iou(arrays['bbox'][i], arrays['bbox'][j])
+    n_annotators = max(len(arrays['annotators']), 1)
+    # candidate_pairs gives each pair once, in either orientation, so take
+    # each box's best partner per other annotator over both orientations
+    src = np.concatenate([i, j])
+    dst = np.concatenate([j, i])
+    best = _best_per_group(src * n_annotators + arrays['annotator'][dst], np.concatenate([iou, iou]))
+    n = len(i)
+    keep = best[:n] & best[n:] & (iou >= iou_threshold)
+    return i[keep], j[keep], iou[keep]
+
+
+def pair_metrics(arrays, i, j):
+    """Gaze distance, angular error and categorical agreement for matched pairs."""
+    bbox, gaze = arrays['bbox'], arrays['gaze']
+    gaze_l2 = np.linalg.norm(gaze[i] - gaze[j], axis=1)
+    # Gaze direction from the face box centre to the gaze point
+    centre = (bbox[:, :2] + bbox[:, 2:]) / 2
+    vi = gaze[i] - centre[i]
+    vj = gaze[j] - centre[j]
+    cross = vi[:, 0] * vj[:, 1] - vi[:, 1] * vj[:, 0]
+    dot = (vi * vj).sum(axis=1)
+    angle = np.degrees(np.abs(np.arctan2(cross, dot)))
+
+    def agreement(codes):
+        a, b = codes[i], codes[j]
+        valid = (a >= 0) & (b >= 0)
+        return np.where(valid, (a == b).astype(np.float64), np.nan)
+
+    return {
+        'gaze_l2': gaze_l2,
+        'angular_error_deg': angle,
+        'target_type_agree': agreement(arrays['target_type']),
+        'farther_closer_agree': agreement(arrays['farther_closer']),
+    }
+
+
+def _nanmean(values):
+    values = values[~np.isnan(values)]
+    return float(values.mean()) if len(values) else None
+
+
+def _grouped_nanmean(groups, values, n_groups):
+    valid = ~np.isnan(values)
+    sums = np.bincount(groups[valid], weights=values[valid], minlength=n_groups)
+    counts = np.bincount(groups[valid], minlength=n_groups)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(counts > 0, sums / counts, np.nan)
+
+
+def agreement_report(merged, iou_threshold=0.5):
+    """Compute overall and per-annotator agreement for a merged annotations list."""
+    arrays = load_annotation_arrays(merged)
+    i, j, iou = match_boxes(arrays, iou_threshold=iou_threshold)
+    metrics = pair_metrics(arrays, i, j)
+    metrics['iou'] = iou
+
+    annotators = arrays['annotators']
+    n_annotators = len(annotators)
+    # Each matched pair counts once for both of its annotators
+    who = np.concatenate([arrays['annotator'][i], arrays['annotator'][j]])
+    per_annotator = {name: np.concatenate([v, v]) for name, v in metrics.items()}
+    boxes_per_annotator = np.bincount(arrays['annotator'], minlength=n_annotators)
+    matched = np.zeros(len(arrays['image']), dtype=bool)
+    matched[i] = True
+    matched[j] = True
+    matched_per_annotator = np.bincount(arrays['annotator'], weights=matched, minlength=n_annotators)
+    means = {name: _grouped_nanmean(who, v, n_annotators) for name, v in per_annotator.items()}
+
+    def clean(v):
+        return None if np.isnan(v) else float(v)
+
+    report = {
+        'iou_threshold': iou_threshold,
+        'images': len(arrays['images']),
+        'annotators': n_annotators,
+        'boxes': int(len(arrays['image'])),
+        'matched_pairs': int(len(i)),
+        'overall': {name: _nanmean(v) for name, v in metrics.items()},
+        'per_annotator': {},
+    }
+    for a, name in enumerate(annotators):
+        report['per_annotator'][name] = {
+            'boxes': int(boxes_per_annotator[a]),
+            'matched_fraction': float(matched_per_annotator[a] / boxes_per_annotator[a]) if boxes_per_annotator[a] else None,
+            **{metric: clean(means[metric][a]) for metric in metrics},
+        }
+    return report
+
+
+def main():
+    if len(sys.argv) < 2:
+        print("Usage: python annotator_agreement.py <annotations_merged.json> [report.json] [--iou=0.5]")
+        print("Run merge_annotations.py with --tag-annotator first so annotations carry annotator_id "
+              "(the uid saved with each entry, else the input file name).")
+        return 1
+
+    input_file = sys.argv[1]
+    output_file = sys.argv[2] if len(sys.argv) >= 3 and not sys.argv[2].startswith('--') else None
+    iou_threshold = 0.5
+    for a in sys.argv[2:]:
+        if a.startswith('--iou='):
+            iou_threshold = float(a[len('--iou='):])
+
+    try:
+        with open(input_file, 'r') as f:
+            merged = json.load(f)
+    except Exception as e:
+        print(f"Failed to load {input_file}: {e}")
+        return 1
+
+    report = agreement_report(merged, iou_threshold=iou_threshold)
+    print(f"{report['images']} images, {report['annotators']} annotators, {report['boxes']} boxes, "
+          f"{report['matched_pairs']} matched pairs (IoU >= {iou_threshold})")
+    for name, value in report['overall'].items():
+        print(f"  {name}: {value if value is None else round(value, 4)}")
+    if '__unknown__' in report['per_annotator']:
+        print("Warning: some annotations have no uid or annotator_id; merge with --tag-annotator.")
+    for annotator, scores in sorted(report['per_annotator'].items()):
+        summary = ', '.join(f"{k}={'-' if v is None else round(v, 3)}" for k, v in scores.items())
+        print(f"  {annotator}: {summary}")
+
+    if output_file:
+        with open(output_file, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Wrote agreement report to {os.path.abspath(output_file)}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
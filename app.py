@@ -1,13 +1,32 @@
-from flask import Flask, request, redirect, url_for, render_template_string, send_file, abort, session, jsonify
+from flask import Flask, Blueprint, Response, request, redirect, url_for, render_template_string, send_file, abort, session, jsonify, stream_with_context
+import atexit
+import contextlib
+import copy
+import functools
+import hmac
 import json
 import random
 import os
+import threading
 from PIL import Image
 import time
-import portalocker
-
-app = Flask(__name__)
-app.secret_key = 'your-secret-key-for-sessions'  # Required for sessions
+from urllib.parse import quote
+from werkzeug.wsgi import wrap_file
+from annotation_query import QUERY_FIELDS, AnnotationIndex
+from annotation_stats import AnnotationStats
+from annotation_canonical import ERRORS, canonicalize
+from annotation_store import AnnotationStore, StoreTracker
+from assignment_scheduler import CoverageScheduler
+from audit_images import load_audit_results
+from clip_tracks import frame_of, interpolate_clip, order_by_clip
+from gaze_suggestions import SuggestionService
+from image_pack import DEFAULT_PACK_NAME, ImagePack
+from image_resolver import build_vat_index, is_gazefollow_path, resolve_merged_path
+from progress_store import AnnotatorKeys, ProgressStore, valid_uid
+from snapshots import DEFAULT_KEEP, default_snapshot_dir, list_snapshots, take_snapshot
+from telemetry import TelemetryAggregator
+
+bp = Blueprint('annotator', __name__)
 
 # Avoid storing large objects in the cookie-based session.
 # Keep per-user image assignments in server memory keyed by a tiny uid.
@@ -16,24 +35,111 @@ USER_IMAGE_ASSIGNMENTS = {}
 # Configuration for images per user
 IMAGES_PER_USER = 500  # Fixed set: show same 500 images to all users
 
-# Load JSON file with all available images
-json_path = os.path.abspath('combined_gazefollow_vat.json')
-try:
-    with open(json_path, 'r') as f:
-        all_images = json.load(f)
-    print(f"Loaded {len(all_images)} total entries from {json_path}")
-    if not all_images:
-        print("Warning: JSON is empty or no entries loaded.")
-except Exception as e:
-    print(f"Error loading JSON: {e}")
-    all_images = []
-
-# Merged images base (serve only these 500 images)
+# Image assignment: 'fixed' gives every user the same first IMAGES_PER_USER
+# images; 'coverage' leases batches of the least-annotated images until each
+# has ANNOTATIONS_PER_IMAGE annotations (see assignment_scheduler.py); 'clip'
+# is the fixed set with VAT frames grouped by clip (see clip_tracks.py).
+ASSIGNMENT_MODE = os.environ.get('ASSIGNMENT_MODE', 'fixed')
+ANNOTATIONS_PER_IMAGE = int(os.environ.get('ANNOTATIONS_PER_IMAGE', 3))
+LEASE_SECONDS = int(os.environ.get('LEASE_SECONDS', 1800))
+LEASE_BATCH = int(os.environ.get('LEASE_BATCH', 20))
+USER_IMAGE_IDS = {}  # coverage mode: uid -> scheduler image ids parallel to USER_IMAGE_ASSIGNMENTS[uid]
+
 project_root = os.path.abspath(os.path.dirname(__file__))
+
+# Dataset state. Nothing here is loaded at import time: create_app() loads it
+# eagerly (the gunicorn master does this once with preload_app, so forked
+# workers share it copy-on-write) or ensure_dataset_state() loads it lazily on
+# first use. Treat it as read-only once loaded.
+json_path = os.path.join(project_root, 'combined_gazefollow_vat.json')
 # Allow overriding merged images root via environment (useful for deployment with mounted volumes)
 merged_root = os.environ.get('MERGED_ROOT', os.path.join(project_root, 'merged_images'))
 merged_gf_root = os.path.join(merged_root, 'gazefollow')
 merged_vat_root = os.path.join(merged_root, 'vat')
+# JSON file for storing annotations (configurable via env)
+# Set ANNOTATIONS_PATH to a persistent location in production, e.g., /var/data/annotations.json
+annotations_file = os.environ.get('ANNOTATIONS_PATH', os.path.join(project_root, 'annotations.json'))
+# Split the store into this many files, each with its own lock (see annotation_store.py)
+ANNOTATION_SHARDS = int(os.environ.get('ANNOTATION_SHARDS', 1))
+annotation_store = AnnotationStore(annotations_file, ANNOTATION_SHARDS)
+# Backups of the store (see snapshots.py); SNAPSHOT_DIR defaults to snapshots/ next to it.
+# /api/snapshots needs `Authorization: Bearer <SNAPSHOT_TOKEN>` and is disabled without a token.
+SNAPSHOT_DIR = os.environ.get('SNAPSHOT_DIR')
+SNAPSHOT_KEEP = int(os.environ.get('SNAPSHOT_KEEP', DEFAULT_KEEP))
+SNAPSHOT_TOKEN = os.environ.get('SNAPSHOT_TOKEN', '')
+# /stats, /api/stats, /api/annotations and GET /api/telemetry show every annotator's
+# work; they need ADMIN_TOKEN (Bearer, or as the Basic auth password) and are disabled without it.
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN', '')
+# How image files leave the app: '' sends them from Python (with byte ranges);
+# 'x-accel' (nginx) or 'x-sendfile' (Apache, lighttpd) only resolve the file and
+# hand it to the fronting server. IMAGE_ACCEL_PREFIX is nginx's internal location for MERGED_ROOT.
+IMAGE_OFFLOAD = os.environ.get('IMAGE_OFFLOAD', '').strip().lower()
+IMAGE_ACCEL_PREFIX = os.environ.get('IMAGE_ACCEL_PREFIX', '/_images/')
+# Optional single-file image store (see image_pack.py); used instead of merged_images files when present
+image_pack_path = os.environ.get('IMAGE_PACK') or os.path.join(merged_root, DEFAULT_PACK_NAME)
+
+all_images = []
+gf_set, vat_set = set(), set()
+vat_index = {}
+audit_results = {}  # full image path -> (size, mtime_ns, error) from audit_images.py
+image_pack = None
+image_file_index = {}  # dataset path -> (full path, size, mtime_ns) of the file as last verified
+available_images = []
+available_paths = set()  # dataset paths of available_images
+_dataset_loaded = False
+_dataset_lock = threading.Lock()
+
+
+def configure_paths(dataset_json=None, merged=None, annotations=None, pack=None):
+    """Override dataset, merged image, annotation and image pack paths.
+
+    If this changes any of them (or the shard count), state loaded from the
+    old paths is dropped, so the next use loads it from the new ones.
+    """
+    global json_path, merged_root, merged_gf_root, merged_vat_root, annotations_file, image_pack_path, annotation_store
+    before = (json_path, merged_root, image_pack_path, annotation_store.path, annotation_store.shards)
+    if dataset_json:
+        json_path = os.path.abspath(dataset_json)
+    if merged:
+        merged_root = merged
+        merged_gf_root = os.path.join(merged_root, 'gazefollow')
+        merged_vat_root = os.path.join(merged_root, 'vat')
+        if not os.environ.get('IMAGE_PACK'):
+            image_pack_path = os.path.join(merged_root, DEFAULT_PACK_NAME)
+    if annotations:
+        annotations_file = annotations
+    if pack:
+        image_pack_path = pack
+    annotation_store = AnnotationStore(annotations_file, ANNOTATION_SHARDS)
+    if before != (json_path, merged_root, image_pack_path, annotation_store.path, annotation_store.shards):
+        reset_dataset_state()
+
+
+def open_image_pack():
+    if not os.path.exists(image_pack_path):
+        return None
+    try:
+        pack = ImagePack(image_pack_path)
+        print(f"Serving {len(pack)} images from pack {image_pack_path}")
+        return pack
+    except Exception as e:
+        print(f"Warning: could not open image pack {image_pack_path}: {e}")
+        return None
+
+
+def load_all_images():
+    """Load JSON file with all available images."""
+    try:
+        with open(json_path, 'r') as f:
+            images = json.load(f)
+        print(f"Loaded {len(images)} total entries from {json_path}")
+        if not images:
+            print("Warning: JSON is empty or no entries loaded.")
+    except Exception as e:
+        print(f"Error loading JSON: {e}")
+        images = []
+    return images
+
 
 def collect_merged_sets():
     """Collect available merged image identifiers for filtering.
@@ -57,93 +163,396 @@ def collect_merged_sets():
         print(f"Warning: failed to scan merged VAT: {e}")
     return gf_rel_paths, vat_basenames
 
-gf_set, vat_set = collect_merged_sets()
-available_images = []
-if all_images:
-    for item in all_images:
-        p = item.get('path', '')
-        if isinstance(p, str) and (p.startswith('train/') or p.startswith('test2/')):
-            if p in gf_set:
-                available_images.append(item)
-        else:
-            fname = os.path.basename(p)
-            if fname in vat_set:
-                available_images.append(item)
-    print(f"Filtered to {len(available_images)} images available in merged_images (GF set={len(gf_set)}, VAT set={len(vat_set)})")
-else:
-    print("No all_images loaded; available_images remains empty.")
 
-# JSON file for storing annotations (configurable via env)
-# Set ANNOTATIONS_PATH to a persistent location in production, e.g., /var/data/annotations.json
-annotations_file = os.environ.get('ANNOTATIONS_PATH', os.path.join(project_root, 'annotations.json'))
+def filter_available_images(images, gf_rel_paths, vat_basenames):
+    """Keep only dataset entries whose image exists in merged_images (serve only these 500 images)."""
+    available = []
+    if images:
+        for item in images:
+            p = item.get('path', '')
+            if isinstance(p, str) and (p.startswith('train/') or p.startswith('test2/')):
+                if p in gf_rel_paths:
+                    available.append(item)
+            else:
+                fname = os.path.basename(p)
+                if fname in vat_basenames:
+                    available.append(item)
+        print(f"Filtered to {len(available)} images available in merged_images (GF set={len(gf_rel_paths)}, VAT set={len(vat_basenames)})")
+    else:
+        print("No all_images loaded; available_images remains empty.")
+    return available
+
 
-# Ensure directory exists if a nested path is used
-annotations_dir = os.path.dirname(annotations_file)
-if annotations_dir and not os.path.exists(annotations_dir):
+def check_annotations_layout():
+    """Raise RuntimeError if the files on disk use a different shard count
+    (e.g. an unsplit annotations.json with ANNOTATION_SHARDS > 1). Writes nothing."""
     try:
-        os.makedirs(annotations_dir, exist_ok=True)
-    except Exception as e:
-        print(f"Warning: could not create annotations directory '{annotations_dir}': {e}")
+        annotation_store.check_layout()
+    except ValueError as e:
+        raise RuntimeError(f"Refusing to use the annotations store: {e}") from e
 
-# Initialize file if missing
-if not os.path.exists(annotations_file):
+
+def init_annotations_file():
+    """Create the annotations file(s) (and their directory) if missing, once the layout checks out."""
+    check_annotations_layout()
     try:
-        with open(annotations_file, 'w') as f:
-            json.dump([], f)
+        annotation_store.init_files()
     except Exception as e:
         print(f"Warning: could not initialize annotations file '{annotations_file}': {e}")
 
-def get_next_available_index():
-    """Get the next available index for annotations.json under a lock."""
+
+def init_dataset_state():
+    """Load the dataset JSON, scan merged_images and prepare the annotations file."""
+    global all_images, gf_set, vat_set, vat_index, audit_results, image_pack, available_images, available_paths
+    global _dataset_loaded
+    with _dataset_lock:
+        if _dataset_loaded:
+            return
+        all_images = load_all_images()
+        vat_index = build_vat_index(merged_vat_root)
+        image_pack = open_image_pack()
+        if image_pack is not None:
+            available_images = [item for item in all_images if item.get('path') in image_pack]
+            print(f"Filtered to {len(available_images)} images available in the image pack")
+        else:
+            gf_set, vat_set = collect_merged_sets()
+            audit_results = load_audit_results(merged_root)
+            if audit_results:
+                print(f"Loaded audit results for {len(audit_results)} images")
+            available_images = filter_available_images(all_images, gf_set, vat_set)
+        available_paths = {item.get('path') for item in available_images}
+        init_annotations_file()
+        _dataset_loaded = True
+
+
+def ensure_dataset_state():
+    """Lazily load dataset state on first use."""
+    if not _dataset_loaded:
+        init_dataset_state()
+
+
+def reset_dataset_state():
+    """Drop the loaded dataset and everything derived from it (assignments, scheduler, clip order, stats, query index)."""
+    global all_images, gf_set, vat_set, vat_index, audit_results, image_pack, available_images, available_paths
+    global _dataset_loaded, scheduler, scheduled_images, clip_images, clip_ranges, clip_group_of, collection_stats, query_index
+    with _dataset_lock:
+        all_images, available_images, available_paths = [], [], set()
+        gf_set, vat_set = set(), set()
+        vat_index, audit_results = {}, {}
+        image_pack = None
+        image_file_index.clear()
+        USER_IMAGE_ASSIGNMENTS.clear()
+        USER_IMAGE_IDS.clear()
+        scheduler, scheduled_images = None, []
+        clip_images, clip_ranges, clip_group_of = [], [], []
+        collection_stats = None
+        query_index = None
+        _dataset_loaded = False
+
+
+# Optional model-based gaze suggestions (see gaze_suggestions.py)
+suggestion_service = None
+SUGGESTION_LOOKAHEAD = 5
+
+
+def init_suggestion_service(config):
+    """Set up the suggestion backend named by SUGGESTION_MODEL ('module:factory'), if any."""
+    global suggestion_service, SUGGESTION_LOOKAHEAD
+    model_spec = config.get('SUGGESTION_MODEL', os.environ.get('SUGGESTION_MODEL', '')).strip()
+    if not model_spec:
+        suggestion_service = None
+        return
+    cache_dir = config.get('SUGGESTION_CACHE_DIR') or os.environ.get('SUGGESTION_CACHE_DIR') or \
+        os.path.join(os.path.dirname(os.path.abspath(annotations_file)), 'suggestion_cache')
+    SUGGESTION_LOOKAHEAD = int(config.get('SUGGESTION_LOOKAHEAD', os.environ.get('SUGGESTION_LOOKAHEAD', 5)))
+    suggestion_service = SuggestionService(
+        model_spec, cache_dir,
+        workers=int(config.get('SUGGESTION_WORKERS', os.environ.get('SUGGESTION_WORKERS', 1))),
+        wait=float(config.get('SUGGESTION_WAIT', os.environ.get('SUGGESTION_WAIT', 0.05))),
+    )
+    print(f"Gaze suggestions from model {model_spec} (cache: {cache_dir})")
+
+
+def prefetch_suggestions(user_images, index):
+    """Queue model suggestions for image `index` and the SUGGESTION_LOOKAHEAD images after it."""
+    if suggestion_service is None:
+        return
+    upcoming = user_images[index:index + 1 + SUGGESTION_LOOKAHEAD]
+    suggestion_service.prefetch(
+        p for p in (resolve_merged_path(it.get('path'), merged_root, vat_index) for it in upcoming) if p)
+
+
+# Coverage scheduling state, built on first use in coverage mode
+scheduler = None
+scheduled_images = []  # one dataset entry per distinct image path; scheduler ids index this
+_scheduler_lock = threading.Lock()
+
+
+def _iter_stored_entries(keyed=False):
+    """All stored entries (as (key, entry) pairs with keyed=True), across shards."""
     try:
-        with portalocker.Lock(annotations_file, 'r+', timeout=10) as f:
-            f.seek(0)
-            try:
-                data = json.load(f)
-            except Exception:
-                data = []
-            max_index = -1
-            for entry in data:
-                if 'index' in entry:
-                    try:
-                        max_index = max(max_index, int(entry['index']))
-                    except Exception:
-                        pass
-            return max_index + 1
+        items = list(annotation_store.iter_keyed())
     except Exception as e:
-        print(f"Error getting next index: {e}")
-        return 0
+        print(f"Warning: could not read existing annotations: {e}")
+        return []
+    return items if keyed else [entry for _, entry in items]
+
+
+def ensure_scheduler():
+    """Create the coverage scheduler, seeding counts from the annotations already stored."""
+    global scheduler, scheduled_images
+    if scheduler is not None:
+        return scheduler
+    ensure_dataset_state()
+    with _scheduler_lock:
+        if scheduler is not None:
+            return scheduler
+        ids_by_path = {}
+        images = []
+        for item in available_images:
+            if item.get('path') not in ids_by_path:
+                ids_by_path[item.get('path')] = len(images)
+                images.append(item)
+        new_scheduler = CoverageScheduler(len(images), target=ANNOTATIONS_PER_IMAGE, lease_seconds=LEASE_SECONDS)
+        seeded = 0
+        for entry in _iter_stored_entries():
+            anns = entry.get('annotations') if isinstance(entry, dict) else None
+            if not anns or not isinstance(anns[0], dict):
+                continue
+            image_id = ids_by_path.get(anns[0].get('image_path'))
+            if image_id is not None:
+                seeded += new_scheduler.record_existing(image_id, uid=entry.get('uid'))
+        scheduled_images = images
+        scheduler = new_scheduler
+        print(f"Coverage scheduler: {len(images)} images, target {ANNOTATIONS_PER_IMAGE} each, {seeded} existing annotations counted")
+    return scheduler
+
+
+def extend_user_images(uid):
+    """Lease another batch for uid in coverage mode; returns how many images were added."""
+    sched = ensure_scheduler()
+    ids = USER_IMAGE_IDS.setdefault(uid, [])
+    images = USER_IMAGE_ASSIGNMENTS.setdefault(uid, [])
+    leased = sched.lease(uid, LEASE_BATCH, exclude=set(ids))
+    ids.extend(leased)
+    images.extend(scheduled_images[i] for i in leased)
+    if leased:
+        print(f"Leased {len(leased)} images to user uid={uid} (coverage target {ANNOTATIONS_PER_IMAGE})")
+    return len(leased)
+
+
+# Clip mode: the fixed set reordered by clip, shared by all users
+clip_images = []
+clip_ranges = []  # (start, end) of each clip in clip_images
+clip_group_of = []  # clip_images index -> position in clip_ranges
+_clip_lock = threading.Lock()
+
+
+def ensure_clip_order():
+    global clip_images, clip_ranges, clip_group_of
+    if clip_images:
+        return clip_images
+    ensure_dataset_state()
+    with _clip_lock:
+        if not clip_images:
+            ordered, ranges = order_by_clip(available_images[:IMAGES_PER_USER], image_file_path, merged_root)
+            clip_group_of = [group for group, (start, end) in enumerate(ranges) for _ in range(start, end)]
+            clip_ranges = ranges
+            clip_images = ordered
+            clips = sum(1 for start, end in ranges if end - start > 1)
+            print(f"Clip mode: {len(ordered)} images, {clips} clips of 2 or more frames")
+    return clip_images
+
+
+# Per-user completion bitmaps (see progress_store.py)
+progress = None
+annotator_keys = None
+
+
+def init_progress_store(config):
+    """Open the progress bitmaps of the current assignment mode and the /identify passphrases.
+
+    Slots mean list positions in fixed and clip mode (in different orders)
+    and scheduler image ids in coverage mode, so each mode other than fixed
+    keeps its bitmaps in a subdirectory of its own.
+    """
+    global progress, annotator_keys
+    progress_dir = config.get('PROGRESS_DIR') or os.environ.get('PROGRESS_DIR') or \
+        os.path.join(os.path.dirname(os.path.abspath(annotations_file)), 'progress')
+    progress = ProgressStore(progress_dir if ASSIGNMENT_MODE == 'fixed' else os.path.join(progress_dir, ASSIGNMENT_MODE))
+    annotator_keys = AnnotatorKeys(os.path.join(progress_dir, 'keys'))
+
+
+# Annotator timing beacons from the labelling page (see telemetry.py)
+telemetry = None
+TELEMETRY_BATCH = 10  # images per beacon sent by the page
+TELEMETRY_MAX_EVENTS = 200  # per POST
+
+
+def init_telemetry(config):
+    global telemetry, TELEMETRY_BATCH
+    telemetry_dir = config.get('TELEMETRY_DIR') or os.environ.get('TELEMETRY_DIR') or \
+        os.path.join(os.path.dirname(os.path.abspath(annotations_file)), 'telemetry')
+    TELEMETRY_BATCH = max(1, int(config.get('TELEMETRY_BATCH', os.environ.get('TELEMETRY_BATCH', TELEMETRY_BATCH))))
+    flush_seconds = float(config.get('TELEMETRY_FLUSH_SECONDS', os.environ.get('TELEMETRY_FLUSH_SECONDS', 60)))
+    flush_telemetry()
+    try:
+        telemetry = TelemetryAggregator(telemetry_dir, flush_seconds)
+    except OSError as e:
+        print(f"Warning: could not create telemetry directory '{telemetry_dir}': {e}")
+        telemetry = None
+
+
+def flush_telemetry():
+    if telemetry is not None:
+        telemetry.flush()
+
+
+# Registered once: create_app() may replace the aggregator many times
+atexit.register(flush_telemetry)
+
+
+# Running totals for /stats and secondary indexes for /api/annotations, both
+# seeded from the store and then updated on each save. Other workers save to
+# the same files, so reads check each shard's version: a shard changed in a way
+# this process did not apply itself is re-read on its own, and the entries the
+# query index held for it are subtracted from the totals before the new ones
+# are added. Only a full load (startup, or a different store) parses every shard.
+collection_stats = None
+query_index = None
+_views_tracker = None
+_views_lock = threading.Lock()
+
+
+def _refresh_views():
+    global collection_stats, query_index, _views_tracker
+    if _views_tracker is None or _views_tracker.store is not annotation_store:
+        _views_tracker = StoreTracker(annotation_store)
+        collection_stats = query_index = None
+    if collection_stats is None or query_index is None:
+        versions = annotation_store.versions()
+        items = _iter_stored_entries(keyed=True)
+        new_stats, new_index = AnnotationStats(), AnnotationIndex()
+        new_stats.seed(entry for _, entry in items)
+        new_index.seed(items)
+        _views_tracker.loaded(versions)
+        collection_stats, query_index = new_stats, new_index
+        print(f"Stats: {new_stats.annotations} annotations in {new_stats.entries} saved entries")
+        return
+    for shard in _views_tracker.stale_shards():
+        version = annotation_store.version(shard)
+        try:
+            entries = annotation_store.read(shard)
+        except Exception as e:
+            print(f"Warning: could not re-read annotations shard {shard}: {e}")
+            continue
+        items = [(annotation_store.key(shard, position), entry) for position, entry in enumerate(entries)]
+        old_entries = query_index.replace_shard(shard, annotation_store.shards, items)
+        collection_stats.replace_many(old_entries, entries)
+        _views_tracker.reloaded(shard, version)
+
+
+def _ensure_views(refresh):
+    stats, index = collection_stats, query_index
+    if stats is not None and index is not None and (not refresh or not _views_tracker.stale()):
+        return stats, index
+    with _views_lock:
+        _refresh_views()
+        return collection_stats, query_index
+
+
+def ensure_stats(refresh=True):
+    """The stats view; refresh=False (the save paths) skips the staleness check."""
+    return _ensure_views(refresh)[0]
+
+
+def ensure_query_index(refresh=True):
+    """The query index; refresh=False (the save paths) skips the staleness check."""
+    return _ensure_views(refresh)[1]
+
+
+def create_app(config=None):
+    """Application factory.
+
+    Recognised config keys (all optional): DATASET_JSON, MERGED_ROOT,
+    ANNOTATIONS_PATH, ANNOTATION_SHARDS, IMAGE_PACK, IMAGE_OFFLOAD, IMAGE_ACCEL_PREFIX, PRELOAD_DATASET, ASSIGNMENT_MODE, ANNOTATIONS_PER_IMAGE,
+    LEASE_SECONDS, LEASE_BATCH, PROGRESS_DIR, SNAPSHOT_DIR, SNAPSHOT_KEEP, SNAPSHOT_TOKEN, ADMIN_TOKEN and the SUGGESTION_* and TELEMETRY_* settings. With
+    PRELOAD_DATASET (the default) dataset state is loaded here; otherwise it
+    is loaded on the first request.
+    """
+    global ASSIGNMENT_MODE, ANNOTATIONS_PER_IMAGE, LEASE_SECONDS, LEASE_BATCH, ANNOTATION_SHARDS, SNAPSHOT_DIR, SNAPSHOT_KEEP, SNAPSHOT_TOKEN
+    global ADMIN_TOKEN
+    global IMAGE_OFFLOAD, IMAGE_ACCEL_PREFIX
+    config = dict(config or {})
+    IMAGE_OFFLOAD = str(config.get('IMAGE_OFFLOAD', IMAGE_OFFLOAD)).strip().lower()
+    IMAGE_ACCEL_PREFIX = config.get('IMAGE_ACCEL_PREFIX', IMAGE_ACCEL_PREFIX)
+    ANNOTATION_SHARDS = int(config.get('ANNOTATION_SHARDS', ANNOTATION_SHARDS))
+    SNAPSHOT_DIR = config.get('SNAPSHOT_DIR', SNAPSHOT_DIR)
+    SNAPSHOT_KEEP = int(config.get('SNAPSHOT_KEEP', SNAPSHOT_KEEP))
+    SNAPSHOT_TOKEN = config.get('SNAPSHOT_TOKEN', SNAPSHOT_TOKEN)
+    ADMIN_TOKEN = config.get('ADMIN_TOKEN', ADMIN_TOKEN)
+    previous_mode, ASSIGNMENT_MODE = ASSIGNMENT_MODE, config.get('ASSIGNMENT_MODE', ASSIGNMENT_MODE)
+    if ASSIGNMENT_MODE != previous_mode:
+        reset_dataset_state()  # user lists are built differently per mode
+    ANNOTATIONS_PER_IMAGE = int(config.get('ANNOTATIONS_PER_IMAGE', ANNOTATIONS_PER_IMAGE))
+    LEASE_SECONDS = int(config.get('LEASE_SECONDS', LEASE_SECONDS))
+    LEASE_BATCH = int(config.get('LEASE_BATCH', LEASE_BATCH))
+    if ASSIGNMENT_MODE == 'coverage' and int(os.environ.get('WEB_CONCURRENCY', '1')) > 1:
+        print("Warning: coverage mode keeps leases and assignments in process memory; "
+              "with WEB_CONCURRENCY > 1 each worker hands out its own leases")
+    app = Flask(__name__)
+    app.secret_key = 'your-secret-key-for-sessions'  # Required for sessions
+    app.config.update(config)
+
+    configure_paths(
+        dataset_json=config.get('DATASET_JSON'),
+        merged=config.get('MERGED_ROOT'),
+        annotations=config.get('ANNOTATIONS_PATH'),
+        pack=config.get('IMAGE_PACK'),
+    )
+    if config.get('PRELOAD_DATASET', True):
+        init_dataset_state()
+        if ASSIGNMENT_MODE == 'coverage':
+            ensure_scheduler()
+        elif ASSIGNMENT_MODE == 'clip':
+            ensure_clip_order()
+        ensure_stats()
+        ensure_query_index()
+    else:
+        # The store is created with the rest of the dataset state on the first request
+        check_annotations_layout()
+    init_progress_store(config)
+    init_telemetry(config)
+    init_suggestion_service(config)
+
+    app.register_blueprint(bp)
+    return app
+
+
+_app = None
+
+
+def __getattr__(name):
+    # Keep `gunicorn app:app` and `from app import app` working without
+    # paying the dataset load cost on a plain `import app`.
+    global _app
+    if name == 'app':
+        if _app is None:
+            _app = create_app()
+        return _app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 def reserve_annotation_index():
-    """Reserve and return a unique annotation index using an exclusive file lock."""
+    """Reserve and return a unique annotation index in the user's shard using an exclusive file lock.
+
+    Errors propagate: guessing an index without the lock would hand out one that is already taken.
+    """
+    uid = session.get('uid')
     try:
-        with portalocker.Lock(annotations_file, 'r+', timeout=10) as f:
-            f.seek(0)
-            try:
-                data = json.load(f)
-            except Exception:
-                data = []
-            max_index = -1
-            for entry in data:
-                if 'index' in entry:
-                    try:
-                        max_index = max(max_index, int(entry['index']))
-                    except Exception:
-                        pass
-            new_index = max_index + 1
-            data.append({'index': new_index, 'annotations': []})
-            f.seek(0)
-            f.truncate()
-            json.dump(data, f)
-            f.flush()
-            try:
-                os.fsync(f.fileno())
-            except Exception:
-                pass
-            return new_index
+        return annotation_store.reserve_index(uid)
     except Exception as e:
         print(f"Error reserving next index: {e}")
-        return get_next_available_index()
+        raise
 
 def _get_or_create_uid():
     uid = session.get('uid')
@@ -153,8 +562,15 @@ def _get_or_create_uid():
     return uid
 
 def get_user_images():
-    """Return the same fixed set of merged images to all users."""
+    """Return the user's image list: the same fixed set for all users, or leased batches in coverage mode."""
+    ensure_dataset_state()
     uid = _get_or_create_uid()
+    if ASSIGNMENT_MODE == 'coverage':
+        if uid not in USER_IMAGE_ASSIGNMENTS:
+            extend_user_images(uid)
+        return USER_IMAGE_ASSIGNMENTS[uid]
+    if ASSIGNMENT_MODE == 'clip':
+        return ensure_clip_order()
     user_images = USER_IMAGE_ASSIGNMENTS.get(uid)
     if not user_images:
         # Serve the filtered merged set. If more than IMAGES_PER_USER, trim deterministically.
@@ -171,8 +587,65 @@ def get_user_images():
         print(f"Assigned {len(user_images)} merged images to user uid={uid} (fixed set)")
     return USER_IMAGE_ASSIGNMENTS[uid]
 
+def _annotation_slot(index):
+    """Session key for the user's annotation entry of user image `index`.
+
+    In coverage mode the key is the scheduler image id, since a user's list
+    is rebuilt in a different order after a restart. Clip mode positions are
+    prefixed so they never reuse a fixed-mode slot.
+    """
+    if ASSIGNMENT_MODE == 'coverage':
+        return f"c{USER_IMAGE_IDS[session['uid']][index]}"
+    if ASSIGNMENT_MODE == 'clip':
+        return f"k{index}"
+    return str(index)
+
+def _progress_slot(uid, index):
+    """Bit in the user's progress bitmap for user image `index`."""
+    if ASSIGNMENT_MODE == 'coverage':
+        return USER_IMAGE_IDS[uid][index]
+    return index
+
+def resume_index(uid, user_images):
+    """Index of the first image in the user's list they have not submitted, or None."""
+    if ASSIGNMENT_MODE == 'coverage':
+        ids = USER_IMAGE_IDS.get(uid, [])
+        for position, image_id in enumerate(ids):
+            if not progress.is_done(uid, image_id):
+                return position
+        start = len(ids)
+        return start if extend_user_images(uid) else None
+    index = progress.first_incomplete(uid)
+    return index if index < len(user_images) else None
+
+def find_saved_index(uid, image_path):
+    """Annotation index of the entry uid already saved for image_path, or None."""
+    results, _ = ensure_query_index().query({'annotator': uid, 'image_path': image_path}, limit=10)
+    for result in results:
+        if result['uid'] == uid:
+            return result['index']
+    return None
+
+def get_annotation_index(index):
+    """Get or reserve the unique annotation index for this user's image.
+
+    When the session has no index for the image (a new cookie, or after
+    /identify), the entry this uid already saved for it is reused, so a
+    resubmit updates it instead of adding a duplicate.
+    """
+    if 'user_annotation_indices' not in session:
+        session['user_annotation_indices'] = {}
+    slot = _annotation_slot(index)
+    if slot not in session['user_annotation_indices']:
+        annotation_index = find_saved_index(session['uid'], get_user_images()[index].get('path'))
+        if annotation_index is None:
+            annotation_index = reserve_annotation_index()
+        session['user_annotation_indices'][slot] = annotation_index
+        session.modified = True  # nested dict changes are not tracked by the session
+    return session['user_annotation_indices'][slot]
+
 # API to save 3D gaze (camera coordinates) for a given image index
-@app.route('/api/save_gaze3d/<int:index>', methods=['POST'])
+@bp.route('/api/save_gaze3d/<int:index>', methods=['POST'])
 def save_gaze3d(index):
     try:
         user_images = get_user_images()
@@ -205,20 +678,12 @@ def save_gaze3d(index):
             gaze_number = None
 
         # Ensure an annotation index exists for this user's image
-        if 'user_annotation_indices' not in session:
-            session['user_annotation_indices'] = {}
-        if str(index) not in session['user_annotation_indices']:
-            session['user_annotation_indices'][str(index)] = reserve_annotation_index()
-        annotation_index = session['user_annotation_indices'][str(index)]
-
-        # Load and update annotations.json with exclusive lock
-        with portalocker.Lock(annotations_file, 'r+', timeout=10) as f:
-            f.seek(0)
-            try:
-                all_annotations = json.load(f)
-            except Exception:
-                all_annotations = []
+        annotation_index = get_annotation_index(index)
+        stats, queries = ensure_stats(refresh=False), ensure_query_index(refresh=False)
 
+        # Load and update the entry's annotations shard with exclusive lock
+        shard = annotation_store.shard_for_index(annotation_index)
+        with annotation_store.edit(shard) as all_annotations:
             existing_entry_idx = None
             for i, entry in enumerate(all_annotations):
                 if entry.get('index') == annotation_index:
@@ -231,6 +696,7 @@ def save_gaze3d(index):
                 existing_entry_idx = len(all_annotations) - 1
 
             entry = all_annotations[existing_entry_idx]
+            old_entry = copy.deepcopy(entry)
             if 'annotations' not in entry or not isinstance(entry['annotations'], list):
                 entry['annotations'] = []
 
@@ -248,22 +714,16 @@ def save_gaze3d(index):
                 if gaze_number is not None:
                     new_ann['gaze_number'] = gaze_number
                 entry['annotations'].append(new_ann)
-
-            f.seek(0)
-            f.truncate()
-            json.dump(all_annotations, f)
-            f.flush()
-            try:
-                os.fsync(f.fileno())
-            except Exception:
-                pass
+            entry['saved_at'] = int(time.time())
+        stats.replace(old_entry, entry)
+        queries.replace(annotation_store.key(shard, existing_entry_idx), entry)
 
         return jsonify({"status": "ok", "index": annotation_index, "annotation_idx": ann_idx, "gaze_3d": [X, Y, Z]})
     except Exception as e:
         print(f"save_gaze3d error: {e}")
         return jsonify({"error": str(e)}), 500
 
-@app.route('/api/gaze_suggest/<int:index>', methods=['GET'])
+@bp.route('/api/gaze_suggest/<int:index>', methods=['GET'])
 def gaze_suggest(index):
     """Return a best-effort gaze suggestion for the given image index.
     Uses existing dataset metadata (bbox/eye/gaze) and normalizes to [0,1].
@@ -277,9 +737,16 @@ def gaze_suggest(index):
             return jsonify({"error": "Index out of range or no data loaded"}), 400
 
         item = user_images[index]
-        full_path = resolve_image_full_path(index)
-        with Image.open(full_path) as img:
-            width, height = img.size
+        packed = image_pack.info(item.get('path')) if image_pack is not None else None
+        if packed:
+            # Size from the pack index; the loose file may not be deployed at all
+            width, height = packed['width'], packed['height']
+            full_path = image_file_path(item.get('path'))
+            full_path = full_path if os.path.exists(full_path) else None
+        else:
+            full_path = resolve_image_full_path(index)
+            with Image.open(full_path) as img:
+                width, height = img.size
 
         def rectify_bbox(x, y, w, h):
             # Ensure positive width/height; shift origin if needed
@@ -334,30 +801,34 @@ def gaze_suggest(index):
         bbox = normalize_bbox(item.get('bbox'), is_norm)
         eye = normalize_point(item.get('eye'), is_norm)
         gaze = normalize_point(item.get('gaze') or eye, is_norm)
+        source = "dataset"
+
+        if suggestion_service is not None and full_path:
+            # Model hint if cached or ready within the wait budget; otherwise keep the dataset values
+            suggestion = suggestion_service.get(full_path)
+            if suggestion:
+                bbox = suggestion.get('bbox', bbox)
+                gaze = suggestion.get('gaze', gaze)
+                eye = [bbox[0] + bbox[2] / 2, bbox[1] + bbox[3] / 2]
+                source = "model"
+            prefetch_suggestions(user_images, index)
 
         return jsonify({
             "index": index,
             "bbox": bbox,
             "eye": eye,
             "gaze": gaze,
-            "source": "dataset"
+            "source": source
         })
     except Exception as e:
         print(f"gaze_suggest error: {e}")
         return jsonify({"error": str(e)}), 500
 
-def find_image_file(base_dir, filename):
-    """Recursively search for filename (with or without .jpg) in base_dir."""
-    print(f"Starting fallback search for {filename} in {base_dir}")
-    base_name = os.path.splitext(filename)[0]  # Strip .jpg if double extension
-    for root, dirs, files in os.walk(base_dir):
-        for file in files:
-            if file == filename or os.path.splitext(file)[0] == base_name:
-                full_path = os.path.join(root, file)
-                print(f"Found image at fallback path: {full_path}")
-                return full_path
-    print(f"Failed to find {filename} or {base_name} in {base_dir}")
-    return None
+def image_file_path(path):
+    """Full path of a dataset image under merged_root (as recorded in the pack, if one is loaded)."""
+    if image_pack is not None and path in image_pack:
+        return os.path.join(merged_root, image_pack.info(path)['file'])
+    return resolve_merged_path(path, merged_root, vat_index)
 
 def resolve_image_full_path(index):
     """Resolve and verify full image path for a user image index from merged_images."""
@@ -367,22 +838,24 @@ def resolve_image_full_path(index):
 
     item = user_images[index]
     filename = os.path.basename(item['path'])
-    base_name = os.path.splitext(filename)[0]
     print(f"Resolving merged image path for index {index}: {item['path']}")
 
-    if item['path'].startswith('test2/') or item['path'].startswith('train/'):
-        # GazeFollow in merged set
-        full_path = os.path.join(merged_gf_root, item['path'].replace('/', os.sep))
-        print(f"Merged GazeFollow path attempt: {full_path}")
-    else:
-        # VAT in merged set: find by filename under merged_vat_root
-        full_path = find_image_file(merged_vat_root, filename) or find_image_file(merged_vat_root, base_name + '.jpg')
-        print(f"Merged VAT search result: {full_path}")
+    full_path = resolve_merged_path(item['path'], merged_root, vat_index)
+    print(f"Merged {'GazeFollow' if is_gazefollow_path(item['path']) else 'VAT'} path: {full_path}")
 
-    if not full_path or not os.path.exists(full_path):
+    try:
+        st = os.stat(full_path) if full_path else None
+    except OSError:
+        st = None
+    if st is None:
         raise FileNotFoundError(f"Image not found in merged set: {filename}")
 
-    # Verify image integrity (optional)
+    # Trust the last audit for files unchanged since then; verify the rest here
+    audited = audit_results.get(os.path.normpath(full_path))
+    if audited and audited[:2] == (st.st_size, st.st_mtime_ns):
+        if audited[2]:
+            raise RuntimeError(f"Invalid image file: {full_path}, error: {audited[2]}")
+        return full_path
     try:
         with Image.open(full_path) as img:
             print(f"Image verified: {full_path}, size={img.size}")
@@ -392,30 +865,346 @@ def resolve_image_full_path(index):
     return full_path
 
 # Route to serve images with detailed debugging (from merged_images)
-@app.route('/images/<int:index>')
+def image_source(index):
+    """Where a user image is read from: ('pack', key) if the image pack has it, else ('file', full path).
+
+    Files are resolved and verified once and recorded in image_file_index with
+    their size and mtime, like the audit results; later requests only stat the
+    file, and a file that changed or vanished is resolved and verified again.
+    """
+    user_images = get_user_images()
+    key = user_images[index].get('path') if 0 <= index < len(user_images) else None
+    if image_pack is not None and key in image_pack:
+        return 'pack', key
+    known = image_file_index.get(key)
+    if known is not None:
+        try:
+            st = os.stat(known[0])
+        except OSError:
+            st = None
+        if st is not None and (st.st_size, st.st_mtime_ns) == known[1:]:
+            return 'file', known[0]
+        image_file_index.pop(key, None)
+    full_path = resolve_image_full_path(index)
+    try:
+        st = os.stat(full_path)
+    except OSError:
+        return 'file', full_path
+    image_file_index[key] = (full_path, st.st_size, st.st_mtime_ns)
+    return 'file', full_path
+
+def forget_image_file(full_path):
+    """Drop a file that has gone missing from image_file_index so it is resolved again."""
+    for key, known in list(image_file_index.items()):
+        if known[0] == full_path:
+            image_file_index.pop(key, None)
+
+def offload_headers(full_path):
+    """X-Accel-Redirect / X-Sendfile header for an image file, or None to send it from Python."""
+    if IMAGE_OFFLOAD == 'x-sendfile':
+        return {'X-Sendfile': full_path}
+    if IMAGE_OFFLOAD == 'x-accel':
+        rel_path = os.path.relpath(full_path, merged_root)
+        if not rel_path.startswith('..'):
+            return {'X-Accel-Redirect': IMAGE_ACCEL_PREFIX.rstrip('/') + '/' + quote(rel_path.replace(os.sep, '/'))}
+    return None
+
+@bp.route('/images/<int:index>')
 def serve_image(index):
     try:
-        full_path = resolve_image_full_path(index)
+        kind, source = image_source(index)
     except Exception as e:
         print(f"serve_image error: {e}")
         abort(400, description=str(e))
-    print(f"Serving image: {full_path}")
-    return send_file(full_path, mimetype='image/jpeg')
+    if kind == 'pack':
+        info = image_pack.info(source)
+        # Stream the slice of the mapping rather than copying the whole image out of it
+        response = Response(wrap_file(request.environ, image_pack.open(source)), mimetype='image/jpeg',
+                            direct_passthrough=True)
+        response.content_length = info['length']
+        response.set_etag(info['sha256'])
+        response.headers['Accept-Ranges'] = 'bytes'
+        return response.make_conditional(request, accept_ranges=True, complete_length=info['length'])
+    offload = offload_headers(source)
+    if offload:
+        return Response(headers=offload, mimetype='image/jpeg')
+    try:
+        # send_file answers conditional and Range requests itself
+        response = send_file(source, mimetype='image/jpeg')
+        response.headers['Accept-Ranges'] = 'bytes'
+        return response
+    except FileNotFoundError:
+        forget_image_file(source)
+        abort(404)
 
 # VGGT API endpoints removed
 
-@app.route('/')
+@bp.route('/api/save_clip/<int:start>', methods=['POST'])
+def save_clip(start):
+    """Save every frame of a clip in one write; skipped (null) frames are interpolated.
+
+    Every shard the clip touches (normally just the annotator's) is locked
+    first, in shard order so concurrent saves cannot deadlock, and written
+    when all frames are in place. The shards are still separate files: if
+    writing one fails after another was written, the request fails with
+    those frames saved. The reserved indices stay in the session, so
+    submitting the clip again rewrites the same entries.
+    """
+    user_images = get_user_images()
+    if ASSIGNMENT_MODE != 'clip' or not 0 <= start < len(user_images) or clip_ranges[clip_group_of[start]][0] != start:
+        return jsonify({"error": "Not the first frame of a clip"}), 400
+    start, end = clip_ranges[clip_group_of[start]]
+    submitted = (request.get_json(silent=True) or {}).get('annotations') or {}
+    frame_annotations = []
+    for index in range(start, end):
+        anns = submitted.get(str(index))
+        frame_annotations.append([ann for ann in anns if isinstance(ann, dict)] if isinstance(anns, list) else None)
+    filled = [canonicalize(anns)[0] for anns in
+              interpolate_clip([frame_of(item) for item in user_images[start:end]], frame_annotations)]
+
+    uid = session['uid']
+    stats, queries = ensure_stats(refresh=False), ensure_query_index(refresh=False)
+    indices = session.setdefault('user_annotation_indices', {})
+    # Frames with an index already go to its shard, new ones to the annotator's shard
+    uid_shard = annotation_store.shard_for_uid(uid)
+    by_shard = {}
+    for index, annotations in zip(range(start, end), filled):
+        slot = _annotation_slot(index)
+        if slot not in indices:
+            saved_index = find_saved_index(uid, user_images[index].get('path'))
+            if saved_index is not None:
+                indices[slot] = saved_index
+        shard = annotation_store.shard_for_index(indices[slot]) if slot in indices else uid_shard
+        by_shard.setdefault(shard, []).append((index, slot, annotations))
+
+    saved = []
+    saved_at = int(time.time())
+    # One locked write per shard touched, reserving indices in the same pass
+    with contextlib.ExitStack() as stack:
+        shard_entries = {shard: stack.enter_context(annotation_store.edit(shard)) for shard in sorted(by_shard)}
+        for shard, all_annotations in shard_entries.items():
+            positions = {entry['index']: i for i, entry in enumerate(all_annotations)
+                         if isinstance(entry, dict) and 'index' in entry}
+            next_index = annotation_store.next_index(all_annotations, shard)
+            for index, slot, annotations in by_shard[shard]:
+                for ann in annotations:
+                    ann['image_path'] = user_images[index].get('path')
+                if slot not in indices:
+                    indices[slot] = next_index
+                    next_index += annotation_store.shards
+                annotation_entry = {'index': indices[slot], 'annotations': annotations, 'uid': uid, 'saved_at': saved_at}
+                position = positions.get(indices[slot])
+                old_entry = None
+                if position is None:
+                    position = positions[indices[slot]] = len(all_annotations)
+                    all_annotations.append(annotation_entry)
+                else:
+                    old_entry = all_annotations[position]
+                    all_annotations[position] = annotation_entry
+                saved.append((index, annotation_store.key(shard, position), old_entry, annotation_entry))
+    session.modified = True
+
+    for index, key, old_entry, annotation_entry in saved:
+        stats.replace(old_entry, annotation_entry)
+        queries.replace(key, annotation_entry)
+        progress.mark(uid, _progress_slot(uid, index))
+    interpolated = sum(anns is None for anns in frame_annotations)
+    print(f"Saved clip frames {start}-{end - 1} in {len(by_shard)} write(s) ({interpolated} interpolated)")
+    next_url = url_for('.label_image', index=end) if end < len(user_images) else url_for('.resume')
+    return jsonify({"status": "ok", "saved": len(saved), "interpolated": interpolated, "next": next_url})
+
+def _has_token(token):
+    """True if the request carries token as `Authorization: Bearer <token>` or as the Basic auth password."""
+    given = request.headers.get('Authorization', '')
+    if given.startswith('Bearer '):
+        given = given[7:]
+    elif request.authorization is not None and request.authorization.type == 'basic':
+        given = request.authorization.password or ''
+    else:
+        return False
+    return hmac.compare_digest(given.encode('utf-8'), token.encode('utf-8'))
+
+def admin_required(view):
+    """Gate a read-only view of everyone's annotations behind ADMIN_TOKEN."""
+    @functools.wraps(view)
+    def wrapped(*args, **kwargs):
+        if not ADMIN_TOKEN:
+            return jsonify({"error": "this view is disabled; set ADMIN_TOKEN"}), 403
+        if not _has_token(ADMIN_TOKEN):
+            response = jsonify({"error": "missing or wrong admin token"})
+            response.status_code = 401
+            # Lets a browser ask for the token (any user name, the token as password)
+            response.headers['WWW-Authenticate'] = 'Basic realm="annotations"'
+            return response
+        return view(*args, **kwargs)
+    return wrapped
+
+@bp.route('/api/stats')
+@admin_required
+def api_stats():
+    return jsonify(ensure_stats().snapshot())
+
+@bp.route('/api/snapshots', methods=['GET', 'POST'])
+def api_snapshots():
+    """List snapshots of the annotations store (GET) or take one now (POST); needs SNAPSHOT_TOKEN."""
+    if not SNAPSHOT_TOKEN:
+        return jsonify({"error": "snapshots over HTTP are disabled; set SNAPSHOT_TOKEN or use snapshots.py"}), 403
+    given = request.headers.get('Authorization', '')
+    if not (given.startswith('Bearer ') and hmac.compare_digest(given[7:].encode('utf-8'), SNAPSHOT_TOKEN.encode('utf-8'))):
+        return jsonify({"error": "missing or wrong snapshot token"}), 401
+    directory = SNAPSHOT_DIR or default_snapshot_dir(annotations_file)
+    if request.method == 'GET':
+        return jsonify({"snapshots": list_snapshots(annotation_store, directory)})
+    try:
+        manifest = take_snapshot(annotation_store, directory, SNAPSHOT_KEEP)
+    except Exception as e:
+        print(f"Snapshot failed: {e}")
+        return jsonify({"error": str(e)}), 500
+    print(f"Snapshot {manifest['name']}: {manifest['entries']} entries")
+    return jsonify(manifest), 201
+
+@bp.route('/api/telemetry', methods=['GET', 'POST'])
+def api_telemetry():
+    """Timing summaries (GET), or a batch of {"events": [{index, <metric>: value, ...}]} from the labelling page (POST)."""
+    if telemetry is None:
+        return jsonify({"error": "telemetry is not available"}), 503
+    if request.method == 'GET':
+        return admin_required(lambda: jsonify(telemetry.snapshot()))()
+    # sendBeacon posts a Blob, so do not insist on the Content-Type
+    payload = request.get_json(silent=True, force=True)
+    events = payload.get('events') if isinstance(payload, dict) else None
+    if not isinstance(events, list):
+        return jsonify({"error": "expected {\"events\": [...]}"}), 400
+    # Events name their image by dataset path, as indices differ between annotators and
+    # assignment modes; unknown paths are dropped so per-image counts stay bounded
+    ensure_dataset_state()
+    pairs = []
+    for event in events[:TELEMETRY_MAX_EVENTS]:
+        image_path = event.get('image_path') if isinstance(event, dict) else None
+        if isinstance(image_path, str) and image_path in available_paths:
+            pairs.append((image_path, event))
+    accepted = telemetry.record(session.get('uid'), pairs)
+    return jsonify({"accepted": accepted}), 202
+
+@bp.route('/api/annotations')
+@admin_required
+def api_annotations():
+    """Stored annotations filtered by QUERY_FIELDS, paged by cursor and streamed as JSON."""
+    try:
+        cursor = int(request.args.get('cursor', -1))
+        limit = int(request.args.get('limit', 100))
+    except ValueError:
+        return jsonify({"error": "cursor and limit must be integers"}), 400
+    if not 1 <= limit <= 1000:
+        return jsonify({"error": "limit must be between 1 and 1000"}), 400
+    filters = {field: request.args.get(field) for field in QUERY_FIELDS}
+    results, next_cursor = ensure_query_index().query(filters, cursor=cursor, limit=limit)
+
+    def generate():
+        yield '{"results": ['
+        for i, result in enumerate(results):
+            yield (',' if i else '') + json.dumps(result)
+        yield '], "next_cursor": ' + json.dumps(next_cursor) + '}'
+
+    return Response(stream_with_context(generate()), mimetype='application/json')
+
+STATS_TEMPLATE = """
+<!DOCTYPE html>
+<html>
+<head>
+<title>Annotation Progress</title>
+<style>
+body { font-family: sans-serif; margin: 2em; }
+table { border-collapse: collapse; margin-bottom: 1.5em; }
+td, th { border: 1px solid #ccc; padding: 4px 10px; text-align: left; }
+</style>
+</head>
+<body>
+<h2>Annotation Progress</h2>
+<p>{{ s.annotations }} annotations in {{ s.entries }} saved entries covering {{ s.images_annotated }} images
+(<a href="{{ url_for('.api_stats') }}">JSON</a>)</p>
+{% for title, rows in [('Per annotator', s.per_annotator.items()), ('Per source', s.per_source.items()),
+                       ('Target type', s.target_types.items()),
+                       ('Images by annotation count', s.images_by_annotation_count.items())] %}
+<h3>{{ title }}</h3>
+<table>{% for key, value in rows %}<tr><td>{{ key }}</td><td>{{ value }}</td></tr>{% endfor %}</table>
+{% endfor %}
+<h3>Saves per {{ s.bucket_seconds // 60 }} min</h3>
+<table>{% for bucket, n in s.throughput %}<tr><td>{{ bucket | fmt_time }}</td><td>{{ n }}</td></tr>{% endfor %}</table>
+{% if t and t.events %}
+{% macro quantiles(m) %}{% if m.n %}{{ m.p50 | fmt_bound }} / {{ m.p90 | fmt_bound }}{% else %}-{% endif %}{% endmacro %}
+<h3>Annotator timing, p50 / p90 ({{ t.events }} images, <a href="{{ url_for('.api_telemetry') }}">JSON</a>)</h3>
+<table><tr><th></th>{% for metric in t.overall %}<th>{{ metric }}</th>{% endfor %}</tr>
+<tr><td>all</td>{% for m in t.overall.values() %}<td>{{ quantiles(m) }}</td>{% endfor %}</tr>
+{% for uid, metrics in t.per_annotator.items() %}<tr><td>{{ uid }}</td>{% for m in metrics.values() %}<td>{{ quantiles(m) }}</td>{% endfor %}</tr>{% endfor %}
+</table>
+<h3>Slowest images (median submit_ms)</h3>
+<table>{% for image in t.slowest_images %}<tr><td>{{ image.image_path }}</td><td>{{ quantiles(image.submit_ms) }}</td><td>{{ image.submit_ms.n }} submits</td></tr>{% endfor %}</table>
+{% endif %}
+</body>
+</html>
+"""
+
+@bp.app_template_filter('fmt_time')
+def fmt_time(timestamp):
+    return time.strftime('%Y-%m-%d %H:%M', time.localtime(timestamp))
+
+@bp.app_template_filter('fmt_bound')
+def fmt_bound(bound):
+    # Quantiles are bucket upper bounds; None is past the last bucket
+    return f"<= {bound}" if bound is not None else "more"
+
+@bp.route('/stats')
+@admin_required
+def stats_page():
+    return render_template_string(STATS_TEMPLATE, s=ensure_stats().snapshot(),
+                                  t=telemetry.snapshot() if telemetry is not None else None)
+
+@bp.route('/')
 def home():
+    return resume()
+
+@bp.route('/resume')
+def resume():
+    """Jump to the first image this user has not submitted yet."""
     user_images = get_user_images()
-    
-    if not user_images:
+
+    if not available_images:
         print("No data loaded, returning error page.")
         return "No data loaded."
 
-    # Redirect to the first image
-    return redirect(url_for('label_image', index=0))
+    index = resume_index(session['uid'], user_images)
+    if index is None:
+        if ASSIGNMENT_MODE == 'coverage':
+            return "All images have reached their annotation target. Thank you!"
+        return f"<h2>Annotation Complete!</h2><p>You have completed annotating all {len(user_images)} images assigned to you.</p>"
+    return redirect(url_for('.label_image', index=index))
+
+@bp.route('/identify', methods=['GET', 'POST'])
+def identify():
+    """Let a returning annotator re-attach to their progress after losing the session cookie.
 
-@app.route('/label_image/<int:index>', methods=['GET', 'POST'])
+    The first use of an ID sets its passphrase; later uses must repeat it.
+    """
+    annotator = (request.values.get('annotator') or '').strip()
+    if request.method == 'POST' and annotator:
+        if not valid_uid(annotator):
+            return "Annotator ID may only contain letters, digits, '.', '_' and '-' (max 64).", 400
+        passphrase = request.form.get('passphrase') or ''
+        if len(passphrase) < 4:
+            return "Choose a passphrase of at least 4 characters.", 400
+        if not annotator_keys.check(annotator, passphrase):
+            return "Wrong passphrase for this annotator ID.", 403
+        session['uid'] = annotator
+        session.pop('user_annotation_indices', None)
+        return redirect(url_for('.resume'))
+    return render_template_string(
+        "<form method='post'><label>Annotator ID: <input name='annotator' value='{{ annotator }}'></label> "
+        "<label>Passphrase: <input type='password' name='passphrase'></label> "
+        "<input type='submit' value='Continue'></form>",
+        annotator=annotator or session.get('uid', ''))
+
+@bp.route('/label_image/<int:index>', methods=['GET', 'POST'])
 def label_image(index):
     user_images = get_user_images()
     
@@ -433,23 +1222,22 @@ def label_image(index):
             for ann in annotations:
                 if isinstance(ann, dict):
                     ann['image_path'] = item.get('path')
+            annotations, problems = canonicalize(annotations)
+            errors = sorted({name for _, name in problems if name in ERRORS})
+            if errors:
+                print(f"Rejected annotations for image {index}: {problems}")
+                return f"Invalid annotations: {', '.join(errors)}", 400
+            if problems:
+                print(f"Canonicalised annotations for image {index}: {problems}")
 
             # Get or assign a unique annotation index for this user's image
-            if 'user_annotation_indices' not in session:
-                session['user_annotation_indices'] = {}
-            if str(index) not in session['user_annotation_indices']:
-                session['user_annotation_indices'][str(index)] = reserve_annotation_index()
-
-            annotation_index = session['user_annotation_indices'][str(index)]
-
-            # Update annotations.json using exclusive lock
-            with portalocker.Lock(annotations_file, 'r+', timeout=10) as f:
-                f.seek(0)
-                try:
-                    all_annotations = json.load(f)
-                except Exception:
-                    all_annotations = []
+            annotation_index = get_annotation_index(index)
+            uid = session['uid']
+            stats, queries = ensure_stats(refresh=False), ensure_query_index(refresh=False)
 
+            # Update the entry's annotations shard using exclusive lock
+            shard = annotation_store.shard_for_index(annotation_index)
+            with annotation_store.edit(shard) as all_annotations:
                 # Check if this annotation index already exists and update it, otherwise append
                 existing_entry_idx = None
                 for i, entry in enumerate(all_annotations):
@@ -457,36 +1245,51 @@ def label_image(index):
                         existing_entry_idx = i
                         break
 
-                annotation_entry = {'index': annotation_index, 'annotations': annotations}
+                annotation_entry = {'index': annotation_index, 'annotations': annotations, 'uid': uid,
+                                    'saved_at': int(time.time())}
 
+                old_entry = None
                 if existing_entry_idx is not None:
+                    old_entry = all_annotations[existing_entry_idx]
                     all_annotations[existing_entry_idx] = annotation_entry
                     print(f"Updated existing annotations for index {annotation_index}: {annotations}")
                 else:
+                    existing_entry_idx = len(all_annotations)
                     all_annotations.append(annotation_entry)
                     print(f"Added new annotations for index {annotation_index}: {annotations}")
 
-                f.seek(0)
-                f.truncate()
-                json.dump(all_annotations, f)
-                f.flush()
-                try:
-                    os.fsync(f.fileno())
-                except Exception:
-                    pass
-            
+            stats.replace(old_entry, annotation_entry)
+            queries.replace(annotation_store.key(shard, existing_entry_idx), annotation_entry)
+            progress.mark(uid, _progress_slot(uid, index))
+            if ASSIGNMENT_MODE == 'coverage':
+                ensure_scheduler().complete(uid, USER_IMAGE_IDS[uid][index])
+                if index + 1 >= len(user_images):
+                    extend_user_images(uid)
+
             next_index = min(index + 1, len(user_images) - 1)
             if next_index == index:  # We've reached the last image
-                return f"<h2>Annotation Complete!</h2><p>You have completed annotating all {len(user_images)} images assigned to you.</p><p>Total annotations saved with automatic indexing.</p><a href='{url_for('home')}'>Start Over</a>"
+                return f"<h2>Annotation Complete!</h2><p>You have completed annotating all {len(user_images)} images assigned to you.</p><p>Total annotations saved with automatic indexing.</p><a href='{url_for('.home')}'>Start Over</a>"
             
-            return redirect(url_for('label_image', index=next_index))
+            return redirect(url_for('.label_image', index=next_index))
+
+    # Have model hints for this image and the next ones ready before they are asked for
+    try:
+        prefetch_suggestions(user_images, index)
+    except Exception as e:
+        print(f"Suggestion prefetch failed: {e}")
 
     # Get the image URL with cache busting query parameter
     timestamp = int(time.time())
-    image_url = url_for('serve_image', index=index) + f'?t={timestamp}'
+    image_url = url_for('.serve_image', index=index) + f'?t={timestamp}'
     
     # Show progress information
     progress_info = f"Image {index + 1} of {len(user_images)} (User Session)"
+    clip = None
+    if ASSIGNMENT_MODE == 'clip':
+        start, end = clip_ranges[clip_group_of[index]]
+        if end - start > 1:
+            clip = {'start': start, 'end': end, 'frames': [frame_of(item) for item in user_images[start:end]]}
+            progress_info += f" - clip frame {index - start + 1} of {end - start}"
 
     html = """
 <!DOCTYPE html>
@@ -505,6 +1308,113 @@ let isDrawingBBox = false;
 let isDrawingGaze = false;
 let startX, startY;
 const currentIndex = {{ index }};
+// Clip mode: {start, end, frames} when this frame belongs to a multi-frame clip.
+// Frames are kept in sessionStorage until the last one, then saved together.
+const clip = {{ clip | tojson }};
+const clipKey = clip ? `clip_${clip.start}` : null;
+
+// Timing of this image, sent to /api/telemetry in batches of {{ telemetry_batch }} images.
+// Queued events live in localStorage, so they survive moving between pages.
+const TELEMETRY_KEY = 'telemetryQueue';
+const TELEMETRY_BATCH = {{ telemetry_batch }};
+const TELEMETRY_MAX_QUEUED = 200;
+const pageStart = performance.now();
+let imageShownAt = null;
+let leavingForNextImage = false;
+const timing = { image_path: {{ image_path | tojson }}, resets: 0 };
+
+function sinceImageShown() {
+  return performance.now() - (imageShownAt === null ? pageStart : imageShownAt);
+}
+
+function imageLoaded() {
+  const image = document.getElementById('image');
+  const entry = performance.getEntriesByName(image.currentSrc)[0];
+  if (entry && entry.responseEnd > 0) {
+    timing.image_fetch_ms = entry.responseEnd - entry.startTime;
+  }
+  const decodeStart = performance.now();
+  image.decode()
+    .then(() => { timing.image_decode_ms = performance.now() - decodeStart; })
+    .catch(() => {})
+    .finally(() => { imageShownAt = performance.now(); });
+}
+
+function queueTiming() {
+  timing.submit_ms = sinceImageShown();
+  const queue = JSON.parse(localStorage.getItem(TELEMETRY_KEY) || '[]');
+  queue.push(timing);
+  localStorage.setItem(TELEMETRY_KEY, JSON.stringify(queue.slice(-TELEMETRY_MAX_QUEUED)));
+  leavingForNextImage = true;
+  if (queue.length >= TELEMETRY_BATCH) {
+    flushTiming();
+  }
+}
+
+function flushTiming() {
+  const queue = localStorage.getItem(TELEMETRY_KEY);
+  if (!queue || queue === '[]' || !navigator.sendBeacon) {
+    return;
+  }
+  const body = new Blob([`{"events": ${queue}}`], { type: 'application/json' });
+  if (navigator.sendBeacon('/api/telemetry', body)) {
+    localStorage.removeItem(TELEMETRY_KEY);
+  }
+}
+
+// Send what is queued when the annotator switches tab or closes the page,
+// but not on every move to the next image
+document.addEventListener('visibilitychange', () => {
+  if (document.visibilityState === 'hidden' && !leavingForNextImage) {
+    flushTiming();
+  }
+});
+
+function loadClipState() {
+  return JSON.parse(sessionStorage.getItem(clipKey) || '{}');
+}
+
+function clipStartingAnnotations() {
+  // This frame's earlier answer, else the boxes and gaze of the closest annotated previous frame
+  const state = loadClipState();
+  if (state[currentIndex]) {
+    return state[currentIndex];
+  }
+  for (let i = currentIndex - 1; i >= clip.start; i--) {
+    if (state[i]) {
+      return state[i].map(ann => ({ bbox: ann.bbox.slice(), gaze: ann.gaze ? ann.gaze.slice() : null }));
+    }
+  }
+  return [];
+}
+
+async function finishClipFrame(anns) {
+  // anns is null for a skipped frame; the server interpolates it from the frames around it
+  queueTiming();
+  const state = loadClipState();
+  state[currentIndex] = anns;
+  sessionStorage.setItem(clipKey, JSON.stringify(state));
+  if (currentIndex + 1 < clip.end) {
+    window.location = `/label_image/${currentIndex + 1}`;
+    return;
+  }
+  try {
+    const res = await fetch(`/api/save_clip/${clip.start}`, {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify({ annotations: state })
+    });
+    const data = await res.json();
+    if (!res.ok || data.error) {
+      throw new Error(data.error || `HTTP ${res.status}`);
+    }
+    sessionStorage.removeItem(clipKey);
+    window.location = data.next;
+  } catch (err) {
+    alert(`Saving clip failed: ${err.message}`);
+    console.error(err);
+  }
+}
 
 async function autoDetectGaze() {
   try {
@@ -545,6 +1455,9 @@ function initCanvas() {
     startY = e.clientY - rect.top;
     if (!isDrawingGaze) {
       isDrawingBBox = true;
+      if (timing.first_bbox_ms === undefined) {
+        timing.first_bbox_ms = sinceImageShown();
+      }
       currentAnnotation = { bbox: [startX / canvas.width, startY / canvas.height, 0, 0], gaze: null };
     }
   });
@@ -580,6 +1493,12 @@ function initCanvas() {
       updateAnnotationsList();
     }
   });
+
+  if (clip) {
+    annotations = clipStartingAnnotations();
+    redrawCanvas(ctx, image, annotations);
+    updateAnnotationsList();
+  }
 }
 
 function redrawCanvas(ctx, image, anns) {
@@ -808,6 +1727,7 @@ function resetLastAnnotation() {
   if (annotations.length > 0) {
     // Remove the last annotation
     annotations.pop();
+    timing.resets += 1;
     
     // Reset drawing states
     isDrawingBBox = false;
@@ -862,6 +1782,11 @@ function submitForm() {
     }
   });
   document.getElementById('annotations_input').value = JSON.stringify(annotations);
+  if (clip) {
+    finishClipFrame(annotations);
+    return false;
+  }
+  queueTiming();
   return true;
 }
 </script>
@@ -869,22 +1794,27 @@ function submitForm() {
 <body onload="initCanvas()">
 <h2>{{ progress_info }}</h2>
 <div class="image-container">
-  <img id="image" src="{{ image_url }}">
+  <img id="image" src="{{ image_url }}" onload="imageLoaded()">
   <canvas id="canvas" style="position: absolute; top: 0; left: 0;"></canvas>
 </div>
 <!-- VGGT depth preview UI removed -->
-<form method="post" onsubmit="submitForm()">
+<form method="post" onsubmit="return submitForm()">
   <input type="hidden" id="annotations_input" name="annotations">
   <div id="annotations" class="annotations"></div>
   <p>Click and drag to draw a face rectangle, then click to mark gaze target. Repeat for multiple persons.</p>
+  <button type="button" onclick="autoDetectGaze()" style="padding: 10px 20px; border: none; border-radius: 5px; cursor: pointer; margin-right: 10px;">Suggest Gaze</button>
   <button type="button" onclick="resetLastAnnotation()" style="background-color: #ff6b6b; color: white; padding: 10px 20px; border: none; border-radius: 5px; cursor: pointer; margin-right: 10px;">Reset Last Annotation</button>
   <input type="submit" value="Submit All" style="background-color: #4CAF50; color: white; padding: 10px 20px; border: none; border-radius: 5px; cursor: pointer;">
+  {% if clip %}
+  <button type="button" onclick="finishClipFrame(null)" style="padding: 10px 20px; border: none; border-radius: 5px; cursor: pointer; margin-left: 10px;">Skip Frame (interpolate)</button>
+  {% endif %}
 </form>
 </body>
 </html>
     """
-    return render_template_string(html, image_url=image_url, progress_info=progress_info, index=index)
+    return render_template_string(html, image_url=image_url, progress_info=progress_info, index=index, clip=clip,
+                                  image_path=user_images[index].get('path'), telemetry_batch=TELEMETRY_BATCH)
 
 if __name__ == '__main__':
     port = int(os.environ.get("PORT", 5000))
-    app.run(debug=True, port=port)
\ No newline at end of file
+    create_app().run(debug=True, port=port)
\ No newline at end of file
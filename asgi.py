@@ -0,0 +1,256 @@
+import asyncio
+import contextvars
+import io
+import os
+import re
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.http import parse_etags, parse_if_range_header, parse_range_header
+
+import app as annotation_app
+
+# ASGI entry point for the annotation app. Start with:
+#   gunicorn -c gunicorn.conf.py -k uvicorn.workers.UvicornWorker asgi:app
+# (or `uvicorn asgi:app` locally).
+#
+# Images (/images/<index>) are sent from the event loop: the path lookup and
+# each chunk read run in the thread pool, and between chunks the connection
+# waits on the client without holding a thread. So one process can feed many
+# slow downloads. Single byte ranges and IMAGE_OFFLOAD behave as in the
+# Flask route. Every other route, the suggestion and save routes
+# included, runs the Flask app in the thread pool. Request bodies are read
+# in full on the event loop first, and response bodies are pulled from the
+# pool chunk by chunk. Blocking work (file locks, storage writes, model
+# waits) never runs on the event loop.
+
+ASGI_THREADS = int(os.environ.get('ASGI_THREADS', 16))
+CHUNK_SIZE = 256 * 1024
+_IMAGE_ROUTE = re.compile(r'^/images/(\d+)$')
+
+
+def _latin1(value):
+    return value.encode('latin-1') if isinstance(value, str) else value
+
+
+def build_environ(scope, body):
+    """WSGI environ for an ASGI http scope and its (fully read) request body."""
+    server = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': str(server[0]),
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    if scope.get('client'):
+        environ['REMOTE_ADDR'] = scope['client'][0]
+    for name, value in scope.get('headers', []):
+        name, value = name.decode('latin-1'), value.decode('latin-1')
+        if name == 'content-type':
+            key = 'CONTENT_TYPE'
+        elif name == 'content-length':
+            key = 'CONTENT_LENGTH'
+        else:
+            key = 'HTTP_' + name.upper().replace('-', '_')
+        environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+def requested_range(environ, length, etag):
+    """(start, stop) of a single satisfiable Range request, None to send the whole body, False for 416.
+
+    Follows werkzeug (and so the WSGI routes): a stale If-Range sends the whole
+    body, and several ranges in one request are not satisfiable.
+    """
+    byte_range = parse_range_header(environ.get('HTTP_RANGE'))
+    if byte_range is None:
+        return None
+    if_range = parse_if_range_header(environ.get('HTTP_IF_RANGE'))
+    if if_range.date is not None or (if_range.etag is not None and if_range.etag != etag):
+        return None
+    bounds = byte_range.range_for_length(length)
+    return bounds if bounds is not None else False
+
+
+async def read_body(receive):
+    """The whole request body, or None if the client went away first."""
+    chunks = []
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return None
+        chunks.append(message.get('body', b''))
+        if not message.get('more_body', False):
+            return b''.join(chunks)
+
+
+class AsgiApp:
+    """ASGI callable serving a Flask app created by app.create_app()."""
+
+    def __init__(self, flask_app, threads=ASGI_THREADS):
+        self.flask_app = flask_app
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='asgi')
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+        elif scope['type'] == 'http':
+            match = _IMAGE_ROUTE.match(scope['path'])
+            if match and scope['method'] in ('GET', 'HEAD'):
+                await self.serve_image(scope, int(match.group(1)), send)
+            else:
+                body = await read_body(receive)
+                if body is not None:
+                    await self.call_flask(scope, body, send)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.executor.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    def _run(self, context, func, *args):
+        # All blocking calls of one request share a context, so Flask's
+        # context-local state survives the hops between pool threads
+        return asyncio.get_running_loop().run_in_executor(self.executor, context.run, func, *args)
+
+    async def call_flask(self, scope, body, send):
+        """Run the Flask app for one request in the pool, sending its body as it is produced."""
+        environ = build_environ(scope, body)
+        context = contextvars.copy_context()
+        started = {}
+
+        def start_response(status, headers, exc_info=None):
+            started['status'], started['headers'] = status, headers
+            return lambda data: None  # the legacy write() callable is not used by Flask
+
+        def begin():
+            iterable = self.flask_app(environ, start_response)
+            iterator = iter(iterable)
+            return iterable, iterator, next(iterator, None)
+
+        iterable, iterator, chunk = await self._run(context, begin)
+        try:
+            await send({
+                'type': 'http.response.start',
+                'status': int(started['status'].split(' ', 1)[0]),
+                'headers': [(_latin1(name.lower()), _latin1(value)) for name, value in started['headers']],
+            })
+            while chunk is not None:
+                if chunk:
+                    await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+                chunk = await self._run(context, next, iterator, None)
+            await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+        finally:
+            if hasattr(iterable, 'close'):
+                await self._run(context, iterable.close)
+
+    def _locate_image(self, environ, index):
+        """(status, headers, body, source) for an image request; source is (read, start, stop, close) or None."""
+        with self.flask_app.request_context(environ) as ctx:
+            try:
+                kind, key = annotation_app.image_source(index)
+            except Exception as e:
+                print(f"serve_image error: {e}")
+                return 400, [('content-type', 'text/plain; charset=utf-8')], str(e).encode('utf-8'), None
+            response = self.flask_app.response_class()
+            self.flask_app.session_interface.save_session(self.flask_app, ctx.session, response)
+            headers = [('set-cookie', cookie) for cookie in response.headers.getlist('Set-Cookie')]
+        if kind == 'pack':
+            info = annotation_app.image_pack.info(key)
+            view = annotation_app.image_pack.view(key)
+            etag, length, close = info['sha256'], info['length'], None
+
+            def read(offset, size):
+                return bytes(view[offset:offset + size])
+        else:
+            offload = annotation_app.offload_headers(key)
+            if offload:
+                headers += [(name.lower(), value) for name, value in offload.items()]
+                return 200, headers + [('content-type', 'image/jpeg'), ('content-length', '0')], b'', None
+            try:
+                f = open(key, 'rb')
+            except FileNotFoundError:
+                annotation_app.forget_image_file(key)
+                return 404, headers + [('content-type', 'text/plain; charset=utf-8')], b'Image not found', None
+            st = os.fstat(f.fileno())
+            etag, length, close = f"{st.st_mtime_ns:x}-{st.st_size:x}", st.st_size, f.close
+
+            def read(offset, size):
+                f.seek(offset)
+                return f.read(size)
+        headers += [('etag', f'"{etag}"'), ('accept-ranges', 'bytes')]
+        if parse_etags(environ.get('HTTP_IF_NONE_MATCH')).contains(etag):
+            if close:
+                close()
+            return 304, headers, b'', None
+        byte_range = requested_range(environ, length, etag)
+        if byte_range is False:
+            if close:
+                close()
+            return 416, headers + [('content-range', f'bytes */{length}')], b'', None
+        headers.append(('content-type', 'image/jpeg'))
+        if byte_range is None:
+            return 200, headers + [('content-length', str(length))], None, (read, 0, length, close)
+        start, stop = byte_range
+        headers += [('content-range', f'bytes {start}-{stop - 1}/{length}'), ('content-length', str(stop - start))]
+        return 206, headers, None, (read, start, stop, close)
+
+    async def serve_image(self, scope, index, send):
+        """Send an image in CHUNK_SIZE pieces, each read in the pool."""
+        context = contextvars.copy_context()
+        status, headers, body, source = await self._run(
+            context, self._locate_image, build_environ(scope, b''), index)
+        await send({'type': 'http.response.start', 'status': status,
+                    'headers': [(_latin1(name), _latin1(value)) for name, value in headers]})
+        if source is None or scope['method'] == 'HEAD':
+            if source is not None and source[3]:
+                await self._run(context, source[3])
+            await send({'type': 'http.response.body', 'body': b'' if scope['method'] == 'HEAD' else body,
+                        'more_body': False})
+            return
+        read, offset, stop, close = source
+        try:
+            while offset < stop:
+                chunk = await self._run(context, read, offset, min(CHUNK_SIZE, stop - offset))
+                if not chunk:
+                    break  # file shrank underneath us
+                offset += len(chunk)
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': offset < stop})
+            if offset < stop:
+                await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+        finally:
+            if close:
+                await self._run(context, close)
+
+
+def create_asgi_app(config=None):
+    """ASGI app around app.create_app(config)."""
+    return AsgiApp(annotation_app.create_app(config))
+
+
+_app = None
+
+
+def __getattr__(name):
+    # `asgi:app` builds the app on first access, like app.py does for `app:app`
+    global _app
+    if name == 'app':
+        if _app is None:
+            _app = create_asgi_app()
+        return _app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
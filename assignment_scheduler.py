@@ -0,0 +1,114 @@
+import heapq
+import threading
+import time
+
+
+class CoverageScheduler:
+    """Hands out leased batches of the least-annotated images.
+
+    Images are integer ids 0..n-1. Each image aims for `target` annotations
+    from distinct annotators. An image's priority is its completed count plus
+    its active leases, kept in a lazily invalidated min-heap, so leasing or
+    completing an image is O(log n). Leases that are not completed within
+    lease_seconds are reclaimed and the image becomes available again.
+    Images a user has already done are skipped over (and put back) while
+    leasing to them.
+    """
+
+    def __init__(self, image_count, target=3, lease_seconds=1800, clock=time.monotonic):
+        self.target = target
+        self.lease_seconds = lease_seconds
+        self.clock = clock
+        self.done = [0] * image_count
+        self.leased = [0] * image_count
+        self.completed_by = {}  # uid -> set of image ids
+        self._leases = {}  # (uid, image id) -> expiry
+        self._expiries = []  # heap of (expiry, uid, image id)
+        self._heap = [(0, i) for i in range(image_count)]
+        self._lock = threading.Lock()
+
+    def _priority(self, image_id):
+        return self.done[image_id] + self.leased[image_id]
+
+    def _push(self, image_id):
+        heapq.heappush(self._heap, (self._priority(image_id), image_id))
+        if len(self._heap) > 4 * len(self.done) + 64:
+            # Drop stale entries once they dominate the heap
+            self._heap = [(self._priority(i), i) for i in range(len(self.done))]
+            heapq.heapify(self._heap)
+
+    def _release(self, uid, image_id):
+        if self._leases.pop((uid, image_id), None) is not None:
+            self.leased[image_id] -= 1
+            return True
+        return False
+
+    def _expire(self):
+        now = self.clock()
+        while self._expiries and self._expiries[0][0] <= now:
+            expiry, uid, image_id = heapq.heappop(self._expiries)
+            if self._leases.get((uid, image_id)) == expiry:
+                self._release(uid, image_id)
+                self._push(image_id)
+
+    def record_existing(self, image_id, count=1, uid=None):
+        """Count annotations that already exist (e.g. loaded from the store at startup).
+
+        With a uid this counts one annotator, and only the first time uid is
+        recorded for image_id, as complete() does. Returns the number counted.
+        """
+        with self._lock:
+            if uid is not None:
+                done_by_uid = self.completed_by.setdefault(uid, set())
+                if image_id in done_by_uid:
+                    return 0
+                done_by_uid.add(image_id)
+                count = 1
+            self.done[image_id] += count
+            self._push(image_id)
+            return count
+
+    def lease(self, uid, count, exclude=()):
+        """Lease up to `count` images below target that uid has not done or leased.
+
+        Returns the leased image ids, least-covered first; an empty list means
+        every image uid may still label has reached the target.
+        """
+        with self._lock:
+            self._expire()
+            done_by_uid = self.completed_by.get(uid, ())
+            picked, skipped = [], []
+            while self._heap and len(picked) < count:
+                priority, image_id = heapq.heappop(self._heap)
+                if priority != self._priority(image_id) or image_id in picked:
+                    continue  # stale or duplicate entry
+                if priority >= self.target:
+                    skipped.append((priority, image_id))
+                    break
+                if image_id in done_by_uid or image_id in exclude or (uid, image_id) in self._leases:
+                    skipped.append((priority, image_id))
+                    continue
+                picked.append(image_id)
+            for entry in skipped:
+                heapq.heappush(self._heap, entry)
+
+            expiry = self.clock() + self.lease_seconds
+            for image_id in picked:
+                self.leased[image_id] += 1
+                self._leases[(uid, image_id)] = expiry
+                heapq.heappush(self._expiries, (expiry, uid, image_id))
+                self._push(image_id)
+            return picked
+
+    def complete(self, uid, image_id):
+        """Record that uid annotated image_id; a repeat submit by the same uid is not recounted."""
+        with self._lock:
+            self._release(uid, image_id)
+            done_by_uid = self.completed_by.setdefault(uid, set())
+            if image_id not in done_by_uid:
+                done_by_uid.add(image_id)
+                self.done[image_id] += 1
+            self._push(image_id)
+
+    def has_completed(self, uid, image_id):
+        return image_id in self.completed_by.get(uid, ())
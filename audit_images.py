@@ -0,0 +1,221 @@
+import argparse
+import hashlib
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+from PIL import Image
+
+from image_resolver import build_vat_index, default_merged_root, is_gazefollow_path, resolve_merged_path
+
+# Checks every entry of the combined selection against merged_images: the
+# image exists and decodes completely, and its bbox/eye/gaze fit inside it.
+# Decode results are cached by content hash in <merged_root>/.audit_cache.json
+# (files are re-hashed only when their size or mtime changes), so re-audits
+# only decode new or changed images. The app reads the same cache and skips
+# its per-request PIL check for files that passed.
+
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+# Head boxes may hang over the frame edge by this fraction of the image size
+BBOX_SLACK = 0.1
+AUDIT_CACHE_NAME = '.audit_cache.json'
+CACHE_VERSION = 1
+
+_known_hashes = frozenset()
+
+
+def _init_worker(known_hashes):
+    global _known_hashes
+    _known_hashes = frozenset(known_hashes)
+
+
+def _inspect(path):
+    """Hash a file and, unless its content was decoded before, decode it fully."""
+    st = os.stat(path)
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    result = {'size': st.st_size, 'mtime_ns': st.st_mtime_ns, 'sha256': h.hexdigest()}
+    if result['sha256'] in _known_hashes:
+        return path, result, None
+    try:
+        with Image.open(path) as img:
+            img.load()
+            decoded = {'width': img.width, 'height': img.height, 'error': None}
+    except Exception as e:
+        decoded = {'width': None, 'height': None, 'error': f"{type(e).__name__}: {e}"}
+    return path, result, decoded
+
+
+def load_audit_cache(cache_path):
+    try:
+        with open(cache_path, 'r') as f:
+            cache = json.load(f)
+        if cache.get('version') == CACHE_VERSION:
+            return cache
+    except (OSError, ValueError):
+        pass
+    return empty_cache()
+
+
+def empty_cache():
+    return {'version': CACHE_VERSION, 'files': {}, 'decoded': {}}
+
+
+def load_audit_results(merged_root):
+    """Map full image path -> (size, mtime_ns, error or None) from the last audit."""
+    cache = load_audit_cache(os.path.join(merged_root, AUDIT_CACHE_NAME))
+    results = {}
+    for rel_path, info in cache['files'].items():
+        decoded = cache['decoded'].get(info.get('sha256'))
+        if decoded is not None:
+            full_path = os.path.normpath(os.path.join(merged_root, rel_path))
+            results[full_path] = (info['size'], info['mtime_ns'], decoded['error'])
+    return results
+
+
+def audit_files(paths, merged_root, cache, workers=None):
+    """Decode results for paths (absolute), updating cache in place.
+
+    Cached files that no longer exist are forgotten, and so are decode
+    results whose content hash no cached file refers to.
+    """
+    files, decoded = cache['files'], cache['decoded']
+    results, todo = {}, []
+    for path in paths:
+        rel_path = os.path.relpath(path, merged_root)
+        info = files.get(rel_path)
+        try:
+            st = os.stat(path)
+        except OSError:
+            files.pop(rel_path, None)
+            results[path] = {'width': None, 'height': None, 'error': 'missing'}
+            continue
+        if info and (info['size'], info['mtime_ns']) == (st.st_size, st.st_mtime_ns) and info['sha256'] in decoded:
+            results[path] = decoded[info['sha256']]
+        else:
+            todo.append(path)
+
+    if todo:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(list(decoded),)) as pool:
+            for path, info, result in pool.map(_inspect, todo, chunksize=16):
+                if result is not None:
+                    decoded[info['sha256']] = result
+                files[os.path.relpath(path, merged_root)] = info
+                results[path] = decoded[info['sha256']]
+    # Forget deleted files, then decode results of content no file has any more
+    audited = {os.path.relpath(path, merged_root) for path in paths}
+    for rel_path in [p for p in files if p not in audited and not os.path.exists(os.path.join(merged_root, p))]:
+        del files[rel_path]
+    referenced = {info['sha256'] for info in files.values()}
+    for digest in [d for d in decoded if d not in referenced]:
+        del decoded[digest]
+    print(f"Audited {len(results)} files: {len(todo)} hashed, {len(results) - len(todo)} unchanged since the last audit")
+    return results
+
+
+def _rectify(x, y, w, h):
+    if w < 0:
+        x, w = x + w, -w
+    if h < 0:
+        y, h = y + h, -h
+    return x, y, w, h
+
+
+def check_entry(entry, width, height):
+    """Problems with an entry's bbox/eye/gaze for an image of the given size.
+
+    GazeFollow values are normalised, VAT values are pixels; a gaze of -1
+    marks an out-of-frame target and is allowed. Boxes may overhang the
+    image by BBOX_SLACK.
+    """
+    if is_gazefollow_path(entry.get('path')):
+        scale_x, scale_y, tol = 1.0, 1.0, 1e-3
+    else:
+        scale_x, scale_y, tol = float(width), float(height), 1.0
+    problems = []
+
+    def inside(px, py, slack=0.0):
+        tol_x, tol_y = tol + slack * scale_x, tol + slack * scale_y
+        return -tol_x <= px <= scale_x + tol_x and -tol_y <= py <= scale_y + tol_y
+
+    bbox = entry.get('bbox')
+    try:
+        x, y, w, h = _rectify(*[float(v) for v in bbox[:4]])
+        if not (inside(x, y, BBOX_SLACK) and inside(x + w, y + h, BBOX_SLACK)):
+            problems.append(f"bbox {bbox} outside {width}x{height}")
+    except (TypeError, ValueError):
+        problems.append(f"bad bbox {bbox!r}")
+    for field in ('eye', 'gaze'):
+        point = entry.get(field)
+        if point is None and field == 'gaze':
+            continue
+        try:
+            px, py = float(point[0]), float(point[1])
+        except (TypeError, ValueError, IndexError):
+            problems.append(f"bad {field} {point!r}")
+            continue
+        if field == 'gaze' and (px == -1 or py == -1):
+            continue
+        if not inside(px, py):
+            problems.append(f"{field} {point} outside {width}x{height}")
+    return problems
+
+
+def audit(entries, merged_root, workers=None, use_cache=True):
+    cache_path = os.path.join(merged_root, AUDIT_CACHE_NAME)
+    cache = load_audit_cache(cache_path) if use_cache else empty_cache()
+    vat_index = build_vat_index(os.path.join(merged_root, 'vat'))
+
+    resolved = []
+    for entry in entries:
+        path = resolve_merged_path(entry.get('path'), merged_root, vat_index)
+        resolved.append(os.path.normpath(path) if path else None)
+    results = audit_files(sorted({p for p in resolved if p}), merged_root, cache, workers)
+
+    problems = []
+    for entry, path in zip(entries, resolved):
+        if path is None:
+            problems.append({'path': entry.get('path'), 'problems': ['missing']})
+            continue
+        result = results[path]
+        if result['error']:
+            issues = [result['error']]
+        else:
+            issues = check_entry(entry, result['width'], result['height'])
+        if issues:
+            problems.append({'path': entry.get('path'), 'file': path, 'problems': issues})
+
+    tmp_path = cache_path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(cache, f)
+    os.replace(tmp_path, cache_path)
+    return problems
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check selected images and their labels against merged_images.")
+    parser.add_argument('dataset', nargs='?', default=os.path.join(ROOT_DIR, 'combined_gazefollow_vat.json'))
+    parser.add_argument('--merged-root', default=default_merged_root())
+    parser.add_argument('--workers', type=int, default=None, help="decode processes (default: CPU count)")
+    parser.add_argument('--no-cache', action='store_true', help="re-hash and re-decode every file")
+    parser.add_argument('-o', '--report', help="write the problems as JSON to this file")
+    args = parser.parse_args(argv)
+
+    with open(args.dataset, 'r') as f:
+        entries = json.load(f)
+    problems = audit(entries, args.merged_root, workers=args.workers, use_cache=not args.no_cache)
+
+    for problem in problems:
+        print(f"{problem['path']}: {'; '.join(problem['problems'])}")
+    print(f"{len(problems)} of {len(entries)} entries have problems")
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(problems, f, indent=2)
+    return 1 if problems else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -43,12 +43,35 @@ def download_and_unpack(url, dest_root):
             return False
 
 
+def download_pack(url, pack_path):
+    print(f"Downloading image pack from {url} ...")
+    ensure_dir(os.path.dirname(pack_path))
+    tmp_path = pack_path + '.part'
+    try:
+        urlretrieve(url, tmp_path)
+        os.replace(tmp_path, pack_path)
+        print(f"Saved image pack to {pack_path}")
+        return True
+    except Exception as e:
+        print(f"Download failed: {e}")
+        return False
+
+
 def main():
     project_root = os.path.abspath(os.path.dirname(__file__))
     merged_root = os.environ.get('MERGED_ROOT', os.path.join(project_root, 'merged_images'))
     zip_url = os.environ.get('MERGED_ZIP_URL', '').strip()
+    pack_url = os.environ.get('MERGED_PACK_URL', '').strip()
+    pack_path = os.environ.get('IMAGE_PACK') or os.path.join(merged_root, 'images.pack')
 
     print(f"Bootstrap: MERGED_ROOT={merged_root}")
+    if pack_url:
+        # A single pack file replaces the unpacked image tree
+        if os.path.exists(pack_path):
+            print("Bootstrap: image pack already present; skipping download.")
+            return 0
+        return 0 if download_pack(pack_url, pack_path) else 1
+
     if has_any_files(merged_root):
         print("Bootstrap: merged images already present; skipping download.")
         return 0
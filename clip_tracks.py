@@ -0,0 +1,109 @@
+import bisect
+import copy
+import os
+
+# Clip grouping and keyframe interpolation for the clip annotation mode.
+#
+# VAT frames live under merged_images/vat/<show>/<start>_<end>/; frames that
+# share that folder form a clip. In clip mode the user's list is reordered so
+# each clip's frames are consecutive and sorted by frame number. Frames the
+# annotator skips are filled in from the annotated frames (keyframes) around
+# them when the clip is saved.
+
+GEOMETRY_FIELDS = ('bbox', 'gaze')
+
+
+def clip_of(full_path, merged_root):
+    """'<show>/<clip>' for a VAT image under merged_root, else None."""
+    if not full_path:
+        return None
+    rel = os.path.relpath(full_path, os.path.join(merged_root, 'vat'))
+    parts = rel.replace(os.sep, '/').split('/')
+    if len(parts) != 3 or parts[0] == '..':
+        return None
+    return '/'.join(parts[:2])
+
+
+def frame_of(item):
+    frame = item.get('frame')
+    if frame is None:
+        stem = os.path.splitext(os.path.basename(item.get('path', '')))[0].split('.')[0]
+        frame = int(stem) if stem.isdigit() else 0
+    return int(frame)
+
+
+def order_by_clip(images, resolve, merged_root):
+    """Reorder images so frames of a clip are adjacent and in frame order.
+
+    resolve maps a dataset path to its full path. Clips keep the position of
+    their first frame in `images`; GazeFollow images and frames outside any
+    clip stay single. A frame listed twice in a clip is kept once. Returns
+    (ordered images, [(start, end)] index range of each group).
+    """
+    groups, by_clip = [], {}
+    for item in images:
+        clip = clip_of(resolve(item.get('path')), merged_root)
+        if clip is None:
+            groups.append([item])
+        elif clip in by_clip:
+            by_clip[clip].append(item)
+        else:
+            by_clip[clip] = [item]
+            groups.append(by_clip[clip])
+
+    ordered, ranges = [], []
+    for group in groups:
+        seen, frames = set(), []
+        for item in sorted(group, key=frame_of):
+            if item.get('path') not in seen:
+                seen.add(item.get('path'))
+                frames.append(item)
+        ranges.append((len(ordered), len(ordered) + len(frames)))
+        ordered.extend(frames)
+    return ordered, ranges
+
+
+def _lerp(a, b, t):
+    if a is None or b is None or len(a) != len(b):
+        return copy.deepcopy(a if t < 0.5 or b is None else b)
+    return [float(x) + (float(y) - float(x)) * t for x, y in zip(a, b)]
+
+
+def interpolate_clip(frames, annotations):
+    """Fill skipped frames (None) of a clip from the keyframes around them.
+
+    frames are the frame numbers and annotations the per-frame annotation
+    lists. Person k of a skipped frame takes the bbox and gaze of person k
+    in the previous and next keyframes, linearly interpolated by frame
+    number; other fields come from the previous keyframe. With a keyframe on
+    one side only, its annotations are held. Filled-in annotations are
+    marked 'interpolated'. Returns a new list; a clip with no keyframes is
+    returned as all empty lists.
+    """
+    keys = [i for i, anns in enumerate(annotations) if anns is not None]
+    filled = []
+    for i, anns in enumerate(annotations):
+        if anns is not None:
+            filled.append(anns)
+            continue
+        pos = bisect.bisect_left(keys, i)
+        prev_key = keys[pos - 1] if pos > 0 else None
+        next_key = keys[pos] if pos < len(keys) else None
+        prev_anns = annotations[prev_key] if prev_key is not None else None
+        next_anns = annotations[next_key] if next_key is not None else None
+        if prev_anns is None and next_anns is None:
+            filled.append([])
+            continue
+        base = prev_anns if prev_anns is not None else next_anns
+        span = frames[next_key] - frames[prev_key] if prev_anns is not None and next_anns is not None else 0
+        t = (frames[i] - frames[prev_key]) / span if span else 0.0
+        result = []
+        for k, ann in enumerate(base):
+            new_ann = copy.deepcopy(ann)
+            if prev_anns is not None and next_anns is not None and k < len(next_anns):
+                for field in GEOMETRY_FIELDS:
+                    new_ann[field] = _lerp(ann.get(field), next_anns[k].get(field), t)
+            new_ann['interpolated'] = True
+            result.append(new_ann)
+        filled.append(result)
+    return filled
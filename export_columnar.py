@@ -0,0 +1,128 @@
+import os
+import sys
+import json
+
+import numpy as np
+
+from annotation_canonical import parse_vec
+from merge_annotations import iter_json_array
+
+# Categorical annotation fields stored as int16 codes plus a value table
+CATEGORICAL_FIELDS = ('target_type', 'farther_closer', 'object_detection', 'annotator_id')
+
+
+def _fixed(rows, n):
+    """(len(rows), n) float32 array with NaN for missing rows."""
+    out = np.full((len(rows), n), np.nan, dtype=np.float32)
+    for i, v in enumerate(rows):
+        if v is not None:
+            out[i] = v
+    return out
+
+
+def build_columns(entries):
+    """Turn [{index, annotations: [...]}] entries into columnar arrays.
+
+    One row per annotation. Missing numeric values are NaN (gaze_number -1);
+    categorical values are int16 codes into '<field>_values' with -1 for empty.
+    Images are referenced through 'image_id' into the 'image_paths' table.
+    """
+    entry_index, image_ids = [], []
+    bbox, gaze, gaze_3d, gaze_number = [], [], [], []
+    categorical = {field: [] for field in CATEGORICAL_FIELDS}
+    tables = {field: {} for field in CATEGORICAL_FIELDS}
+    images = {}
+    for entry in entries:
+        if not isinstance(entry, dict):
+            continue
+        for ann in entry.get('annotations') or []:
+            if not isinstance(ann, dict):
+                continue
+            image_path = ann.get('image_path') or entry.get('image_path') or ''
+            try:
+                entry_index.append(int(entry.get('index')))
+            except (TypeError, ValueError):
+                entry_index.append(-1)
+            image_ids.append(images.setdefault(image_path, len(images)))
+            bbox.append(parse_vec(ann.get('bbox'), 4))
+            gaze.append(parse_vec(ann.get('gaze'), 2))
+            gaze_3d.append(parse_vec(ann.get('gaze_3d'), 3))
+            try:
+                gaze_number.append(int(ann.get('gaze_number')))
+            except (TypeError, ValueError):
+                gaze_number.append(-1)
+            for field in CATEGORICAL_FIELDS:
+                value = ann.get(field)
+                if value in (None, ''):
+                    categorical[field].append(-1)
+                else:
+                    categorical[field].append(tables[field].setdefault(str(value), len(tables[field])))
+
+    columns = {
+        'entry_index': np.asarray(entry_index, dtype=np.int64),
+        'image_id': np.asarray(image_ids, dtype=np.int32),
+        'bbox': _fixed(bbox, 4),
+        'gaze': _fixed(gaze, 2),
+        'gaze_3d': _fixed(gaze_3d, 3),
+        'gaze_number': np.asarray(gaze_number, dtype=np.int32),
+        'image_paths': np.asarray(list(images), dtype=str),
+    }
+    for field in CATEGORICAL_FIELDS:
+        columns[field] = np.asarray(categorical[field], dtype=np.int16)
+        columns[f'{field}_values'] = np.asarray(list(tables[field]), dtype=str)
+    return columns
+
+
+def export_columnar(input_file, output_dir):
+    """Convert an annotations store (or merged file) into a directory of .npy files.
+
+    Each column is its own .npy so consumers can memory-map exactly what they
+    need. The input is read incrementally. Returns the number of rows.
+    """
+    columns = build_columns(iter_json_array(input_file))
+    os.makedirs(output_dir, exist_ok=True)
+    for name, array in columns.items():
+        tmp_path = os.path.join(output_dir, f'{name}.npy.tmp')
+        with open(tmp_path, 'wb') as f:
+            np.save(f, array)
+        os.replace(tmp_path, os.path.join(output_dir, f'{name}.npy'))
+    rows = int(len(columns['entry_index']))
+    meta = {
+        'source': os.path.abspath(input_file),
+        'rows': rows,
+        'columns': sorted(columns),
+        'categorical': list(CATEGORICAL_FIELDS),
+    }
+    with open(os.path.join(output_dir, 'meta.json'), 'w') as f:
+        json.dump(meta, f, indent=2)
+    return rows
+
+
+def load_columnar(output_dir, mmap_mode='r'):
+    """Open an exported directory; numeric columns are memory-mapped by default."""
+    with open(os.path.join(output_dir, 'meta.json'), 'r') as f:
+        meta = json.load(f)
+    return {name: np.load(os.path.join(output_dir, f'{name}.npy'), mmap_mode=mmap_mode)
+            for name in meta['columns']}
+
+
+def main():
+    if len(sys.argv) < 2:
+        print("Usage: python export_columnar.py <annotations.json|annotations_merged.json> [output_dir]")
+        print("Example:")
+        print("  python export_columnar.py annotations_merged.json annotations_columnar")
+        return 1
+
+    input_file = sys.argv[1]
+    output_dir = sys.argv[2] if len(sys.argv) >= 3 else os.path.splitext(input_file)[0] + '_columnar'
+    try:
+        rows = export_columnar(input_file, output_dir)
+    except Exception as e:
+        print(f"Failed to export {input_file}: {e}")
+        return 1
+    print(f"Exported {rows} annotations from {input_file} to {output_dir}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
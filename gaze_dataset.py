@@ -0,0 +1,122 @@
+import os
+from collections import OrderedDict
+
+import numpy as np
+import torch
+from PIL import Image
+from torch.utils.data import Dataset, DataLoader
+
+from export_columnar import build_columns, load_columnar
+from gaze_heatmaps import cached_heatmaps, gaze_heatmaps
+from image_resolver import build_vat_index, default_merged_root, resolve_merged_path
+from merge_annotations import iter_json_array
+
+
+class GazeAnnotationDataset(Dataset):
+    """One sample per annotated person: the resized image plus its labels.
+
+    `source` is an annotations store / merged file (JSON) or a directory made
+    by export_columnar.py. Images are resolved under merged_root with the same
+    rules the app uses and resized to image_size (height, width). Annotations
+    whose image is missing or that lack a bbox or gaze point are dropped.
+    Coordinates stay normalised to [0, 1].
+
+    Label columns are kept whole (memory-mapped for an export directory) and
+    read one row per sample, so DataLoader workers share the mapped pages
+    instead of each holding a copy.
+
+    cache_size bounds an LRU of decoded, resized image tensors (per process,
+    so each DataLoader worker keeps its own). num_shards/shard_index split the
+    samples deterministically, e.g. one shard per training process.
+
+    With heatmap_size, samples also carry a Gaussian gaze 'heatmap' and an
+    'in_frame' flag; heatmap_cache_dir persists them in a memory-mapped file.
+    """
+
+    def __init__(self, source, merged_root=None, image_size=(224, 224), cache_size=0,
+                 num_shards=1, shard_index=0, heatmap_size=None, heatmap_sigma=3.0, heatmap_cache_dir=None):
+        if os.path.isdir(source):
+            columns = load_columnar(source, mmap_mode='r')
+        else:
+            columns = build_columns(iter_json_array(source))
+
+        merged_root = merged_root or default_merged_root()
+        vat_index = build_vat_index(os.path.join(merged_root, 'vat'))
+        image_files = [resolve_merged_path(p, merged_root, vat_index) for p in columns['image_paths'].tolist()]
+        has_file = np.array([f is not None for f in image_files], dtype=bool)
+
+        bbox = columns['bbox']
+        gaze = columns['gaze']
+        image_id = np.asarray(columns['image_id'])
+        keep = ~np.isnan(bbox).any(axis=1) & ~np.isnan(gaze).any(axis=1) & has_file[image_id]
+        rows = np.flatnonzero(keep)
+        # Stable order (by image, then row) so shards are identical across processes
+        rows = rows[np.lexsort((rows, image_id[rows]))]
+        rows = rows[shard_index::num_shards]
+
+        self.image_files = image_files
+        self.rows = rows  # sample -> row of the columns below
+        self.image_id = image_id[rows]
+        self.bbox = bbox
+        self.gaze = gaze
+        self.gaze_3d = columns['gaze_3d']
+        self.target_type = columns['target_type']
+        self.target_types = columns['target_type_values'].tolist()
+        self.image_size = tuple(image_size)
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+
+        self.heatmaps = self.in_frame = None
+        if heatmap_size:
+            sample_gaze = np.asarray(gaze[rows], dtype=np.float32)
+            if heatmap_cache_dir:
+                self.heatmaps, self.in_frame = cached_heatmaps(sample_gaze, heatmap_cache_dir, heatmap_size, heatmap_sigma)
+            else:
+                self.heatmaps, self.in_frame = gaze_heatmaps(sample_gaze, heatmap_size, heatmap_sigma)
+
+    def __len__(self):
+        return len(self.image_id)
+
+    def load_image(self, image_id):
+        """Decoded image as a 3xHxW float tensor in [0, 1], resized to image_size."""
+        cached = self._cache.get(image_id)
+        if cached is not None:
+            self._cache.move_to_end(image_id)
+            return cached
+        with Image.open(self.image_files[image_id]) as img:
+            img.draft('RGB', self.image_size[::-1])  # Let JPEG decode at reduced scale
+            img = img.convert('RGB').resize(self.image_size[::-1], Image.BILINEAR)
+            tensor = torch.from_numpy(np.asarray(img, dtype=np.uint8).copy()).permute(2, 0, 1)
+        tensor = tensor.float().div_(255)
+        if self.cache_size:
+            self._cache[image_id] = tensor
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return tensor
+
+    def __getitem__(self, i):
+        image_id = int(self.image_id[i])
+        row = self.rows[i]
+        sample = {
+            'image': self.load_image(image_id),
+            'bbox': torch.from_numpy(np.array(self.bbox[row], dtype=np.float32)),
+            'gaze': torch.from_numpy(np.array(self.gaze[row], dtype=np.float32)),
+            'gaze_3d': torch.from_numpy(np.array(self.gaze_3d[row], dtype=np.float32)),
+            'target_type': int(self.target_type[row]),
+            'image_id': image_id,
+        }
+        if self.heatmaps is not None:
+            sample['heatmap'] = torch.from_numpy(np.asarray(self.heatmaps[i], dtype=np.float32))
+            sample['in_frame'] = bool(self.in_frame[i])
+        return sample
+
+
+def make_dataloader(dataset, batch_size=32, shuffle=True, num_workers=4, prefetch_factor=4, seed=0, **kwargs):
+    """DataLoader with worker prefetching and a seeded shuffle."""
+    generator = torch.Generator()
+    generator.manual_seed(seed)
+    if num_workers:
+        kwargs.setdefault('persistent_workers', True)
+        kwargs['prefetch_factor'] = prefetch_factor
+    return DataLoader(dataset, batch_size=batch_size, shuffle=shuffle, num_workers=num_workers,
+                      generator=generator, pin_memory=torch.cuda.is_available(), **kwargs)
@@ -0,0 +1,75 @@
+import os
+import hashlib
+
+import numpy as np
+
+
+def in_frame_mask(gaze):
+    """True where a normalised gaze point lies inside the image.
+
+    Out-of-frame targets are negative (VAT's -1 pixel marker becomes -0.05 in
+    gaze_suggest's normalize_point), above 1, or missing (NaN).
+    """
+    gaze = np.asarray(gaze, dtype=np.float32).reshape(-1, 2)
+    return np.all((gaze >= 0) & (gaze <= 1), axis=1)
+
+
+def gaze_heatmaps(gaze, size=(64, 64), sigma=3.0, dtype=np.float32):
+    """GazeFollow-style Gaussian target heatmaps for a batch of gaze points.
+
+    gaze is (N, 2) normalised (x, y); size is the output (height, width) and
+    sigma is in output pixels. Each heatmap is a Gaussian equal to 1 at the
+    gaze point; out-of-frame samples get an all-zero map. The Gaussian is
+    separable, so a batch is one outer product of per-axis profiles instead
+    of N full evaluations. Returns (heatmaps (N, H, W), in_frame (N,) bool).
+    """
+    gaze = np.asarray(gaze, dtype=np.float32).reshape(-1, 2)
+    height, width = size
+    in_frame = in_frame_mask(gaze)
+    centre = np.where(in_frame[:, None], gaze, 0.0) * np.array([width, height], dtype=np.float32)
+    xs = np.arange(width, dtype=np.float32) + 0.5
+    ys = np.arange(height, dtype=np.float32) + 0.5
+    inv = np.float32(-0.5 / (sigma * sigma))
+    gx = np.exp(inv * (xs[None, :] - centre[:, :1]) ** 2)  # (N, W)
+    gy = np.exp(inv * (ys[None, :] - centre[:, 1:]) ** 2)  # (N, H)
+    gy *= in_frame[:, None]
+    heatmaps = np.einsum('nh,nw->nhw', gy, gx).astype(dtype, copy=False)
+    return heatmaps, in_frame
+
+
+def heatmap_cache_key(gaze, size, sigma, version=None):
+    """Cache key from the gaze data (or an explicit annotation version) and the parameters."""
+    h = hashlib.sha1()
+    if version is not None:
+        h.update(str(version).encode('utf-8'))
+    else:
+        h.update(np.ascontiguousarray(gaze, dtype=np.float32).tobytes())
+    h.update(f"{tuple(size)}:{float(sigma)}".encode('utf-8'))
+    return h.hexdigest()[:16]
+
+
+def cached_heatmaps(gaze, cache_dir, size=(64, 64), sigma=3.0, version=None, batch_size=4096):
+    """Heatmaps for all gaze points, persisted as a memory-mapped .npy in cache_dir.
+
+    The file name encodes heatmap_cache_key(), so new or edited annotations
+    (or a different resolution/sigma) produce a new file rather than stale
+    targets. Maps are stored as float16 and generated batch by batch straight
+    into the memmap. Returns (heatmaps memmap, in_frame).
+    """
+    gaze = np.asarray(gaze, dtype=np.float32).reshape(-1, 2)
+    height, width = size
+    key = heatmap_cache_key(gaze, size, sigma, version)
+    path = os.path.join(cache_dir, f"heatmaps_{height}x{width}_{key}.npy")
+    in_frame = in_frame_mask(gaze)
+    if os.path.exists(path):
+        return np.load(path, mmap_mode='r'), in_frame
+
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_path = path + '.tmp'
+    out = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=np.float16, shape=(len(gaze), height, width))
+    for start in range(0, len(gaze), batch_size):
+        out[start:start + batch_size], _ = gaze_heatmaps(gaze[start:start + batch_size], size, sigma, dtype=np.float16)
+    out.flush()
+    del out
+    os.replace(tmp_path, path)
+    return np.load(path, mmap_mode='r'), in_frame
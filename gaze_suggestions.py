@@ -0,0 +1,167 @@
+import os
+import json
+import hashlib
+import importlib
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+
+from PIL import Image
+
+# Model-based gaze hints for /api/gaze_suggest.
+#
+# A model is named by a 'module:factory' spec; the factory is called once in
+# each worker process and returns a callable mapping an image path to
+# {'bbox': [x, y, w, h], 'gaze': [x, y]} in normalised coordinates. Inference
+# runs in a process pool off the request thread, results are cached on disk
+# by image content hash, and upcoming images are predicted ahead of time.
+
+
+class CenterPriorModel:
+    """Tiny stand-in model: a face box in the upper centre looking at the image centre.
+
+    Cheap and deterministic, for tests and for exercising the pipeline
+    without real weights (spec 'gaze_suggestions:CenterPriorModel').
+    """
+
+    def __call__(self, image_path):
+        with Image.open(image_path) as img:
+            width, height = img.size
+        side = min(width, height) * 0.2
+        w, h = side / width, side / height
+        return {'bbox': [0.5 - w / 2, 0.15, w, h], 'gaze': [0.5, 0.5]}
+
+
+def load_model(spec):
+    module_name, _, attr = spec.partition(':')
+    factory = getattr(importlib.import_module(module_name), attr)
+    return factory()
+
+
+_worker_model = None
+
+
+def _init_worker(spec):
+    global _worker_model
+    _worker_model = load_model(spec)
+
+
+def _predict(image_path):
+    return _worker_model(image_path)
+
+
+class SuggestionService:
+    """Runs a suggestion model in a worker pool with a per-image disk cache.
+
+    get() answers from the cache, or waits up to `wait` seconds for an
+    in-flight prediction, and returns None when the model is busy so the
+    caller can fall back to dataset metadata. prefetch() queues predictions
+    for images the annotator will see next. At most max_pending predictions
+    are queued at once. The pool is started lazily in the process that first
+    uses it, so a gunicorn master can build the service before forking.
+    """
+
+    def __init__(self, model_spec, cache_dir, workers=1, wait=0.05, max_pending=16):
+        self.model_spec = model_spec
+        self.cache_dir = cache_dir
+        self.workers = workers
+        self.wait = wait
+        self.max_pending = max_pending
+        self._pool = None
+        self._pool_pid = None
+        self._pending = {}  # content hash -> Future
+        self._hashes = {}  # path -> (size, mtime_ns, content hash)
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _get_pool(self):
+        if self._pool is None or self._pool_pid != os.getpid():
+            self._pool = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker,
+                                             initargs=(self.model_spec,))
+            self._pool_pid = os.getpid()
+            self._pending = {}
+        return self._pool
+
+    def content_hash(self, image_path):
+        st = os.stat(image_path)
+        known = self._hashes.get(image_path)
+        if known and known[:2] == (st.st_size, st.st_mtime_ns):
+            return known[2]
+        h = hashlib.sha256(self.model_spec.encode('utf-8'))
+        with open(image_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                h.update(chunk)
+        digest = h.hexdigest()
+        self._hashes[image_path] = (st.st_size, st.st_mtime_ns, digest)
+        return digest
+
+    def _cache_path(self, digest):
+        return os.path.join(self.cache_dir, f"{digest}.json")
+
+    def cached(self, image_path):
+        try:
+            with open(self._cache_path(self.content_hash(image_path)), 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _store(self, digest, future):
+        with self._lock:
+            self._pending.pop(digest, None)
+        try:
+            result = future.result()
+        except Exception as e:
+            print(f"Suggestion model failed: {e}")
+            return
+        tmp_path = self._cache_path(digest) + f'.{os.getpid()}.tmp'
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(result, f)
+            os.replace(tmp_path, self._cache_path(digest))
+        except OSError as e:
+            print(f"Could not cache suggestion {digest}: {e}")
+
+    def _submit(self, image_path):
+        """Queue a prediction unless cached, in flight or over the pending limit."""
+        digest = self.content_hash(image_path)
+        if os.path.exists(self._cache_path(digest)):
+            return None
+        with self._lock:
+            pool = self._get_pool()
+            future = self._pending.get(digest)
+            if future is not None:
+                return future
+            if len(self._pending) >= self.max_pending:
+                return None
+            future = pool.submit(_predict, image_path)
+            self._pending[digest] = future
+        # Outside the lock: the callback runs immediately if already done
+        future.add_done_callback(lambda f, d=digest: self._store(d, f))
+        return future
+
+    def get(self, image_path):
+        """Model suggestion for image_path, or None if it is not ready in time."""
+        result = self.cached(image_path)
+        if result is not None:
+            return result
+        future = self._submit(image_path)
+        if future is None:
+            return self.cached(image_path)
+        try:
+            return future.result(timeout=self.wait)
+        except TimeoutError:
+            return None
+        except Exception as e:
+            print(f"Suggestion model failed: {e}")
+            return None
+
+    def prefetch(self, image_paths):
+        for image_path in image_paths:
+            try:
+                self._submit(image_path)
+            except OSError:
+                continue
+
+    def shutdown(self):
+        if self._pool is not None and self._pool_pid == os.getpid():
+            self._pool.shutdown(wait=False, cancel_futures=True)
+        self._pool = None
@@ -0,0 +1,18 @@
+import gc
+import os
+
+# Gunicorn settings for the annotation app. Start with:
+#   gunicorn -c gunicorn.conf.py "app:create_app()"
+#
+# preload_app loads the dataset JSON and the merged_images scan once in the
+# master; workers are forked afterwards and share that memory copy-on-write.
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '5000')}"
+workers = int(os.environ.get('WEB_CONCURRENCY', '1'))
+preload_app = True
+
+
+def when_ready(server):
+    # Move everything allocated during preload into the permanent generation so
+    # the cyclic GC in each worker does not touch (and thereby copy) those pages.
+    gc.freeze()
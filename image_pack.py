@@ -0,0 +1,171 @@
+import argparse
+import hashlib
+import io
+import json
+import mmap
+import os
+import struct
+import sys
+
+from PIL import Image
+
+from image_resolver import build_vat_index, default_merged_root, resolve_merged_path
+
+# Single-file image store. A pack is
+#
+#   MAGIC | image bytes, concatenated | index JSON | trailer
+#
+# where the trailer is the index offset and length (two little-endian u64)
+# followed by INDEX_MAGIC. The index maps each dataset path (the 'path' of a
+# combined_gazefollow_vat.json entry) to its offset, length, width, height,
+# sha256 and the file it came from relative to merged_images. Readers map
+# the pack once and slice images out of it, so serving an image needs no
+# per-file open/stat, and deploying the image set is one file copy.
+
+MAGIC = b'GZPACK01'
+INDEX_MAGIC = b'GZPKIDX1'
+TRAILER = struct.Struct('<QQ8s')
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_PACK_NAME = 'images.pack'
+
+
+def build_pack(entries, merged_root, pack_path):
+    """Write every resolvable image of entries into a pack at pack_path; returns the image count."""
+    vat_index = build_vat_index(os.path.join(merged_root, 'vat'))
+    index = {}
+    tmp_path = pack_path + '.tmp'
+    with open(tmp_path, 'wb') as out:
+        out.write(MAGIC)
+        for entry in entries:
+            key = entry.get('path')
+            if not key or key in index:
+                continue
+            full_path = resolve_merged_path(key, merged_root, vat_index)
+            if not full_path:
+                print(f"Missing image, not packed: {key}")
+                continue
+            with open(full_path, 'rb') as f:
+                data = f.read()
+            with Image.open(full_path) as img:
+                width, height = img.size
+            index[key] = {
+                'offset': out.tell(),
+                'length': len(data),
+                'width': width,
+                'height': height,
+                'sha256': hashlib.sha256(data).hexdigest(),
+                'file': os.path.relpath(full_path, merged_root).replace(os.sep, '/'),
+            }
+            out.write(data)
+        index_offset = out.tell()
+        index_bytes = json.dumps(index).encode('utf-8')
+        out.write(index_bytes)
+        out.write(TRAILER.pack(index_offset, len(index_bytes), INDEX_MAGIC))
+    os.replace(tmp_path, pack_path)
+    return len(index)
+
+
+class ImagePack:
+    """Read-only view of a pack file, memory-mapped once per process."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mm[:len(MAGIC)] != MAGIC or len(self._mm) < len(MAGIC) + TRAILER.size:
+            raise ValueError(f"{path} is not an image pack")
+        index_offset, index_length, magic = TRAILER.unpack(self._mm[-TRAILER.size:])
+        if magic != INDEX_MAGIC:
+            raise ValueError(f"{path} has no pack index")
+        self.index = json.loads(self._mm[index_offset:index_offset + index_length])
+
+    def __contains__(self, key):
+        return key in self.index
+
+    def __len__(self):
+        return len(self.index)
+
+    def info(self, key):
+        return self.index.get(key)
+
+    def view(self, key):
+        """Zero-copy memoryview of an image's bytes, or None."""
+        info = self.index.get(key)
+        if info is None:
+            return None
+        return memoryview(self._mm)[info['offset']:info['offset'] + info['length']]
+
+    def open(self, key):
+        """Seekable file object over an image's bytes in the mapping, or None."""
+        view = self.view(key)
+        return None if view is None else PackReader(view)
+
+    def read(self, key):
+        """An image's bytes (one copy out of the mapping), or None."""
+        info = self.index.get(key)
+        if info is None:
+            return None
+        return self._mm[info['offset']:info['offset'] + info['length']]
+
+    def verify(self):
+        """Keys whose bytes no longer match their recorded sha256."""
+        return [key for key, info in self.index.items() if hashlib.sha256(self.view(key)).hexdigest() != info['sha256']]
+
+
+class PackReader(io.RawIOBase):
+    """Read-only file object over a memoryview, so responses can stream a slice of the pack."""
+
+    def __init__(self, view):
+        self._view = view
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self._pos, io.SEEK_END: len(self._view)}[whence]
+        self._pos = max(0, base + offset)
+        return self._pos
+
+    def readinto(self, buffer):
+        chunk = self._view[self._pos:self._pos + len(buffer)]
+        buffer[:len(chunk)] = chunk
+        self._pos += len(chunk)
+        return len(chunk)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build or check a single-file image pack.")
+    sub = parser.add_subparsers(dest='command', required=True)
+    build = sub.add_parser('build', help="pack the images of a selection")
+    build.add_argument('dataset', nargs='?', default=os.path.join(ROOT_DIR, 'combined_gazefollow_vat.json'))
+    build.add_argument('--merged-root', default=default_merged_root())
+    build.add_argument('-o', '--output', help=f"pack file (default: <merged-root>/{DEFAULT_PACK_NAME})")
+    check = sub.add_parser('verify', help="re-hash every image in a pack")
+    check.add_argument('pack')
+    args = parser.parse_args(argv)
+
+    if args.command == 'build':
+        with open(args.dataset, 'r') as f:
+            entries = json.load(f)
+        output = args.output or os.path.join(args.merged_root, DEFAULT_PACK_NAME)
+        count = build_pack(entries, args.merged_root, output)
+        print(f"Packed {count} images into {output} ({os.path.getsize(output)} bytes)")
+        return 0
+
+    pack = ImagePack(args.pack)
+    bad = pack.verify()
+    for key in bad:
+        print(f"Hash mismatch: {key}")
+    print(f"{len(pack) - len(bad)} of {len(pack)} images OK")
+    return 1 if bad else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
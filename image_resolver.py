@@ -0,0 +1,64 @@
+import os
+
+# Shared rules for locating dataset images under merged_images:
+# - GazeFollow entries ('train/...' or 'test2/...') keep their relative path
+#   under <merged_root>/gazefollow.
+# - VAT entries are bare filenames found anywhere under <merged_root>/vat
+#   (stored as <show>/<clip>/<file>); a name also matches a file with the same
+#   stem, which covers entries like '00066238.jpg.jpg'.
+
+project_root = os.path.abspath(os.path.dirname(__file__))
+
+
+def default_merged_root():
+    return os.environ.get('MERGED_ROOT', os.path.join(project_root, 'merged_images'))
+
+
+def is_gazefollow_path(path):
+    return isinstance(path, str) and (path.startswith('train/') or path.startswith('test2/'))
+
+
+def find_image_file(base_dir, filename):
+    """Recursively search for filename (with or without .jpg) in base_dir."""
+    base_name = os.path.splitext(filename)[0]  # Strip .jpg if double extension
+    for root, dirs, files in os.walk(base_dir):
+        for file in files:
+            if file == filename or os.path.splitext(file)[0] == base_name:
+                return os.path.join(root, file)
+    return None
+
+
+def build_vat_index(vat_root):
+    """Map VAT filenames and filename stems to full paths with one walk of vat_root.
+
+    Lets callers resolve many images without walking the tree per lookup.
+    """
+    index = {}
+    for root, dirs, files in os.walk(vat_root):
+        dirs.sort()
+        for file in sorted(files):
+            full_path = os.path.join(root, file)
+            index.setdefault(file, full_path)
+            index.setdefault('stem:' + os.path.splitext(file)[0], full_path)
+    return index
+
+
+def resolve_merged_path(path, merged_root=None, vat_index=None):
+    """Full path of a dataset entry's image under merged_root, or None if absent.
+
+    With a vat_index from build_vat_index() VAT lookups are O(1); without one
+    the VAT tree is searched.
+    """
+    merged_root = merged_root or default_merged_root()
+    if is_gazefollow_path(path):
+        full_path = os.path.join(merged_root, 'gazefollow', path.replace('/', os.sep))
+        return full_path if os.path.exists(full_path) else None
+
+    filename = os.path.basename(path or '')
+    if not filename:
+        return None
+    base_name = os.path.splitext(filename)[0]
+    if vat_index is not None:
+        return vat_index.get(filename) or vat_index.get('stem:' + base_name)
+    vat_root = os.path.join(merged_root, 'vat')
+    return find_image_file(vat_root, filename) or find_image_file(vat_root, base_name + '.jpg')
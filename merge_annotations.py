@@ -1,8 +1,26 @@
 import os
+import re
 import sys
 import json
+import hashlib
+import heapq
+import shutil
+import tempfile
+import zlib
+from concurrent.futures import ProcessPoolExecutor
 from glob import glob
 
+from annotation_canonical import canonicalize, canonicalize_entries
+
+
+# Shard files of a sharded store (annotations.shard-03.json, see
+# annotation_store.py) are ordinary inputs; they share their base name's annotator id.
+_SHARD_SUFFIX = re.compile(r'\.shard-\d+$')
+
+
+def annotator_id_for(path):
+    return _SHARD_SUFFIX.sub('', os.path.splitext(os.path.basename(path))[0])
+
 
 def load_annotations(path):
     try:
@@ -13,25 +31,92 @@ def load_annotations(path):
         return []
 
 
+def iter_json_array(path, chunk_size=1 << 16):
+    """Yield the elements of a top-level JSON array one at a time.
+
+    Only the current element (plus one read chunk) is held in memory, so large
+    participant files can be merged without json.load-ing them whole.
+    Raises ValueError if the file does not contain a JSON array.
+    """
+    decoder = json.JSONDecoder()
+    with open(path, 'r') as f:
+        buf, pos, eof = '', 0, False
+
+        def read_more():
+            nonlocal buf, pos, eof
+            chunk = f.read(chunk_size)
+            if not chunk:
+                eof = True
+            buf = buf[pos:] + chunk
+            pos = 0
+
+        def peek():
+            # Next non-whitespace character, or '' at end of file
+            nonlocal pos
+            while True:
+                while pos < len(buf) and buf[pos] in ' \t\r\n':
+                    pos += 1
+                if pos < len(buf):
+                    return buf[pos]
+                if eof:
+                    return ''
+                read_more()
+
+        if peek() != '[':
+            raise ValueError("top-level value is not a JSON array")
+        pos += 1
+        if peek() == ']':
+            return
+        while True:
+            peek()
+            while True:
+                try:
+                    item, end = decoder.raw_decode(buf, pos)
+                except json.JSONDecodeError:
+                    if eof:
+                        raise
+                    read_more()
+                    continue
+                if end >= len(buf) and not eof:
+                    # A scalar may have been cut off at the chunk boundary
+                    read_more()
+                    continue
+                break
+            pos = end
+            yield item
+            c = peek()
+            if c == ',':
+                pos += 1
+            elif c == ']':
+                return
+            else:
+                raise ValueError(f"unexpected {c!r} in JSON array at offset {pos}")
+
+
 def normalize_entry(entry):
-    # Ensure expected structure; tolerate extra keys
+    # Ensure expected structure; tolerate extra keys. The server saves the
+    # annotator's session uid with each entry; keep it for --tag-annotator.
     idx = entry.get('index')
     anns = entry.get('annotations', [])
     if not isinstance(anns, list):
         anns = []
-    return {'index': idx, 'annotations': anns}
+    uid = entry.get('uid')
+    return {'index': idx, 'annotations': anns, 'uid': uid if isinstance(uid, str) and uid else None}
 
 
-def merge_inputs(input_files, add_annotator=False):
+def merge_inputs(input_files, add_annotator=False, canonical=False):
     by_image = {}
 
     for path in input_files:
-        src = os.path.basename(path)
-        annotator_id = os.path.splitext(src)[0] if add_annotator else None
+        annotator_id = annotator_id_for(path) if add_annotator else None
         data = load_annotations(path)
         if not isinstance(data, list):
             print(f"Skipping non-list file: {path}")
             continue
+        if canonical:
+            data, problems = canonicalize_entries(data)
+            if problems:
+                print(f"Canonicalised {path}: {dict(problems)}")
         for entry in data:
             entry = normalize_entry(entry)
             for ann in entry['annotations']:
@@ -43,7 +128,7 @@ def merge_inputs(input_files, add_annotator=False):
                     image_path = '__unknown__'
                 # Optionally tag each annotation with annotator id
                 if annotator_id and 'annotator_id' not in ann:
-                    ann['annotator_id'] = annotator_id
+                    ann['annotator_id'] = entry['uid'] or annotator_id
                 by_image.setdefault(image_path, []).append(ann)
 
     # Build consolidated list with fresh sequential indices
@@ -59,17 +144,367 @@ def merge_inputs(input_files, add_annotator=False):
     return merged
 
 
+def _bucket_of(image_path, buckets):
+    return zlib.crc32(image_path.encode('utf-8')) % buckets
+
+
+def _spill_input_file(task):
+    """Parse one input file and spill its annotations to per-bucket JSONL files.
+
+    Each spilled line is [file_idx, seq, image_path, annotation]; (file_idx, seq)
+    records the original order so the merged output matches merge_inputs().
+    A file that turns out to be invalid part-way contributes nothing, as in
+    merge_inputs(): whatever it already spilled is deleted. Runs in a worker process.
+    """
+    file_idx, path, spill_dir, buckets, add_annotator, canonical, flush_records = task
+    annotator_id = annotator_id_for(path) if add_annotator else None
+    pending = {}
+    pending_count = 0
+    seq = 0
+
+    def flush():
+        nonlocal pending, pending_count
+        for bucket, lines in pending.items():
+            spill_path = os.path.join(spill_dir, f"b{bucket:04d}.f{file_idx:06d}.jsonl")
+            with open(spill_path, 'a') as out:
+                out.writelines(lines)
+        pending = {}
+        pending_count = 0
+
+    try:
+        for entry in iter_json_array(path):
+            if not isinstance(entry, dict):
+                continue
+            entry = normalize_entry(entry)
+            if canonical:
+                entry['annotations'] = canonicalize(entry['annotations'])[0]
+            for ann in entry['annotations']:
+                if not isinstance(ann, dict):
+                    continue
+                image_path = ann.get('image_path') or '__unknown__'
+                if annotator_id and 'annotator_id' not in ann:
+                    ann['annotator_id'] = entry['uid'] or annotator_id
+                line = json.dumps([file_idx, seq, image_path, ann]) + '\n'
+                pending.setdefault(_bucket_of(image_path, buckets), []).append(line)
+                pending_count += 1
+                seq += 1
+                if pending_count >= flush_records:
+                    flush()
+    except Exception as e:
+        if isinstance(e, ValueError) and not isinstance(e, json.JSONDecodeError):
+            print(f"Skipping non-list file: {path} ({e})")
+        else:
+            print(f"Failed to load {path}: {e}")
+        suffix = f".f{file_idx:06d}.jsonl"
+        for name in os.listdir(spill_dir):
+            if name.endswith(suffix):
+                os.remove(os.path.join(spill_dir, name))
+        return 0
+    flush()
+    return seq
+
+
+def _group_bucket(spill_dir, bucket):
+    """Group one bucket's spilled annotations by image_path.
+
+    Writes one line per image, [file_idx, seq, image_path, annotations], sorted
+    by first appearance, and returns the path of that file.
+    """
+    prefix = f"b{bucket:04d}."
+    records = []
+    for name in sorted(os.listdir(spill_dir)):
+        if name.startswith(prefix):
+            with open(os.path.join(spill_dir, name), 'r') as f:
+                for line in f:
+                    records.append(json.loads(line))
+            os.remove(os.path.join(spill_dir, name))
+    records.sort(key=lambda r: (r[0], r[1]))
+
+    groups = {}
+    for file_idx, seq, image_path, ann in records:
+        group = groups.get(image_path)
+        if group is None:
+            groups[image_path] = [file_idx, seq, image_path, [ann]]
+        else:
+            group[3].append(ann)
+
+    grouped_path = os.path.join(spill_dir, f"g{bucket:04d}.jsonl")
+    with open(grouped_path, 'w') as out:
+        for group in groups.values():  # dict order == first-appearance order
+            out.write(json.dumps(group) + '\n')
+    return grouped_path
+
+
+def _iter_grouped(path):
+    with open(path, 'r') as f:
+        for line in f:
+            yield json.loads(line)
+
+
+def merge_inputs_streaming(input_files, output_file, add_annotator=False, workers=None,
+                           buckets=64, flush_records=10000, canonical=False, in_memory_limit=256 << 20):
+    """Merge like merge_inputs() but with bounded memory, writing output_file.
+
+    Inputs totalling at most in_memory_limit bytes are simply merged in memory.
+    Larger ones are parsed in a process pool with an incremental JSON reader and
+    their annotations are hash-partitioned by image_path into spill files on
+    disk. Each partition is then grouped in memory on its own, and the groups
+    are merged back into first-appearance order while the output is written
+    entry by entry. Up to `workers` partitions are grouped at once, so peak
+    memory is roughly workers * (input size / buckets); raise buckets to lower
+    it. The output is written to a temporary file and renamed into place, so
+    a failed run leaves any previous output intact. Returns the number of images.
+    """
+    total_size = 0
+    for path in input_files:
+        try:
+            total_size += os.path.getsize(path)
+        except OSError:
+            pass
+    if total_size <= in_memory_limit:
+        merged = merge_inputs(input_files, add_annotator=add_annotator, canonical=canonical)
+        _write_json_atomic(output_file, merged)
+        return len(merged)
+
+    out_dir = os.path.dirname(os.path.abspath(output_file))
+    spill_dir = tempfile.mkdtemp(prefix='merge_spill_', dir=out_dir)
+    tmp_path = output_file + '.tmp'
+    try:
+        tasks = [(i, path, spill_dir, buckets, add_annotator, canonical, flush_records)
+                 for i, path in enumerate(input_files)]
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            list(pool.map(_spill_input_file, tasks))
+            grouped_files = list(pool.map(_group_bucket, [spill_dir] * buckets, range(buckets)))
+
+        streams = [_iter_grouped(p) for p in grouped_files]
+        count = 0
+        with open(tmp_path, 'w') as out:
+            out.write('[')
+            for _file_idx, _seq, image_path, annotations in heapq.merge(*streams, key=lambda g: (g[0], g[1])):
+                if count:
+                    out.write(', ')
+                json.dump({'index': count, 'annotations': annotations, 'image_path': image_path}, out)
+                count += 1
+            out.write(']')
+            out.flush()
+            os.fsync(out.fileno())
+        os.replace(tmp_path, output_file)
+        return count
+    finally:
+        shutil.rmtree(spill_dir, ignore_errors=True)
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def file_sha256(path, chunk_size=1 << 20):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _write_json_atomic(path, data):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def load_checkpoint(path):
+    """Load an incremental-merge checkpoint; a missing or unreadable one starts fresh."""
+    try:
+        with open(path, 'r') as f:
+            checkpoint = json.load(f)
+    except FileNotFoundError:
+        checkpoint = {}
+    except Exception as e:
+        print(f"Ignoring unreadable checkpoint {path}: {e}")
+        checkpoint = {}
+    checkpoint.setdefault('inputs', {})
+    checkpoint.setdefault('sources', {})
+    checkpoint.setdefault('image_indices', {})
+    checkpoint.setdefault('next_index', 0)
+    return checkpoint
+
+
+def input_key(path, base_dir):
+    """Checkpoint key of an input: its path relative to the checkpoint's directory."""
+    return os.path.relpath(os.path.abspath(path), base_dir).replace(os.sep, '/')
+
+
+def merge_incremental(input_files, output_file, checkpoint_file, add_annotator=False, prune=False, canonical=False):
+    """Apply only new or changed input files to an existing merged output.
+
+    The checkpoint records (size, mtime, sha256) per input, keyed by its path
+    relative to the checkpoint, and the index assigned to every image_path.
+    Inputs whose size and mtime are unchanged are skipped without reading
+    them; otherwise the hash decides. For each image the checkpoint also lists
+    which input every annotation came from, so a changed input can be replaced
+    without marking the output's records. Image indices never change once
+    assigned, and an image_path that returns after being emptied gets its old
+    index back. With prune=True, inputs in the checkpoint that are no longer
+    given are removed from the output.
+    If the output is missing, unreadable or does not match the checkpoint, or
+    add_annotator differs from the last run, every input is re-read (indices
+    are still kept). canonical only applies to the inputs read in this run.
+    Returns (changed_inputs, removed_inputs, image_count).
+    """
+    checkpoint = load_checkpoint(checkpoint_file)
+    known = checkpoint['inputs']
+    sources = checkpoint['sources']
+    image_indices = checkpoint['image_indices']
+    base_dir = os.path.dirname(os.path.abspath(checkpoint_file))
+
+    previous = None
+    try:
+        with open(output_file, 'r') as f:
+            previous = json.load(f)
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        print(f"Failed to load {output_file}: {e}")
+    if not isinstance(previous, list):
+        previous = None
+
+    # image_path -> [(input key, annotation), ...] in output order
+    entries = {}
+    rebuild = None
+    if known and previous is None:
+        rebuild = f"{output_file} is missing or unreadable"
+    elif known and checkpoint.get('tag_annotator') not in (None, bool(add_annotator)):
+        rebuild = "--tag-annotator changed since the last run"
+    elif known:
+        for entry in previous:
+            image_path = (entry.get('image_path') if isinstance(entry, dict) else None) or '__unknown__'
+            anns = normalize_entry(entry)['annotations'] if isinstance(entry, dict) else []
+            owners = sources.get(image_path)
+            if not isinstance(owners, list) or len(owners) != len(anns) or image_path in entries:
+                rebuild = f"{output_file} does not match the checkpoint"
+                break
+            entries[image_path] = list(zip(owners, anns))
+    elif previous is not None:
+        # No checkpoint (e.g. the output came from a full merge): keep its
+        # indices but rebuild contents, since nothing records their inputs.
+        for entry in previous:
+            image_path = entry.get('image_path') if isinstance(entry, dict) else None
+            if image_path is not None and image_path not in image_indices:
+                image_indices[image_path] = entry.get('index')
+    if rebuild:
+        given = {input_key(path, base_dir) for path in input_files}
+        dropped = sorted(key for key in known if key not in given)
+        print(f"Re-reading all {len(given)} inputs: {rebuild}")
+        if dropped:
+            print(f"Warning: {len(dropped)} checkpointed inputs are not given and drop out of {output_file}: {', '.join(dropped[:5])}")
+        known.clear()
+        entries = {}
+    next_index = max([checkpoint['next_index']] + [i + 1 for i in image_indices.values() if isinstance(i, int)])
+
+    changed = {}
+    seen = set()
+    for path in input_files:
+        key = input_key(path, base_dir)
+        if key in seen:
+            print(f"Warning: input {key} given twice; only the first is used")
+            continue
+        seen.add(key)
+        st = os.stat(path)
+        prev = known.get(key)
+        if prev and prev.get('size') == st.st_size and prev.get('mtime_ns') == st.st_mtime_ns:
+            continue
+        digest = file_sha256(path)
+        record = {'size': st.st_size, 'mtime_ns': st.st_mtime_ns, 'sha256': digest}
+        if prev and prev.get('sha256') == digest:
+            known[key] = record  # touched but identical
+            continue
+        changed[key] = (path, record)
+
+    removed = [key for key in known if key not in seen] if prune else []
+    stale = set(changed) | set(removed)
+    if stale:
+        for image_path in list(entries):
+            entries[image_path] = [(owner, ann) for owner, ann in entries[image_path] if owner not in stale]
+
+    for key, (path, record) in changed.items():
+        annotator_id = annotator_id_for(path) if add_annotator else None
+        try:
+            for entry in iter_json_array(path):
+                if not isinstance(entry, dict):
+                    continue
+                entry = normalize_entry(entry)
+                anns = entry['annotations']
+                for ann in canonicalize(anns)[0] if canonical else anns:
+                    if not isinstance(ann, dict):
+                        continue
+                    image_path = ann.get('image_path') or '__unknown__'
+                    if annotator_id and 'annotator_id' not in ann:
+                        ann['annotator_id'] = entry['uid'] or annotator_id
+                    entries.setdefault(image_path, []).append((key, ann))
+        except Exception as e:
+            print(f"Failed to load {path}: {e}")
+            continue
+        known[key] = record
+    for key in removed:
+        del known[key]
+
+    merged = []
+    sources.clear()
+    for image_path, owned in entries.items():
+        if not owned:
+            continue
+        if image_path not in image_indices:
+            image_indices[image_path] = next_index
+            next_index += 1
+        sources[image_path] = [owner for owner, _ in owned]
+        merged.append({'index': image_indices[image_path], 'annotations': [ann for _, ann in owned],
+                       'image_path': image_path})
+    merged.sort(key=lambda e: e['index'])
+
+    checkpoint['next_index'] = next_index
+    checkpoint['tag_annotator'] = bool(add_annotator)
+    _write_json_atomic(output_file, merged)
+    _write_json_atomic(checkpoint_file, checkpoint)
+    return len(changed), len(removed), len(merged)
+
+
+def _str_option(name, default):
+    """Read a string option given as --name=value from sys.argv."""
+    prefix = f"--{name}="
+    for a in sys.argv[1:]:
+        if a.startswith(prefix):
+            return a[len(prefix):]
+    return default
+
+
+def _int_option(name, default):
+    """Read an integer option given as --name=N from sys.argv."""
+    prefix = f"--{name}="
+    for a in sys.argv[1:]:
+        if a.startswith(prefix):
+            return int(a[len(prefix):])
+    return default
+
+
 def main():
     if len(sys.argv) < 2:
-        print("Usage: python merge_annotations.py <input_dir_or_glob> [output_file] [--tag-annotator]")
+        print("Usage: python merge_annotations.py <input_dir_or_glob> [output_file] [--tag-annotator]"
+              " [--canonicalize] [--stream [--workers=N] [--buckets=N] [--in-memory-mb=N]] [--incremental [--checkpoint=FILE] [--prune]]")
         print("Examples:")
         print("  python merge_annotations.py participants/*.json annotations_merged.json --tag-annotator")
         print("  python merge_annotations.py participants annotations_merged.json")
+        print("  python merge_annotations.py participants annotations_merged.json --tag-annotator --stream --workers=8")
+        print("  python merge_annotations.py participants annotations_merged.json --tag-annotator --incremental")
         return 1
 
     input_arg = sys.argv[1]
     output_file = sys.argv[2] if len(sys.argv) >= 3 and not sys.argv[2].startswith('--') else 'annotations_merged.json'
     tag_annotator = any(a == '--tag-annotator' for a in sys.argv[1:])
+    stream = any(a == '--stream' for a in sys.argv[1:])
+    incremental = any(a == '--incremental' for a in sys.argv[1:])
+    prune = any(a == '--prune' for a in sys.argv[1:])
+    canonical = any(a == '--canonicalize' for a in sys.argv[1:])
 
     if os.path.isdir(input_arg):
         input_files = sorted(glob(os.path.join(input_arg, '*.json')))
@@ -80,10 +515,33 @@ def main():
         print(f"No input JSON files found for: {input_arg}")
         return 1
 
-    merged = merge_inputs(input_files, add_annotator=tag_annotator)
+    if incremental:
+        checkpoint_file = _str_option('checkpoint', output_file + '.checkpoint.json')
+        try:
+            changed, removed, count = merge_incremental(input_files, output_file, checkpoint_file,
+                                                        add_annotator=tag_annotator, prune=prune, canonical=canonical)
+            print(f"Updated {output_file} incrementally ({changed} new/changed, {removed} removed of "
+                  f"{len(input_files)} files, {count} images); checkpoint {checkpoint_file}")
+        except Exception as e:
+            print(f"Incremental merge into {output_file} failed: {e}")
+            return 1
+        return 0
+
+    if stream:
+        try:
+            count = merge_inputs_streaming(input_files, output_file, add_annotator=tag_annotator,
+                                           workers=_int_option('workers', None),
+                                           buckets=_int_option('buckets', 64), canonical=canonical,
+                                           in_memory_limit=_int_option('in-memory-mb', 256) << 20)
+            print(f"Wrote merged annotations to {output_file} (from {len(input_files)} files, {count} images)")
+        except Exception as e:
+            print(f"Failed to write merged file {output_file}: {e}")
+            return 1
+        return 0
+
+    merged = merge_inputs(input_files, add_annotator=tag_annotator, canonical=canonical)
     try:
-        with open(output_file, 'w') as f:
-            json.dump(merged, f)
+        _write_json_atomic(output_file, merged)
         print(f"Wrote merged annotations to {output_file} (from {len(input_files)} files, {len(merged)} images)")
     except Exception as e:
         print(f"Failed to write merged file {output_file}: {e}")
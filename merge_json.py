@@ -1,6 +1,13 @@
+import argparse
+import errno
+import hashlib
 import json
 import os
 import shutil
+import sys
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 
 # Resolve project root and dataset paths
 ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -11,84 +18,241 @@ VAT_DIR = os.path.join(ROOT_DIR, 'VAT')
 gazefollow_path = os.path.join(ROOT_DIR, 'gazefollow_selected.json')
 vat_path = os.path.join(ROOT_DIR, 'vat_selected.json')
 output_path = os.path.join(ROOT_DIR, 'combined_gazefollow_vat.json')
+merged_images_root = os.path.join(ROOT_DIR, 'merged_images')
+vat_index_cache = os.path.join(ROOT_DIR, '.vat_name_index.json')
 
-# Load Gazefollow JSON
-with open(gazefollow_path, 'r') as f:
-    gazefollow_data = json.load(f)
-
-# Load VAT JSON
-with open(vat_path, 'r') as f:
-    vat_data = json.load(f)
+# Linux ioctl to share extents between files (btrfs, XFS, ...)
+FICLONE = 0x40049409
 
-# Combine the data
-combined_data = gazefollow_data + vat_data
 
-# Save combined JSON
-with open(output_path, 'w') as f:
-    json.dump(combined_data, f, indent=4)
+def file_sha256(path, chunk_size=1 << 20):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
 
-print(f"Merged {len(gazefollow_data)} Gazefollow entries and {len(vat_data)} VAT entries into {output_path}")
 
-# Copy images into a unified folder structure
-merged_images_root = os.path.join(ROOT_DIR, 'merged_images')
-gf_out_dir = os.path.join(merged_images_root, 'gazefollow')
-vat_out_dir = os.path.join(merged_images_root, 'vat')
-os.makedirs(gf_out_dir, exist_ok=True)
-os.makedirs(vat_out_dir, exist_ok=True)
+def is_up_to_date(src_path, dest_path, use_hash=False):
+    """True if dest_path already holds src_path's content.
 
-# Helper to safely copy a file, creating subdirectories as needed
-def safe_copy(src_path, dest_root, rel_path):
+    Compares size and nanosecond mtime (copy2 preserves it), or content
+    hashes with use_hash. A hardlink to the source always counts as up to date.
+    """
     try:
-        dest_path = os.path.join(dest_root, rel_path)
-        dest_dir = os.path.dirname(dest_path)
-        os.makedirs(dest_dir, exist_ok=True)
-        shutil.copy2(src_path, dest_path)
+        dst = os.stat(dest_path)
+    except FileNotFoundError:
+        return False
+    src = os.stat(src_path)
+    if (src.st_dev, src.st_ino) == (dst.st_dev, dst.st_ino):
         return True
+    if src.st_size != dst.st_size:
+        return False
+    if use_hash:
+        return file_sha256(src_path) == file_sha256(dest_path)
+    return src.st_mtime_ns == dst.st_mtime_ns
+
+
+def reflink(src_path, dest_path):
+    """Clone src_path to dest_path sharing data blocks; raises OSError if unsupported."""
+    import fcntl
+    with open(src_path, 'rb') as src, open(dest_path, 'wb') as dst:
+        fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+    shutil.copystat(src_path, dest_path)
+
+
+def _materialise(src_path, dest_path, mode):
+    if mode == 'hardlink':
+        try:
+            os.link(src_path, dest_path)
+            return 'linked'
+        except OSError as e:
+            if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK, errno.ENOTSUP):
+                raise
+    elif mode == 'reflink':
+        try:
+            reflink(src_path, dest_path)
+            return 'cloned'
+        except (OSError, ImportError):
+            if os.path.lexists(dest_path):
+                os.remove(dest_path)
+    shutil.copy2(src_path, dest_path)
+    return 'copied'
+
+
+def sync_file(src_path, dest_path, mode='copy', use_hash=False):
+    """Bring dest_path up to date with src_path.
+
+    mode is 'copy', 'hardlink' or 'reflink'; links fall back to a copy when
+    the filesystem cannot do them. The new file is made under a temporary
+    name and renamed over dest_path, so a failure leaves the old one in
+    place. Returns 'skipped', 'copied', 'linked', 'cloned' or 'failed'.
+    """
+    tmp_path = f"{dest_path}.{os.getpid()}-{threading.get_ident()}.tmp"
+    try:
+        if is_up_to_date(src_path, dest_path, use_hash):
+            return 'skipped'
+        os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+        outcome = _materialise(src_path, tmp_path, mode)
+        os.replace(tmp_path, dest_path)
+        return outcome
     except Exception as e:
         print(f"Failed to copy {src_path} -> {dest_path}: {e}")
-        return False
+        return 'failed'
+    finally:
+        # Still there after a failure, or when tmp and dest were already links to one file
+        if os.path.lexists(tmp_path):
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+
+
+def sync_files(pairs, mode='copy', use_hash=False, workers=8):
+    """Sync (src, dest) pairs through a thread pool; returns a Counter of outcomes."""
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return Counter(pool.map(lambda p: sync_file(p[0], p[1], mode, use_hash), pairs))
+
+
+def prune_stale(root, keep):
+    """Delete files under root that are not in keep (full paths), then empty directories; returns the count deleted."""
+    removed = 0
+    for dirpath, dirs, files in os.walk(root, topdown=False):
+        for fname in files:
+            path = os.path.join(dirpath, fname)
+            if path not in keep:
+                try:
+                    os.remove(path)
+                    removed += 1
+                except OSError as e:
+                    print(f"Failed to remove {path}: {e}")
+        if dirpath != root and not os.listdir(dirpath):
+            os.rmdir(dirpath)
+    return removed
+
+
+def _scan_vat_images(vat_images_root):
+    index, dir_mtimes = {}, {}
+    for root, dirs, files in os.walk(vat_images_root):
+        dir_mtimes[root] = os.stat(root).st_mtime_ns
+        for fname in files:
+            if fname.lower().endswith('.jpg'):
+                index.setdefault(fname, []).append(os.path.join(root, fname))
+    return index, dir_mtimes
+
+
+def build_vat_name_index(vat_images_root, cache_path=None):
+    """Map VAT image filenames to their paths under vat_images_root.
+
+    The index is cached in cache_path together with the mtime of every
+    directory it covers; it is reused as long as none of those directories
+    changed (adding or removing a file or folder updates the parent's mtime).
+    """
+    if cache_path and os.path.exists(cache_path):
+        try:
+            with open(cache_path, 'r') as f:
+                cached = json.load(f)
+            if cached.get('root') == vat_images_root and cached.get('dirs') and all(
+                    os.stat(d).st_mtime_ns == m for d, m in cached['dirs'].items()):
+                return cached['index']
+        except (OSError, ValueError, KeyError):
+            pass
+
+    index, dir_mtimes = _scan_vat_images(vat_images_root)
+    if cache_path:
+        try:
+            with open(cache_path, 'w') as f:
+                json.dump({'root': vat_images_root, 'dirs': dir_mtimes, 'index': index}, f)
+        except OSError as e:
+            print(f"Warning: could not write VAT index cache {cache_path}: {e}")
+    return index
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Combine selections and sync their images into merged_images.")
+    parser.add_argument('--link', choices=['copy', 'hardlink', 'reflink'], default='copy',
+                        help="how to materialise images (links fall back to copying)")
+    parser.add_argument('--hash', action='store_true', help="compare existing targets by content hash instead of size/mtime")
+    parser.add_argument('--workers', type=int, default=8, help="copy threads")
+    parser.add_argument('--no-index-cache', action='store_true', help="rescan VAT/images instead of using the cached name index")
+    parser.add_argument('--prune', action='store_true',
+                        help="delete images under merged_images/gazefollow and merged_images/vat that are not in the current selection")
+    args = parser.parse_args(argv)
+
+    # Load Gazefollow JSON
+    with open(gazefollow_path, 'r') as f:
+        gazefollow_data = json.load(f)
+
+    # Load VAT JSON
+    with open(vat_path, 'r') as f:
+        vat_data = json.load(f)
+
+    # Combine the data
+    combined_data = gazefollow_data + vat_data
+
+    # Save combined JSON
+    with open(output_path, 'w') as f:
+        json.dump(combined_data, f, indent=4)
+
+    print(f"Merged {len(gazefollow_data)} Gazefollow entries and {len(vat_data)} VAT entries into {output_path}")
+
+    # Copy images into a unified folder structure
+    gf_out_dir = os.path.join(merged_images_root, 'gazefollow')
+    vat_out_dir = os.path.join(merged_images_root, 'vat')
+    os.makedirs(gf_out_dir, exist_ok=True)
+    os.makedirs(vat_out_dir, exist_ok=True)
+
+    # 1) Gazefollow images preserving train/test2 substructure
+    gf_pairs = []
+    for item in gazefollow_data:
+        rel_path = item.get('path', '')
+        if not rel_path:
+            continue
+        # Normalize separators and build absolute source path
+        src_path = os.path.join(GAZEFOLLOW_DIR, rel_path.replace('/', os.sep))
+        if os.path.isfile(src_path):
+            gf_pairs.append((src_path, os.path.join(gf_out_dir, rel_path.replace('/', os.sep))))
+        else:
+            print(f"Missing Gazefollow image: {src_path}")
+
+    gf_result = sync_files(gf_pairs, mode=args.link, use_hash=args.hash, workers=args.workers)
+    print(f"Synced {len(gf_pairs) - gf_result['failed']} Gazefollow images into {gf_out_dir} ({dict(gf_result)})")
+
+    # 2) Name index for VAT images to resolve paths by filename
+    vat_images_root = os.path.join(VAT_DIR, 'images')
+    vat_name_index = build_vat_name_index(vat_images_root, None if args.no_index_cache else vat_index_cache)
+
+    # VAT images by filename matching, keeping the <show>/<clip> substructure
+    vat_pairs = []
+    for item in vat_data:
+        fname = item.get('path', '')
+        if not fname:
+            continue
+        candidates = vat_name_index.get(fname)
+        if candidates:
+            # Choose the first match; if multiple exist this may be ambiguous
+            src_path = candidates[0]
+            # src_path structure: VAT/images/<show>/<clip>/<fname>
+            rel_path = os.path.relpath(src_path, vat_images_root)
+            vat_pairs.append((src_path, os.path.join(vat_out_dir, rel_path)))
+        else:
+            print(f"Missing VAT image by name index: {fname}")
+
+    vat_result = sync_files(vat_pairs, mode=args.link, use_hash=args.hash, workers=args.workers)
+    print(f"Synced {len(vat_pairs) - vat_result['failed']} VAT images into {vat_out_dir} ({dict(vat_result)})")
+
+    if args.prune:
+        # Selected images whose source is missing keep their existing copy
+        gf_keep = {os.path.join(gf_out_dir, item['path'].replace('/', os.sep)) for item in gazefollow_data if item.get('path')}
+        gf_removed = prune_stale(gf_out_dir, gf_keep)
+        vat_names = {item['path'] for item in vat_data if item.get('path')}
+        vat_keep = {dest for _, dest in vat_pairs}
+        for dirpath, dirs, files in os.walk(vat_out_dir):
+            vat_keep.update(os.path.join(dirpath, f) for f in files if f in vat_names)
+        vat_removed = prune_stale(vat_out_dir, vat_keep)
+        print(f"Pruned {gf_removed} Gazefollow and {vat_removed} VAT images that are no longer selected")
+    return 0
+
 
-# 1) Copy Gazefollow images preserving train/test2 substructure
-gf_copied = 0
-for item in gazefollow_data:
-    rel_path = item.get('path', '')
-    if not rel_path:
-        continue
-    # Normalize separators and build absolute source path
-    src_path = os.path.join(GAZEFOLLOW_DIR, rel_path.replace('/', os.sep))
-    if os.path.isfile(src_path):
-        if safe_copy(src_path, gf_out_dir, rel_path):
-            gf_copied += 1
-    else:
-        print(f"Missing Gazefollow image: {src_path}")
-
-print(f"Copied {gf_copied} Gazefollow images into {gf_out_dir}")
-
-# 2) Build a name index for VAT images to resolve paths by filename
-vat_name_index = {}
-vat_images_root = os.path.join(VAT_DIR, 'images')
-for root, dirs, files in os.walk(vat_images_root):
-    for fname in files:
-        if fname.lower().endswith('.jpg'):
-            vat_name_index.setdefault(fname, []).append(os.path.join(root, fname))
-
-# Copy VAT images using filename matching, flattening into clip/show substructure if derivable
-vat_copied = 0
-for item in vat_data:
-    fname = item.get('path', '')
-    if not fname:
-        continue
-    candidates = vat_name_index.get(fname)
-    if candidates:
-        # Choose the first match; if multiple exist this may be ambiguous
-        src_path = candidates[0]
-        # Derive relative path under vat_out_dir as <show>/<clip>/<fname> if possible
-        # src_path structure: VAT/images/<show>/<clip>/<fname>
-        rel_parts = os.path.relpath(src_path, vat_images_root).split(os.sep)
-        rel_path = os.path.join(*rel_parts)
-        if safe_copy(src_path, vat_out_dir, rel_path):
-            vat_copied += 1
-    else:
-        print(f"Missing VAT image by name index: {fname}")
-
-print(f"Copied {vat_copied} VAT images into {vat_out_dir}")
\ No newline at end of file
+if __name__ == '__main__':
+    sys.exit(main())
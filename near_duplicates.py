@@ -0,0 +1,199 @@
+import argparse
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+from image_resolver import build_vat_index, default_merged_root, resolve_merged_path
+
+# Near-duplicate detection with 64-bit difference hashes (dHash). Two frames
+# whose hashes differ in at most `radius` bits are treated as the same shot;
+# consecutive frames of a VAT clip typically differ by only a few bits.
+# Hashes are computed in a process pool, cached by path/size/mtime, and
+# looked up in a BK-tree so a radius query only visits a few nodes.
+
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_RADIUS = 6
+
+
+def dhash(path, hash_size=8):
+    """Difference hash of an image as an int, or None if it cannot be read."""
+    try:
+        with Image.open(path) as img:
+            img.draft('L', (hash_size * 4, hash_size * 4))  # Let JPEG decode at reduced scale
+            small = img.convert('L').resize((hash_size + 1, hash_size), Image.LANCZOS)
+    except Exception:
+        return None
+    pixels = np.asarray(small, dtype=np.int16)
+    bits = np.packbits(pixels[:, 1:] > pixels[:, :-1])
+    return int.from_bytes(bits.tobytes(), 'big')
+
+
+def hamming(a, b):
+    return bin(a ^ b).count('1')
+
+
+class BKTree:
+    """Burkhard-Keller tree over hashes under Hamming distance."""
+
+    def __init__(self):
+        self.root = None  # [hash, item, {distance: child}]
+        self.size = 0
+
+    def add(self, value, item):
+        self.size += 1
+        if self.root is None:
+            self.root = [value, item, {}]
+            return
+        node = self.root
+        while True:
+            d = hamming(value, node[0])
+            child = node[2].get(d)
+            if child is None:
+                node[2][d] = [value, item, {}]
+                return
+            node = child
+
+    def find(self, value, radius):
+        """(distance, item) for every stored hash within radius of value."""
+        found = []
+        stack = [self.root] if self.root is not None else []
+        while stack:
+            node = stack.pop()
+            d = hamming(value, node[0])
+            if d <= radius:
+                found.append((d, node[1]))
+            # Triangle inequality: only children at distance d±radius can match
+            for child_d, child in node[2].items():
+                if d - radius <= child_d <= d + radius:
+                    stack.append(child)
+        return found
+
+
+def load_hash_cache(cache_path):
+    try:
+        with open(cache_path, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError, TypeError):
+        return {}
+
+
+def save_hash_cache(cache_path, cache):
+    tmp_path = cache_path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(cache, f)
+    os.replace(tmp_path, cache_path)
+
+
+def compute_hashes(paths, workers=None, cache=None, pool=None):
+    """dHash for each path (None if unreadable), reusing and updating cache in place.
+
+    Hashing runs in pool if given, otherwise in a pool of `workers` processes made for this call.
+    """
+    cache = {} if cache is None else cache
+    hashes, todo = [None] * len(paths), []
+    for i, path in enumerate(paths):
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        known = cache.get(path)
+        if known and known[:2] == [st.st_size, st.st_mtime_ns]:
+            hashes[i] = known[2]
+        else:
+            todo.append((i, path, st))
+    if todo and pool is None:
+        with ProcessPoolExecutor(max_workers=workers) as own_pool:
+            return compute_hashes(paths, cache=cache, pool=own_pool)
+    if todo:
+        for (i, path, st), value in zip(todo, pool.map(dhash, [p for _, p, _ in todo], chunksize=16)):
+            hashes[i] = value
+            if value is not None:
+                cache[path] = [st.st_size, st.st_mtime_ns, value]
+    return hashes
+
+
+def select_unique(paths, size, radius=DEFAULT_RADIUS, workers=None, cache=None, pool=None):
+    """Indices of up to `size` paths, in order, skipping near-duplicates of earlier picks.
+
+    Candidates are hashed in batches just large enough to fill the
+    selection, so a long shuffled candidate list is not hashed in full.
+    All batches share one process pool (pool, or one made for this call).
+    Images that cannot be hashed are kept. Returns (indices, skipped count).
+    """
+    if pool is None:
+        # Worker processes only start when a batch has uncached images
+        with ProcessPoolExecutor(max_workers=workers) as own_pool:
+            return select_unique(paths, size, radius, cache=cache, pool=own_pool)
+    tree, picked, skipped = BKTree(), [], 0
+    start = 0
+    while len(picked) < size and start < len(paths):
+        batch = paths[start:start + max(64, 2 * (size - len(picked)))]
+        for offset, value in enumerate(compute_hashes(batch, cache=cache, pool=pool)):
+            if len(picked) >= size:
+                break
+            if value is not None:
+                if tree.find(value, radius):
+                    skipped += 1
+                    continue
+                tree.add(value, start + offset)
+            picked.append(start + offset)
+        start += len(batch)
+    return picked, skipped
+
+
+def find_duplicate_groups(paths, radius=DEFAULT_RADIUS, workers=None, cache=None):
+    """Groups of path indices whose hashes chain together within radius."""
+    hashes = compute_hashes(paths, workers, cache)
+    tree = BKTree()
+    parent = list(range(len(paths)))
+
+    def root(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for i, value in enumerate(hashes):
+        if value is None:
+            continue
+        for _, j in tree.find(value, radius):
+            parent[root(i)] = root(j)
+        tree.add(value, i)
+    groups = {}
+    for i in range(len(paths)):
+        groups.setdefault(root(i), []).append(i)
+    return [group for group in groups.values() if len(group) > 1]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Report near-duplicate images in a selection.")
+    parser.add_argument('dataset', nargs='?', default=os.path.join(ROOT_DIR, 'combined_gazefollow_vat.json'))
+    parser.add_argument('--merged-root', default=default_merged_root())
+    parser.add_argument('--radius', type=int, default=DEFAULT_RADIUS, help="max differing hash bits (of 64)")
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--cache', default=os.path.join(ROOT_DIR, 'phash_cache.json'), help="hash cache ('' disables)")
+    args = parser.parse_args(argv)
+
+    with open(args.dataset, 'r') as f:
+        entries = json.load(f)
+    vat_index = build_vat_index(os.path.join(args.merged_root, 'vat'))
+    paths = sorted({p for p in (resolve_merged_path(e.get('path'), args.merged_root, vat_index) for e in entries) if p})
+
+    cache = load_hash_cache(args.cache) if args.cache else {}
+    groups = find_duplicate_groups(paths, args.radius, args.workers, cache)
+    if args.cache:
+        save_hash_cache(args.cache, cache)
+
+    for group in groups:
+        print(' '.join(os.path.relpath(paths[i], args.merged_root) for i in group))
+    duplicates = sum(len(group) - 1 for group in groups)
+    print(f"{len(groups)} groups of near-duplicates; {duplicates} of {len(paths)} images add little over another")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
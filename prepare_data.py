@@ -1,10 +1,40 @@
+import argparse
 import json
+import math
 import random
 import os
+import sys
+
+# Default locations of the GazeFollow release files (override on the command line)
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+GAZEFOLLOW_DIR = os.environ.get('GAZEFOLLOW_DIR', os.path.join(ROOT_DIR, 'Gazefollow'))
+train_annotations_file = os.path.join(GAZEFOLLOW_DIR, 'train_annotations_release.txt')
+test_annotations_file = os.path.join(GAZEFOLLOW_DIR, 'test_annotations_release.txt')
+
+
+# Function to parse one annotation line
+def parse_annotation_line(line):
+    parts = line.strip().split(',')
+    if len(parts) < 16:
+        return None
+    path = parts[0]
+    left = float(parts[2])
+    top = float(parts[3])
+    right = float(parts[4])
+    bottom = float(parts[5])
+    if top > bottom:
+        top, bottom = bottom, top
+    bbox = [left, top, right - left, bottom - top]
+    eye = [float(parts[6]), float(parts[7])]
+    gaze = [float(parts[8]), float(parts[9])]
+    return {
+        'path': path,
+        'bbox': bbox,
+        'eye': eye,
+        'gaze': gaze,
+        'type': 'image'
+    }
 
-# Paths to annotation files
-train_annotations_file = r'C:\Users\anjal\OneDrive\Desktop\Thesis\Gazefollow\train_annotations_release.txt'
-test_annotations_file = r'C:\Users\anjal\OneDrive\Desktop\Thesis\Gazefollow\test_annotations_release.txt'
 
 # Function to parse annotations
 def parse_annotations(file_path):
@@ -12,37 +42,123 @@ def parse_annotations(file_path):
     with open(file_path, 'r') as f:
         for line in f:
             if line.strip():
-                parts = line.strip().split(',')
-                if len(parts) >= 16:
-                    path = parts[0]
-                    left = float(parts[2])
-                    top = float(parts[3])
-                    right = float(parts[4])
-                    bottom = float(parts[5])
-                    if top > bottom:
-                        top, bottom = bottom, top
-                    bbox = [left, top, right - left, bottom - top]
-                    eye = [float(parts[6]), float(parts[7])]
-                    gaze = [float(parts[8]), float(parts[9])]
-                    annotations.append({
-                        'path': path,
-                        'bbox': bbox,
-                        'eye': eye,
-                        'gaze': gaze,
-                        'type': 'image'
-                    })
+                ann = parse_annotation_line(line)
+                if ann is not None:
+                    annotations.append(ann)
     return annotations
 
-# Load all annotations
-all_annotations = parse_annotations(train_annotations_file) + parse_annotations(test_annotations_file)
 
-# Select 250 random
-random.shuffle(all_annotations)
-selected_gazefollow = all_annotations[:250]
+class Reservoir:
+    """Fixed-size uniform sample of a stream (Li's Algorithm L).
+
+    After the reservoir fills, the number of items to skip before the next
+    replacement is drawn directly, so most offered items cost one comparison.
+    """
+
+    def __init__(self, size, rng):
+        self.size = size
+        self.rng = rng
+        self.items = []
+        self.seen = 0
+        self._w = 1.0
+        self._next = size
+
+    def _u(self):
+        # Uniform in (0, 1], safe for log()
+        return 1.0 - self.rng.random()
+
+    def _advance(self):
+        self._w *= math.exp(math.log(self._u()) / self.size)
+        if self._w >= 1.0:
+            self._next += 1
+            return
+        self._next += int(math.log(self._u()) / math.log(1.0 - self._w)) + 1
+
+    def offer(self, item):
+        i = self.seen
+        self.seen += 1
+        if i < self.size:
+            self.items.append(item)
+            if self.seen == self.size:
+                self._next = self.size - 1
+                self._advance()
+        elif i == self._next:
+            self.items[self.rng.randrange(self.size)] = item
+            self._advance()
+
+
+STRATA = {
+    # train/00000045/00045811.jpg -> train
+    'split': lambda path: path.split('/', 1)[0],
+    # train/00000045/00045811.jpg -> train/00000045
+    'scene': lambda path: path.rsplit('/', 1)[0],
+}
+
+
+def sample_annotations(file_paths, size, seed=None, stratify=None):
+    """Sample annotation entries from GazeFollow release files in one streaming pass.
+
+    Lines are parsed before they are offered, so unparseable lines never take
+    a place in the sample. Memory is O(size) (O(size per stratum) with
+    `stratify`, one of STRATA, where `size` is drawn from every stratum).
+    The result is shuffled.
+    """
+    if size < 1:
+        raise ValueError("sample size must be at least 1")
+    rng = random.Random(seed)
+    reservoirs = {}
+    stratum_of = STRATA[stratify] if stratify else None
+    for file_path in file_paths:
+        with open(file_path, 'r') as f:
+            for line in f:
+                # Cheap check first; parse_annotation_line needs 16 fields
+                if line.count(',') < 15:
+                    continue
+                try:
+                    ann = parse_annotation_line(line)
+                except ValueError:
+                    continue
+                key = stratum_of(ann['path']) if stratum_of else None
+                reservoir = reservoirs.get(key)
+                if reservoir is None:
+                    reservoir = reservoirs[key] = Reservoir(size, rng)
+                reservoir.offer(ann)
+
+    selected = []
+    for key in sorted(reservoirs, key=str):
+        selected.extend(reservoirs[key].items)
+    rng.shuffle(selected)
+    return selected
+
+
+def _positive_int(value):
+    n = int(value)
+    if n < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, got {n}")
+    return n
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Sample GazeFollow annotations into gazefollow_selected.json.")
+    parser.add_argument('inputs', nargs='*', default=[train_annotations_file, test_annotations_file],
+                        help="annotation release files (default: train and test files under Gazefollow/)")
+    parser.add_argument('-n', '--size', type=_positive_int, default=250,
+                        help="number of entries to select (per stratum with --stratify)")
+    parser.add_argument('--seed', type=int, default=0, help="random seed (fixed by default for reproducibility)")
+    parser.add_argument('--stratify', choices=sorted(STRATA), help="sample per train/test split or per scene directory")
+    parser.add_argument('-o', '--output', default='gazefollow_selected.json')
+    args = parser.parse_args(argv)
+
+    selected_gazefollow = sample_annotations(args.inputs, args.size, seed=args.seed, stratify=args.stratify)
+
+    # Output to JSON
+    output_path = os.path.abspath(args.output)
+    with open(output_path, 'w') as f:
+        json.dump(selected_gazefollow, f, indent=4)
+
+    print(f"Selected {len(selected_gazefollow)} from GazeFollow and saved to {output_path}")
+    return 0
 
-# Output to JSON
-output_path = os.path.abspath('gazefollow_selected.json')
-with open(output_path, 'w') as f:
-    json.dump(selected_gazefollow, f, indent=4)
 
-print(f"Selected {len(selected_gazefollow)} from GazeFollow and saved to {output_path}")
+if __name__ == '__main__':
+    sys.exit(main())
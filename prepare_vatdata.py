@@ -1,71 +1,211 @@
+import argparse
 import json
-import random
+import logging
 import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
 
-# Path to the VAT dataset folder (update this!)
-vat_path = r'C:\Users\anjal\OneDrive\Desktop\Thesis\VAT'  # Adjust to your actual path
+import numpy as np
 
-# Function to parse .txt annotations with debugging
+from near_duplicates import DEFAULT_RADIUS, load_hash_cache, save_hash_cache, select_unique
+from prepare_data import _positive_int
+
+log = logging.getLogger('prepare_vatdata')
+
+# Path to the VAT dataset folder (override with VAT_DIR or --vat-dir)
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+vat_path = os.environ.get('VAT_DIR', os.path.join(ROOT_DIR, 'VAT'))
+
+
+# Function to parse .txt annotations
 def parse_txt_annotations(file_path):
-    annotations = []
-    print(f"Processing file: {file_path}")
+    """Parse one VAT annotation file into columns.
+
+    Returns (images, frames, boxes, gaze_x) where boxes are [x, y, w, h] in
+    pixels and gaze_x is -1 for out-of-frame targets.
+    """
+    images, frames, boxes, gaze_xs = [], [], [], []
+    log.debug("Processing file: %s", file_path)
     with open(file_path, 'r', encoding='utf-8') as f:
         for line_idx, line in enumerate(f, 1):
             line = line.strip()
             if line and not line.startswith('#'):  # Skip comments or empty lines
                 parts = line.split(',')
-                print(f"Line {line_idx}: {parts}")  # Debug: Print each line's parts
                 if len(parts) == 7:  # Expecting image, frame, x1,y1,x2,y2, gaze_x (or -1)
                     try:
                         image = parts[0].strip()
                         # Only append .jpg if not already present
                         if not image.lower().endswith('.jpg'):
                             image += '.jpg'
-                        print(f"Processed image name: {image} from original {parts[0].strip()}")
                         frame = int(parts[1])
                         x1, y1, x2, y2 = map(float, parts[2:6])  # Bounding box corners
-                        # Convert x1,y1,x2,y2 to x,y,w,h
-                        bbox = [x1, y1, x2 - x1, y2 - y1]  # Width and height
                         gaze_x = float(parts[6])
-                        # Use gaze_x if valid, otherwise set to None; assume gaze_y missing
-                        gaze = [gaze_x, -1.0] if gaze_x >= 0 else [-1.0, -1.0]
-                        # Eye position placeholder (derive from bbox center)
-                        eye = [x1 + (x2 - x1) / 2, y1 + (y2 - y1) / 2]
-                        annotations.append({
-                            'path': image,
-                            'frame': frame,
-                            'bbox': bbox,  # [x, y, w, h] in pixels (to be normalized later if needed)
-                            'eye': eye,    # Placeholder
-                            'gaze': gaze,  # [x, y] in pixels (to be normalized later if needed)
-                            'type': 'image'
-                        })
                     except (ValueError, IndexError) as e:
-                        print(f"Error parsing line {line_idx}: {e} - Skipping line: {line}")
+                        log.warning("%s:%d: %s - skipping line: %s", file_path, line_idx, e, line)
+                        continue
+                    images.append(image)
+                    frames.append(frame)
+                    # Convert x1,y1,x2,y2 to x,y,w,h
+                    boxes.append((x1, y1, x2 - x1, y2 - y1))
+                    gaze_xs.append(gaze_x if gaze_x >= 0 else -1.0)
                 else:
-                    print(f"Line {line_idx} has incorrect parts: {len(parts)} - Skipping: {line}")
-    return annotations
-
-# Recursively find and parse all .txt files in annotations/train
-annotations = []
-for root, dirs, files in os.walk(os.path.join(vat_path, 'annotations', 'train')):
-    for file in files:
-        if file.endswith('.txt'):
-            file_path = os.path.join(root, file)
-            annotations.extend(parse_txt_annotations(file_path))
-
-print(f"Total annotations loaded: {len(annotations)} from {len(files)} .txt files.")
-
-# Select 250 random diverse entries
-if annotations:
-    random.shuffle(annotations)
-    selected_vat = annotations[:250]
-else:
-    print("No annotations found. Check file format or path.")
-    selected_vat = []
-
-# Output to JSON
-output_path = os.path.abspath('vat_selected.json')
-with open(output_path, 'w') as f:
-    json.dump(selected_vat, f, indent=4)
-
-print(f"Selected {len(selected_vat)} from VAT and saved to {output_path}")
\ No newline at end of file
+                    log.debug("%s:%d has %d parts - skipping: %s", file_path, line_idx, len(parts), line)
+    return (images,
+            np.asarray(frames, dtype=np.int32),
+            np.asarray(boxes, dtype=np.float64).reshape(-1, 4),
+            np.asarray(gaze_xs, dtype=np.float64))
+
+
+def list_annotation_files(annotations_root):
+    """Sorted (relative path, mtime_ns) for every .txt file under annotations_root."""
+    found = []
+    for root, dirs, files in os.walk(annotations_root):
+        for file in files:
+            if file.endswith('.txt'):
+                full = os.path.join(root, file)
+                rel = os.path.relpath(full, annotations_root).replace(os.sep, '/')
+                found.append((rel, os.stat(full).st_mtime_ns))
+    found.sort()
+    return found
+
+
+def parse_all(annotations_root, files, workers=None):
+    """Parse all annotation files in a process pool into one columnar dict.
+
+    `clip` indexes into `clips` (the <show>/<clip> folder of each file) and
+    `track` into `files` (the annotation file itself).
+    """
+    paths = [os.path.join(annotations_root, rel) for rel, _ in files]
+    clips, clip_codes, track_codes = {}, [], []
+    images, frames, boxes, gaze_xs = [], [], [], []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for track, ((rel, _), result) in enumerate(zip(files, pool.map(parse_txt_annotations, paths, chunksize=16))):
+            f_images, f_frames, f_boxes, f_gaze = result
+            clip = clips.setdefault(os.path.dirname(rel), len(clips))
+            clip_codes.append(np.full(len(f_images), clip, dtype=np.int32))
+            track_codes.append(np.full(len(f_images), track, dtype=np.int32))
+            images.extend(f_images)
+            frames.append(f_frames)
+            boxes.append(f_boxes)
+            gaze_xs.append(f_gaze)
+
+    def cat(parts, dtype, shape=(0,)):
+        return np.concatenate(parts) if parts else np.empty(shape, dtype=dtype)
+
+    return {
+        'image': np.asarray(images, dtype=str),
+        'frame': cat(frames, np.int32),
+        'bbox': cat(boxes, np.float64, (0, 4)),
+        'gaze_x': cat(gaze_xs, np.float64),
+        'clip': cat(clip_codes, np.int32),
+        'clips': np.asarray(list(clips), dtype=str),
+        'track': cat(track_codes, np.int32),
+        'files': np.asarray([rel for rel, _ in files], dtype=str),
+        'mtimes': np.asarray([m for _, m in files], dtype=np.int64),
+    }
+
+
+def load_or_parse(annotations_root, cache_path, workers=None, reparse=False):
+    """Return parsed columns, reusing cache_path when the annotation files are unchanged."""
+    files = list_annotation_files(annotations_root)
+    if cache_path and os.path.exists(cache_path) and not reparse:
+        try:
+            with np.load(cache_path) as cached:
+                columns = {k: cached[k] for k in cached.files}
+            if columns['files'].tolist() == [rel for rel, _ in files] and \
+                    columns['mtimes'].tolist() == [m for _, m in files]:
+                log.info("Reusing parsed annotations from %s", cache_path)
+                return columns
+            log.info("Annotation files changed since %s was written; re-parsing", cache_path)
+        except Exception as e:
+            log.warning("Ignoring unreadable cache %s: %s", cache_path, e)
+
+    columns = parse_all(annotations_root, files, workers=workers)
+    log.info("Total annotations loaded: %d from %d .txt files.", len(columns['frame']), len(files))
+    if cache_path:
+        np.savez(cache_path, **columns)
+        log.info("Wrote columnar cache to %s", cache_path)
+    return columns
+
+
+def to_entry(columns, i):
+    """Build the vat_selected.json entry for row i."""
+    x, y, w, h = columns['bbox'][i].tolist()
+    gaze_x = float(columns['gaze_x'][i])
+    return {
+        'path': str(columns['image'][i]),
+        'frame': int(columns['frame'][i]),
+        'bbox': [x, y, w, h],  # [x, y, w, h] in pixels (to be normalized later if needed)
+        'eye': [x + w / 2, y + h / 2],  # Placeholder: bbox centre
+        'gaze': [gaze_x, -1.0] if gaze_x >= 0 else [-1.0, -1.0],  # gaze_y is not in the source files
+        'type': 'image'
+    }
+
+
+def select_entries(columns, size, seed=None, images_root=None, radius=0, workers=None, hash_cache=None):
+    """Pick `size` random rows without replacement.
+
+    With images_root and radius > 0, rows whose frame is a near-duplicate
+    (dHash within radius bits) of an already picked frame are skipped.
+    """
+    n = len(columns['frame'])
+    rng = np.random.default_rng(seed)
+    rows = rng.permutation(n) if n else np.empty(0, dtype=np.int64)
+    if images_root and radius > 0:
+        clips = columns['clips']
+        paths = [os.path.join(images_root, str(clips[columns['clip'][i]]), str(columns['image'][i])) for i in rows]
+        picked, skipped = select_unique(paths, size, radius, workers=workers, cache=hash_cache)
+        log.info("Skipped %d near-duplicate frames (radius %d)", skipped, radius)
+        rows = rows[picked]
+    return [to_entry(columns, i) for i in rows[:size]]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Parse VAT annotations and select entries into vat_selected.json.")
+    parser.add_argument('--vat-dir', default=vat_path, help="VAT dataset folder (default: VAT/ or VAT_DIR)")
+    parser.add_argument('-n', '--size', type=_positive_int, default=250, help="number of entries to select")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=None, help="parser processes (default: CPU count)")
+    parser.add_argument('--cache', default='vat_annotations.npz', help="columnar cache of parsed annotations ('' disables)")
+    parser.add_argument('--reparse', action='store_true', help="ignore the cache and re-read all .txt files")
+    parser.add_argument('--dedup-radius', type=int, default=DEFAULT_RADIUS,
+                        help="skip frames within this many dHash bits of a picked frame (0 disables)")
+    parser.add_argument('--hash-cache', default='vat_phash_cache.json', help="perceptual hash cache ('' disables)")
+    parser.add_argument('-o', '--output', default='vat_selected.json')
+    parser.add_argument('-v', '--verbose', action='store_true', help="log every file and skipped line")
+    parser.add_argument('-q', '--quiet', action='store_true', help="only log warnings and errors")
+    args = parser.parse_args(argv)
+
+    level = logging.DEBUG if args.verbose else logging.WARNING if args.quiet else logging.INFO
+    logging.basicConfig(level=level, format='%(message)s')
+
+    # Recursively find and parse all .txt files in annotations/train
+    annotations_root = os.path.join(args.vat_dir, 'annotations', 'train')
+    columns = load_or_parse(annotations_root, args.cache, workers=args.workers, reparse=args.reparse)
+
+    # Select random diverse entries
+    images_root = os.path.join(args.vat_dir, 'images')
+    if args.dedup_radius > 0 and not os.path.isdir(images_root):
+        log.warning("%s not found; selecting without near-duplicate filtering", images_root)
+        images_root = None
+    hash_cache = load_hash_cache(args.hash_cache) if args.hash_cache else {}
+    if len(columns['frame']):
+        selected_vat = select_entries(columns, args.size, seed=args.seed, images_root=images_root,
+                                      radius=args.dedup_radius, workers=args.workers, hash_cache=hash_cache)
+        if args.hash_cache and images_root:
+            save_hash_cache(args.hash_cache, hash_cache)
+    else:
+        log.warning("No annotations found. Check file format or path.")
+        selected_vat = []
+
+    # Output to JSON
+    output_path = os.path.abspath(args.output)
+    with open(output_path, 'w') as f:
+        json.dump(selected_vat, f, indent=4)
+
+    log.info("Selected %d from VAT and saved to %s", len(selected_vat), output_path)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
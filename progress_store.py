@@ -0,0 +1,136 @@
+import hashlib
+import hmac
+import os
+import re
+import threading
+
+_UID_RE = re.compile(r'^[A-Za-z0-9_.-]{1,64}$')
+
+
+def valid_uid(uid):
+    return isinstance(uid, str) and bool(_UID_RE.match(uid)) and uid not in ('.', '..')
+
+
+class ProgressStore:
+    """Per-user completion bitmaps, one small file per uid.
+
+    Bit i is set once the user has submitted image slot i (their list index in
+    fixed mode, the scheduler image id in coverage mode). Each submit rewrites
+    only that user's bitmap, and the first incomplete slot is tracked as a
+    moving hint, so finding where a user left off never scans annotations.json.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._bits = {}  # uid -> (mtime_ns, bytearray)
+        self._first = {}  # uid -> lowest slot that may be incomplete
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, uid):
+        if not valid_uid(uid):
+            raise ValueError(f"invalid uid: {uid!r}")
+        return os.path.join(self.directory, f"{uid}.bits")
+
+    def _load(self, uid):
+        path = self._path(uid)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        cached = self._bits.get(uid)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+        bits = bytearray()
+        if mtime is not None:
+            with open(path, 'rb') as f:
+                bits = bytearray(f.read())
+        self._bits[uid] = (mtime, bits)
+        # First byte with a clear bit bounds the first incomplete slot
+        full = len(bits) - len(bits.lstrip(b'\xff'))
+        self._first[uid] = full * 8
+        return bits
+
+    def _save(self, uid, bits):
+        path = self._path(uid)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(bits)
+        os.replace(tmp_path, path)
+        self._bits[uid] = (os.stat(path).st_mtime_ns, bits)
+
+    def is_done(self, uid, slot):
+        with self._lock:
+            bits = self._load(uid)
+            byte = slot >> 3
+            return byte < len(bits) and bool(bits[byte] & (1 << (slot & 7)))
+
+    def mark(self, uid, slot):
+        """Record that uid completed slot."""
+        with self._lock:
+            bits = self._load(uid)
+            byte = slot >> 3
+            if byte >= len(bits):
+                bits.extend(b'\x00' * (byte + 1 - len(bits)))
+            mask = 1 << (slot & 7)
+            if bits[byte] & mask:
+                return
+            bits[byte] |= mask
+            self._save(uid, bits)
+
+    def first_incomplete(self, uid):
+        """Lowest slot uid has not completed (amortised O(1) across submits)."""
+        with self._lock:
+            bits = self._load(uid)
+            slot = self._first.get(uid, 0)
+            while (slot >> 3) < len(bits) and bits[slot >> 3] & (1 << (slot & 7)):
+                slot += 1
+            self._first[uid] = slot
+            return slot
+
+    def completed_count(self, uid):
+        with self._lock:
+            return sum(bin(b).count('1') for b in self._load(uid))
+
+
+class AnnotatorKeys:
+    """Passphrases that protect the annotator IDs chosen through /identify.
+
+    The first time an ID is identified, a salted PBKDF2 hash of its
+    passphrase is stored in <uid>.key; afterwards the same passphrase is
+    needed to continue as that ID.
+    """
+
+    def __init__(self, directory, iterations=200_000):
+        self.directory = directory
+        self.iterations = iterations
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, uid):
+        if not valid_uid(uid):
+            raise ValueError(f"invalid uid: {uid!r}")
+        return os.path.join(self.directory, f"{uid}.key")
+
+    def _hash(self, passphrase, salt):
+        return hashlib.pbkdf2_hmac('sha256', passphrase.encode('utf-8'), salt, self.iterations).hex()
+
+    def check(self, uid, passphrase):
+        """True if passphrase matches uid's, claiming uid for it if no passphrase is stored yet."""
+        path = self._path(uid)
+        try:
+            with open(path, 'r') as f:
+                salt, expected = f.read().split(':')
+        except FileNotFoundError:
+            salt = os.urandom(16)
+            tmp_path = f"{path}.{os.getpid()}-{threading.get_ident()}.tmp"
+            with open(tmp_path, 'w') as f:
+                f.write(f"{salt.hex()}:{self._hash(passphrase, salt)}")
+            try:
+                # Fails if another request claimed uid first; its passphrase then decides
+                os.link(tmp_path, path)
+                return True
+            except FileExistsError:
+                return self.check(uid, passphrase)
+            finally:
+                os.remove(tmp_path)
+        return hmac.compare_digest(self._hash(passphrase, bytes.fromhex(salt)), expected)
@@ -0,0 +1,237 @@
+import argparse
+import datetime
+import hashlib
+import json
+import os
+import shutil
+import sys
+
+from annotation_store import AnnotationStore, parse_entries
+
+# Backups of the annotations store. A snapshot reads each shard under its
+# lock, which is held only for as long as reading the bytes into memory, so
+# each copy is a state its shard really had. Shards are read one after
+# another, so a write that spans shards (a clip save) may be only partly in
+# a snapshot; with one shard it is a point-in-time copy of the store.
+# Everything slow (checking entries, writing, fsyncing and re-reading the
+# copy) happens after the lock is released. Each snapshot is a directory
+# <dir>/<stem>-<UTC time>/ with one file per shard (same names as the live
+# store) and a manifest.json with their sha256. It only appears under its
+# final name once it has been verified. The newest `keep` snapshots are kept.
+
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+MANIFEST_NAME = 'manifest.json'
+DEFAULT_KEEP = 24
+
+
+def default_snapshot_dir(annotations_path):
+    return os.path.join(os.path.dirname(os.path.abspath(annotations_path)), 'snapshots')
+
+
+def _snapshot_prefix(store):
+    return os.path.splitext(os.path.basename(store.path))[0] + '-'
+
+
+def check_entries(entries, shard, shards):
+    """Problems with a shard's entries: bad entries, duplicate indices, indices of another shard."""
+    problems, seen = [], set()
+    for position, entry in enumerate(entries):
+        if not isinstance(entry, dict) or not isinstance(entry.get('annotations'), list):
+            problems.append(f"entry {position} is not an {{index, annotations}} object")
+            continue
+        index = entry.get('index')
+        if not isinstance(index, int):
+            problems.append(f"entry {position} has index {index!r}")
+        elif index in seen:
+            problems.append(f"index {index} appears twice")
+        elif shards > 1 and index % shards != shard:
+            problems.append(f"index {index} belongs to shard {index % shards}")
+        seen.add(index)
+    return problems
+
+
+def _fsync_dir(path):
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def take_snapshot(store, directory, keep=DEFAULT_KEEP):
+    """Write a verified snapshot of store under directory, prune old ones and return its manifest.
+
+    Raises ValueError if a shard is not a JSON list (e.g. it was damaged outside
+    the app), in which case no snapshot is written and none are pruned. Entry
+    problems from check_entries are recorded in the manifest as warnings.
+    """
+    contents = [store.read_bytes(shard) for shard in range(store.shards)]
+    created = datetime.datetime.now(datetime.timezone.utc)
+    files, warnings = {}, []
+    for shard, data in enumerate(contents):
+        entries = parse_entries(data, store.path_of(shard))
+        warnings.extend(f"{os.path.basename(store.path_of(shard))}: {p}" for p in check_entries(entries, shard, store.shards))
+        files[os.path.basename(store.path_of(shard))] = {
+            'shard': shard,
+            'bytes': len(data),
+            'entries': len(entries),
+            'sha256': hashlib.sha256(data).hexdigest(),
+        }
+
+    name = _snapshot_prefix(store) + created.strftime('%Y%m%dT%H%M%S.%fZ')
+    final_path = os.path.join(directory, name)
+    tmp_path = final_path + '.tmp'
+    os.makedirs(tmp_path)
+    try:
+        for (file_name, info), data in zip(files.items(), contents):
+            with open(os.path.join(tmp_path, file_name), 'wb') as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+        manifest = {
+            'name': name,
+            'created_at': created.timestamp(),
+            'source': os.path.abspath(store.path),
+            'shards': store.shards,
+            'entries': sum(info['entries'] for info in files.values()),
+            'files': files,
+            'warnings': len(warnings),
+            'warning_sample': warnings[:20],
+        }
+        with open(os.path.join(tmp_path, MANIFEST_NAME), 'w') as f:
+            json.dump(manifest, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        problems = verify_snapshot(tmp_path)
+        if problems:
+            raise ValueError(f"snapshot {name} failed verification: {'; '.join(problems[:5])}")
+        os.rename(tmp_path, final_path)
+        _fsync_dir(directory)
+    except BaseException:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        raise
+    prune_snapshots(store, directory, keep)
+    return manifest
+
+
+def verify_snapshot(path):
+    """Problems found re-reading a snapshot directory against its manifest; [] if it is intact."""
+    try:
+        with open(os.path.join(path, MANIFEST_NAME), 'r') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError) as e:
+        return [f"unreadable manifest: {e}"]
+    problems = []
+    for file_name, info in manifest.get('files', {}).items():
+        try:
+            with open(os.path.join(path, file_name), 'rb') as f:
+                data = f.read()
+        except OSError as e:
+            problems.append(f"{file_name}: {e}")
+            continue
+        if hashlib.sha256(data).hexdigest() != info.get('sha256'):
+            problems.append(f"{file_name}: sha256 mismatch")
+            continue
+        try:
+            entries = parse_entries(data, file_name)
+        except ValueError as e:
+            problems.append(str(e))
+            continue
+        if len(entries) != info.get('entries'):
+            problems.append(f"{file_name}: {len(entries)} entries, manifest says {info.get('entries')}")
+    return problems
+
+
+def list_snapshots(store, directory):
+    """Manifests of the store's snapshots under directory, newest first."""
+    prefix = _snapshot_prefix(store)
+    try:
+        names = sorted((n for n in os.listdir(directory) if n.startswith(prefix) and not n.endswith('.tmp')), reverse=True)
+    except OSError:
+        return []
+    manifests = []
+    for name in names:
+        try:
+            with open(os.path.join(directory, name, MANIFEST_NAME), 'r') as f:
+                manifests.append(json.load(f))
+        except (OSError, ValueError):
+            continue
+    return manifests
+
+
+def prune_snapshots(store, directory, keep):
+    """Delete all but the newest `keep` snapshots; returns the names removed."""
+    removed = []
+    for manifest in list_snapshots(store, directory)[max(1, keep):]:
+        shutil.rmtree(os.path.join(directory, manifest['name']), ignore_errors=True)
+        removed.append(manifest['name'])
+    return removed
+
+
+def restore_snapshot(store, path):
+    """Verify a snapshot and write it back over the live store, one shard lock at a time."""
+    problems = verify_snapshot(path)
+    if problems:
+        raise ValueError(f"not restoring {path}: {'; '.join(problems[:5])}")
+    with open(os.path.join(path, MANIFEST_NAME), 'r') as f:
+        manifest = json.load(f)
+    if manifest['shards'] != store.shards:
+        raise ValueError(f"{path} has {manifest['shards']} shards, the store has {store.shards}")
+    store.init_files()
+    for file_name, info in manifest['files'].items():
+        with open(os.path.join(path, file_name), 'rb') as f:
+            store.write(info['shard'], parse_entries(f.read(), file_name))
+    return manifest
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Take, list, verify or restore snapshots of the annotations store.")
+    parser.add_argument('--annotations', default=os.environ.get('ANNOTATIONS_PATH', os.path.join(ROOT_DIR, 'annotations.json')))
+    parser.add_argument('--shards', type=int, default=int(os.environ.get('ANNOTATION_SHARDS', 1)))
+    parser.add_argument('--dir', default=os.environ.get('SNAPSHOT_DIR'), help="snapshot directory (default: snapshots/ next to the annotations)")
+    sub = parser.add_subparsers(dest='command', required=True)
+    create = sub.add_parser('create', help="take a snapshot now")
+    create.add_argument('--keep', type=int, default=int(os.environ.get('SNAPSHOT_KEEP', DEFAULT_KEEP)))
+    sub.add_parser('list', help="list snapshots, newest first")
+    check = sub.add_parser('verify', help="re-check snapshots against their manifests")
+    check.add_argument('names', nargs='*', help="snapshot names (default: all)")
+    restore = sub.add_parser('restore', help="write a snapshot back over the store")
+    restore.add_argument('name')
+    args = parser.parse_args(argv)
+
+    store = AnnotationStore(args.annotations, args.shards)
+    directory = args.dir or default_snapshot_dir(args.annotations)
+
+    if args.command == 'create':
+        manifest = take_snapshot(store, directory, args.keep)
+        print(f"Snapshot {manifest['name']}: {manifest['entries']} entries in {len(manifest['files'])} file(s)")
+        for warning in manifest['warning_sample']:
+            print(f"Warning: {warning}")
+        if manifest['warnings'] > len(manifest['warning_sample']):
+            print(f"... {manifest['warnings']} warnings in all")
+        return 0
+    if args.command == 'list':
+        for manifest in list_snapshots(store, directory):
+            print(f"{manifest['name']}  {manifest['entries']} entries")
+        return 0
+    if args.command == 'verify':
+        names = args.names or [m['name'] for m in list_snapshots(store, directory)]
+        failed = 0
+        for name in names:
+            problems = verify_snapshot(os.path.join(directory, name))
+            print(f"{name}: {'; '.join(problems) if problems else 'OK'}")
+            failed += bool(problems)
+        return 1 if failed else 0
+
+    manifest = restore_snapshot(store, os.path.join(directory, args.name))
+    print(f"Restored {manifest['entries']} entries from {manifest['name']} into {args.annotations}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
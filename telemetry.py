@@ -0,0 +1,299 @@
+import json
+import math
+import os
+import re
+import threading
+import time
+
+import portalocker
+
+# Annotator timing from the labelling page. Each submitted (or skipped) image
+# produces one event:
+#
+#   image_fetch_ms   request to last byte of the image (resource timing)
+#   image_decode_ms  decoding the loaded image
+#   first_bbox_ms    image shown -> first box started
+#   submit_ms        image shown -> submit
+#   resets           'Reset Last Annotation' clicks
+#
+# The page posts events in batches. They are counted into fixed-bucket
+# histograms overall, per image and per annotator, so memory does not grow
+# with the number of events. Each process periodically writes its histograms
+# to its own file under the telemetry directory. snapshot() adds those files
+# to the live counts, so all workers and earlier runs are included.
+#
+# Files of processes that have exited are folded into one compacted file
+# (on start-up and on every flush), so the directory holds one file per live
+# worker plus that one. A process counts as exited when its pid is not
+# running on this machine, so the directory must not be shared between
+# machines. The compacted file lists the files it has absorbed, and readers
+# skip those, so a compaction interrupted before deleting them counts nothing
+# twice.
+
+MS_BOUNDS = (10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000, 120000, 300000)
+COUNT_BOUNDS = (0, 1, 2, 3, 5, 10)
+METRICS = {
+    'image_fetch_ms': MS_BOUNDS,
+    'image_decode_ms': MS_BOUNDS,
+    'first_bbox_ms': MS_BOUNDS,
+    'submit_ms': MS_BOUNDS,
+    'resets': COUNT_BOUNDS,
+}
+MAX_VALUE = 24 * 3600 * 1000  # anything larger is a stale tab, not a measurement
+COMPACTED_NAME = 'telemetry-compacted.json'
+LOCK_NAME = 'telemetry.lock'
+_PROCESS_FILE = re.compile(r'^telemetry-(\d+)-(\d+)\.json$')
+
+
+def _empty():
+    return {metric: [0] * (len(bounds) + 1) for metric, bounds in METRICS.items()}
+
+
+def _bucket(bounds, value):
+    for i, bound in enumerate(bounds):
+        if value <= bound:
+            return i
+    return len(bounds)
+
+
+def _merge(into, counts):
+    for metric, buckets in counts.items():
+        if metric in into and len(buckets) == len(into[metric]):
+            into[metric] = [a + b for a, b in zip(into[metric], buckets)]
+
+
+def _add(state, other):
+    """Add a flushed state (or the compacted file) to state in place."""
+    state['events'] += other.get('events', 0)
+    _merge(state['overall'], other.get('overall', {}))
+    for key in ('per_image', 'per_annotator'):
+        for owner, counts in other.get(key, {}).items():
+            _merge(state[key].setdefault(owner, _empty()), counts)
+
+
+def _process_alive(pid):
+    """Whether pid is running on this machine; True where that cannot be checked safely."""
+    if os.name == 'nt':
+        return True  # os.kill would terminate the process
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        return True
+    return True
+
+
+def summarize(metric, buckets):
+    """n, p50 and p90 (bucket upper bounds; None past the last bound) and the histogram of one metric."""
+    bounds = METRICS[metric]
+    n = sum(buckets)
+
+    def quantile(q):
+        if not n:
+            return None
+        target, seen = math.ceil(q * n), 0
+        for i, count in enumerate(buckets):
+            seen += count
+            if seen >= target:
+                return bounds[i] if i < len(bounds) else None
+        return None
+
+    return {'n': n, 'p50': quantile(0.5), 'p90': quantile(0.9),
+            'histogram': [[bound, count] for bound, count in zip(list(bounds) + [None], buckets)]}
+
+
+class TelemetryAggregator:
+    """In-memory histograms of annotator timing with periodic flush to directory."""
+
+    def __init__(self, directory, flush_seconds=60, clock=time.time):
+        self.directory = directory
+        self.flush_seconds = flush_seconds
+        self.clock = clock
+        self.started = int(clock())
+        self.overall = _empty()
+        self.per_image = {}  # image path -> metric -> buckets
+        self.per_annotator = {}  # uid -> metric -> buckets
+        self.events = 0
+        self._last_flush = clock()
+        self._dirty = False
+        self._lock = threading.Lock()
+        self._files = {}  # path -> ((mtime_ns, size), parsed contents) of other processes' files
+        self._files_lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self.compact()
+
+    def record(self, uid, events):
+        """Count (image path, event dict) pairs; returns how many carried at least one valid metric."""
+        accepted = 0
+        with self._lock:
+            for image_path, event in events:
+                values = {}
+                for metric, bounds in METRICS.items():
+                    value = event.get(metric)
+                    if isinstance(value, (int, float)) and not isinstance(value, bool) \
+                            and math.isfinite(value) and 0 <= value <= MAX_VALUE:
+                        values[metric] = _bucket(bounds, value)
+                if not values:
+                    continue
+                image = self.per_image.setdefault(image_path, _empty())
+                annotator = self.per_annotator.setdefault(uid or 'unknown', _empty())
+                for metric, i in values.items():
+                    self.overall[metric][i] += 1
+                    image[metric][i] += 1
+                    annotator[metric][i] += 1
+                accepted += 1
+            self.events += accepted
+            self._dirty = self._dirty or bool(accepted)
+            due = self._dirty and self.clock() - self._last_flush >= self.flush_seconds
+        if due:
+            self.flush()
+        return accepted
+
+    @property
+    def path(self):
+        # Taken at flush time: with gunicorn's preload_app the aggregator is
+        # created before the workers are forked, and each needs its own file
+        return os.path.join(self.directory, f"telemetry-{self.started}-{os.getpid()}.json")
+
+    def _state(self):
+        return {'events': self.events, 'overall': self.overall,
+                'per_image': self.per_image, 'per_annotator': self.per_annotator}
+
+    def flush(self):
+        """Write this process's histograms to its file (replacing the previous flush) if they changed."""
+        with self._lock:
+            if not self._dirty:
+                return
+            data = json.dumps(self._state())
+            self._dirty = False
+            self._last_flush = self.clock()
+        path = self.path
+        tmp_path = path + '.tmp'
+        try:
+            with open(tmp_path, 'w') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"Warning: could not flush telemetry to {path}: {e}")
+        self.compact()
+
+    def _names(self):
+        try:
+            return sorted(n for n in os.listdir(self.directory) if n.startswith('telemetry-') and n.endswith('.json'))
+        except OSError:
+            return []
+
+    def _load(self, path):
+        """Parsed contents of a telemetry file, re-read only when its (mtime, size) changes; None if unreadable."""
+        try:
+            st = os.stat(path)
+        except OSError:
+            self._files.pop(path, None)
+            return None
+        signature = (st.st_mtime_ns, st.st_size)
+        cached = self._files.get(path)
+        if cached is not None and cached[0] == signature:
+            return cached[1]
+        try:
+            with open(path, 'r') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            data = None
+        if not isinstance(data, dict):
+            data = None
+        self._files[path] = (signature, data)
+        return data
+
+    def compact(self):
+        """Fold the files of processes that have exited into COMPACTED_NAME and delete them."""
+        try:
+            lock = portalocker.Lock(os.path.join(self.directory, LOCK_NAME), 'a', timeout=0, fail_when_locked=True)
+            lock.acquire()
+        except (OSError, portalocker.LockException):
+            return  # another process is compacting
+        try:
+            with self._files_lock:
+                self._compact_locked()
+        except OSError as e:
+            print(f"Warning: could not compact telemetry in {self.directory}: {e}")
+        finally:
+            lock.release()
+
+    def _compact_locked(self):
+        """Compaction proper; runs holding the directory lock and _files_lock."""
+        compacted_path = os.path.join(self.directory, COMPACTED_NAME)
+        compacted = self._load(compacted_path) or {}
+        sources = set(compacted.get('sources', []))
+        names = self._names()
+        absorbed = [n for n in names if n in sources]
+        exited = []
+        for name in names:
+            match = _PROCESS_FILE.match(name)
+            if match and name not in sources and int(match.group(2)) != os.getpid() \
+                    and not _process_alive(int(match.group(2))):
+                exited.append(name)
+        state = {'events': 0, 'overall': _empty(), 'per_image': {}, 'per_annotator': {}}
+        _add(state, compacted)
+        merged = []
+        for name in exited:
+            other = self._load(os.path.join(self.directory, name))
+            if other is not None:
+                _add(state, other)
+                merged.append(name)
+        if merged:
+            # Only names still on disk need remembering
+            state['sources'] = sorted(set(absorbed) | set(merged))
+            tmp_path = compacted_path + '.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump(state, f)
+            os.replace(tmp_path, compacted_path)
+            absorbed = state['sources']
+        for name in absorbed:
+            path = os.path.join(self.directory, name)
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            self._files.pop(path, None)
+
+    def _combined(self):
+        with self._lock:
+            state = json.loads(json.dumps(self._state()))
+        own_path = self.path
+        with self._files_lock:
+            compacted = self._load(os.path.join(self.directory, COMPACTED_NAME)) or {}
+            skip = set(compacted.get('sources', [])) | {COMPACTED_NAME}
+            _add(state, compacted)
+            names = self._names()
+            for name in names:
+                path = os.path.join(self.directory, name)
+                if path == own_path or name in skip:
+                    continue
+                other = self._load(path)
+                if other is not None:
+                    _add(state, other)
+            # Forget files that have gone (compacted by another process)
+            present = {os.path.join(self.directory, name) for name in names}
+            for path in [p for p in self._files if p not in present]:
+                del self._files[path]
+        return state
+
+    def snapshot(self, top=20):
+        """Summaries overall and per annotator, plus the top images by median time to submit."""
+        state = self._combined()
+
+        def summary(counts):
+            return {metric: summarize(metric, buckets) for metric, buckets in counts.items()}
+
+        def median_submit(item):
+            p50 = summarize('submit_ms', item[1]['submit_ms'])['p50']
+            return math.inf if p50 is None and sum(item[1]['submit_ms']) else (p50 or 0)
+
+        slowest = sorted(state['per_image'].items(), key=median_submit, reverse=True)[:top]
+        return {
+            'events': state['events'],
+            'overall': summary(state['overall']),
+            'per_annotator': {uid: summary(counts) for uid, counts in sorted(state['per_annotator'].items())},
+            'slowest_images': [{'image_path': path, **summary(counts)} for path, counts in slowest],
+        }
@@ -0,0 +1,48 @@
+import io
+import json
+import os
+import sys
+
+import pytest
+from PIL import Image
+
+# The modules under test are top-level scripts in the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+GF_PATHS = [f'train/00000001/0000000{i}.jpg' for i in range(4)]
+
+
+def jpeg_bytes(size=(64, 48)):
+    buffer = io.BytesIO()
+    Image.effect_noise(size, 64).convert('RGB').save(buffer, 'JPEG')
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def app_config(tmp_path):
+    """make(paths=GF_PATHS, name='data', **config): config for app.create_app() over GazeFollow-style
+    images written under tmp_path/<name>. Settings kept in module globals are reset to their defaults."""
+    def make(paths=GF_PATHS, name='data', **config):
+        root = tmp_path / name
+        for path in paths:
+            image_file = root / 'merged_images' / 'gazefollow' / path
+            image_file.parent.mkdir(parents=True, exist_ok=True)
+            image_file.write_bytes(jpeg_bytes())
+        dataset = root / 'dataset.json'
+        dataset.write_text(json.dumps([{'path': path, 'bbox': [0.1, 0.1, 0.2, 0.2], 'gaze': [0.5, 0.5]}
+                                       for path in paths]))
+        return dict({
+            'TESTING': True,
+            'DATASET_JSON': str(dataset),
+            'MERGED_ROOT': str(root / 'merged_images'),
+            'ANNOTATIONS_PATH': str(root / 'annotations.json'),
+            'ANNOTATION_SHARDS': 1,
+            'PROGRESS_DIR': str(root / 'progress'),
+            'TELEMETRY_DIR': str(root / 'telemetry'),
+            'ASSIGNMENT_MODE': 'fixed',
+            'IMAGE_OFFLOAD': '',
+            'SNAPSHOT_TOKEN': '',
+            'ADMIN_TOKEN': '',
+            'SUGGESTION_MODEL': '',
+        }, **config)
+    return make
@@ -0,0 +1,73 @@
+import json
+
+import pytest
+
+from annotation_store import AnnotationStore, split_store
+
+
+def test_shard_for_uid_is_stable_and_in_range():
+    store = AnnotationStore('annotations.json', shards=4)
+    shards = {store.shard_for_uid(f'user-{i}') for i in range(50)}
+    assert shards <= set(range(4)) and len(shards) > 1
+    assert store.shard_for_uid('abc') == AnnotationStore('other.json', shards=4).shard_for_uid('abc')
+    assert AnnotationStore('annotations.json').shard_for_uid('abc') == 0
+
+
+def test_key_is_unique_across_shards():
+    store = AnnotationStore('annotations.json', shards=3)
+    keys = [store.key(shard, position) for shard in range(3) for position in range(5)]
+    assert sorted(keys) == list(range(15))
+    assert store.key(2, 1) == 5
+
+
+def test_reserve_index_stays_in_the_uid_shard(tmp_path):
+    store = AnnotationStore(str(tmp_path / 'annotations.json'), shards=3)
+    store.init_files()
+    shard = store.shard_for_uid('alice')
+    first, second = store.reserve_index('alice'), store.reserve_index('alice')
+    assert first % 3 == shard and second == first + 3
+    assert [entry['index'] for entry in store.read(shard)] == [first, second]
+    other = next(s for s in range(3) if s != shard)
+    assert store.read(other) == []
+
+
+def test_edit_writes_on_clean_exit_only(tmp_path):
+    store = AnnotationStore(str(tmp_path / 'annotations.json'))
+    store.init_files()
+    seen = []
+    store.listeners.append(lambda shard, before, after: seen.append(shard))
+    with store.edit(0) as entries:
+        entries.append({'index': 0, 'annotations': []})
+    assert store.read(0) == [{'index': 0, 'annotations': []}] and seen == [0]
+
+    with pytest.raises(RuntimeError):
+        with store.edit(0) as entries:
+            entries.append({'index': 1, 'annotations': []})
+            raise RuntimeError('abandoned')
+    assert len(store.read(0)) == 1 and seen == [0]
+
+
+def test_check_layout(tmp_path):
+    path = tmp_path / 'annotations.json'
+    path.write_text(json.dumps([{'index': 0, 'annotations': []}]))
+    AnnotationStore(str(path)).check_layout()
+    with pytest.raises(ValueError, match='not sharded'):
+        AnnotationStore(str(path), shards=2).check_layout()
+
+    AnnotationStore(str(tmp_path / 'fresh.json'), shards=2).init_files()
+    AnnotationStore(str(tmp_path / 'fresh.json'), shards=2).check_layout()
+    with pytest.raises(ValueError, match='ANNOTATION_SHARDS=2'):
+        AnnotationStore(str(tmp_path / 'fresh.json'), shards=3).check_layout()
+
+
+def test_split_store_moves_the_original_aside(tmp_path):
+    path = tmp_path / 'annotations.json'
+    entries = [{'index': i, 'annotations': []} for i in range(5)]
+    path.write_text(json.dumps(entries))
+    assert split_store(str(path), 2) == [3, 2]
+    assert not path.exists() and (tmp_path / 'annotations.json.pre-split').exists()
+
+    store = AnnotationStore(str(path), shards=2)
+    store.check_layout()
+    assert sorted(entry['index'] for entry in store.read_all()) == list(range(5))
+    assert store.reserve_index('someone') >= 5
@@ -0,0 +1,53 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+import app as annotation_app
+from annotation_validation import main
+
+
+def _write(tmp_path, annotations):
+    path = tmp_path / 'annotations.json'
+    path.write_text(json.dumps([{'index': 0, 'image_path': 'img.jpg', 'annotations': annotations}]))
+    return str(path)
+
+
+def test_informational_tags_do_not_fail(tmp_path, capsys):
+    path = _write(tmp_path, [
+        {'bbox': [0.2, 0.2, 0.1, 0.1], 'gaze': [1.4, 0.5]},
+        {'bbox': [0.9, 0.9, 0.3, -0.2], 'gaze': [0.5, 0.5]},
+    ])
+    assert main([path]) == 0
+    out = capsys.readouterr().out
+    assert 'no errors' in out and 'gaze_out_of_frame 1' in out and 'bbox_clipped 1' in out
+
+
+def test_invalid_geometry_fails(tmp_path, capsys):
+    path = _write(tmp_path, [{'bbox': 'junk', 'gaze': [1.4, 0.5]}])
+    assert main([path]) == 1
+    assert main([path, '--write']) == 1
+    out = capsys.readouterr().out
+    assert 'bbox_invalid 1' in out and '(noted: gaze_out_of_frame 1)' in out
+
+
+def test_canonical_module_needs_only_the_standard_library():
+    code = ("import sys; sys.modules['numpy'] = sys.modules['portalocker'] = None; "
+            "import annotation_canonical, merge_annotations")
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    assert subprocess.run([sys.executable, '-c', code], cwd=root).returncode == 0
+
+
+def test_save_with_errors_is_rejected(app_config):
+    client = annotation_app.create_app(app_config()).test_client()
+    client.get('/label_image/0')
+    bad = client.post('/label_image/0', data={'annotations': json.dumps([{'bbox': [0.2, 0.2, 0.0, 0.1], 'gaze': [0.5, 0.5]}])})
+    assert bad.status_code == 400 and b'bbox_empty' in bad.data
+    assert annotation_app.annotation_store.read_all() == []
+
+    flipped = client.post('/label_image/0', data={'annotations': json.dumps([{'bbox': [0.4, 0.4, -0.2, -0.2], 'gaze': [1.2, 0.5]}])})
+    assert flipped.status_code in (200, 302)
+    saved = annotation_app.annotation_store.read_all()[0]['annotations'][0]
+    assert saved['bbox'] == pytest.approx([0.2, 0.2, 0.2, 0.2]) and saved['gaze_in_frame'] is False
@@ -0,0 +1,51 @@
+import json
+
+from annotator_agreement import agreement_report, load_annotation_arrays, match_boxes
+
+
+def _ann(annotator, bbox, gaze=(0.5, 0.5)):
+    return {'image_path': 'img.jpg', 'annotator_id': annotator, 'bbox': list(bbox), 'gaze': list(gaze)}
+
+
+def test_each_box_matches_at_most_one_box_per_annotator():
+    # The A box overlaps both B boxes; only its best match (the identical box) counts
+    merged = [{'index': 0, 'image_path': 'img.jpg', 'annotations': [
+        _ann('B', (0, 0, 1, 1)),
+        _ann('A', (0, 0, 1, 1)),
+        _ann('B', (0.1, 0.1, 0.8, 0.8)),
+    ]}]
+    arrays = load_annotation_arrays(merged)
+    i, j, iou = match_boxes(arrays)
+    assert sorted(zip(i.tolist(), j.tolist())) == [(0, 1)]
+    assert iou.tolist() == [1.0]
+    assert agreement_report(merged)['matched_pairs'] == 1
+
+
+def test_mutual_best_matches_across_orientations():
+    boxes_a = [(0, 0, 0.4, 0.4), (0.5, 0.5, 0.4, 0.4)]
+    boxes_b = [(0.52, 0.52, 0.4, 0.4), (0.02, 0.02, 0.4, 0.4)]
+    merged = [{'index': 0, 'image_path': 'img.jpg',
+               'annotations': [_ann('A', b) for b in boxes_a] + [_ann('B', b) for b in boxes_b]}]
+    i, j, _ = match_boxes(load_annotation_arrays(merged))
+    assert sorted(tuple(sorted(p)) for p in zip(i.tolist(), j.tolist())) == [(0, 3), (1, 2)]
+
+
+def test_annotators_are_grouped_by_entry_uid(tmp_path):
+    # Two annotators sharing one server store file are told apart by the uid on their entries
+    from merge_annotations import merge_inputs
+
+    ann = {'image_path': 'img.jpg', 'bbox': [0, 0, 0.5, 0.5], 'gaze': [0.5, 0.5]}
+    store = tmp_path / 'annotations.shard-00.json'
+    store.write_text(json.dumps([{'index': 0, 'uid': 'u1', 'annotations': [ann]},
+                                 {'index': 1, 'uid': 'u2', 'annotations': [ann]}]))
+    legacy = tmp_path / 'alice.json'
+    legacy.write_text(json.dumps([{'index': 0, 'annotations': [ann]}]))
+
+    merged = merge_inputs([str(store), str(legacy)], add_annotator=True)
+    assert [a['annotator_id'] for a in merged[0]['annotations']] == ['u1', 'u2', 'alice']
+    report = agreement_report(merged)
+    assert sorted(report['per_annotator']) == ['alice', 'u1', 'u2']
+    assert report['matched_pairs'] == 3
+
+    raw = json.loads(store.read_text())
+    assert sorted(agreement_report(raw)['per_annotator']) == ['u1', 'u2']
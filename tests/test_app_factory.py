@@ -0,0 +1,41 @@
+import os
+
+import app as annotation_app
+
+
+def test_create_app_switches_datasets(app_config):
+    first = app_config(name='first')
+    client = annotation_app.create_app(first).test_client()
+    client.get('/label_image/0')
+    assert len(annotation_app.available_images) == 4
+    assert client.get('/images/0').status_code == 200
+
+    second = app_config(paths=['test2/00000002/00000009.jpg'], name='second')
+    client = annotation_app.create_app(second).test_client()
+    assert [item['path'] for item in annotation_app.available_images] == ['test2/00000002/00000009.jpg']
+    assert annotation_app.annotation_store.path == second['ANNOTATIONS_PATH']
+    assert annotation_app.image_file_index == {}
+
+    client.get('/label_image/0')
+    with open(os.path.join(second['MERGED_ROOT'], 'gazefollow', 'test2/00000002/00000009.jpg'), 'rb') as f:
+        assert client.get('/images/0').data == f.read()
+    assert client.get('/label_image/1').status_code == 400
+
+
+def test_same_paths_keep_loaded_state(app_config):
+    config = app_config()
+    annotation_app.create_app(config)
+    images = annotation_app.available_images
+    annotation_app.create_app(config)
+    assert annotation_app.available_images is images
+
+
+def test_lazy_app_writes_nothing_until_first_request(app_config):
+    config = app_config(PRELOAD_DATASET=False)
+    client = annotation_app.create_app(config).test_client()
+    assert not os.path.exists(config['ANNOTATIONS_PATH'])
+    assert not annotation_app._dataset_loaded
+
+    assert client.get('/label_image/0').status_code == 200
+    assert os.path.exists(config['ANNOTATIONS_PATH'])
+    assert len(annotation_app.available_images) == 4
@@ -0,0 +1,99 @@
+import asyncio
+import json
+from urllib.parse import urlencode
+
+import pytest
+
+import app as annotation_app
+from annotation_store import AnnotationStore
+from asgi import AsgiApp
+from conftest import GF_PATHS
+
+TOKEN = 'let-me-in'
+ANNOTATION = {'bbox': [0.1, 0.1, 0.2, 0.2], 'gaze': [0.5, 0.5], 'target_type': 'object'}
+
+
+async def _call(asgi_app, scope, messages):
+    """Run one ASGI call; messages are handed to receive() in order, then it waits forever."""
+    pending = list(messages)
+    sent = []
+
+    async def receive():
+        if pending:
+            return pending.pop(0)
+        await asyncio.sleep(3600)
+
+    async def send(message):
+        sent.append(message)
+
+    await asgi_app(scope, receive, send)
+    return sent
+
+
+def _http(method, path, headers=(), query=''):
+    return {'type': 'http', 'method': method, 'path': path, 'query_string': query.encode('latin-1'),
+            'root_path': '', 'scheme': 'http', 'http_version': '1.1', 'server': ('testserver', 80),
+            'client': ('127.0.0.1', 1), 'headers': [(k.encode('latin-1'), v.encode('latin-1')) for k, v in headers]}
+
+
+def _response(sent):
+    start = sent[0]
+    assert start['type'] == 'http.response.start'
+    assert all(m['type'] == 'http.response.body' for m in sent[1:]) and sent[-1]['more_body'] is False
+    headers = [(k.decode('latin-1'), v.decode('latin-1')) for k, v in start['headers']]
+    return start['status'], headers, b''.join(m.get('body', b'') for m in sent[1:])
+
+
+@pytest.fixture
+def asgi_app(app_config):
+    asgi_app = AsgiApp(annotation_app.create_app(app_config(ADMIN_TOKEN=TOKEN)), threads=2)
+    yield asgi_app
+    asgi_app.executor.shutdown()
+
+
+def test_lifespan(asgi_app):
+    sent = asyncio.run(_call(asgi_app, {'type': 'lifespan'},
+                             [{'type': 'lifespan.startup'}, {'type': 'lifespan.shutdown'}]))
+    assert [m['type'] for m in sent] == ['lifespan.startup.complete', 'lifespan.shutdown.complete']
+    with pytest.raises(RuntimeError):
+        asgi_app.executor.submit(print)
+
+
+def test_flask_routes_get_the_whole_body(asgi_app):
+    status, headers, body = _response(asyncio.run(_call(asgi_app, _http('GET', '/label_image/0'),
+                                                        [{'type': 'http.request', 'body': b''}])))
+    assert status == 200 and b'<html' in body.lower()
+    cookie = '; '.join(v.split(';')[0] for k, v in headers if k == 'set-cookie')
+
+    form = urlencode({'annotations': json.dumps([ANNOTATION])}).encode('latin-1')
+    half = len(form) // 2
+    post = _http('POST', '/label_image/0', [('cookie', cookie), ('content-type', 'application/x-www-form-urlencoded'),
+                                             ('content-length', str(len(form)))])
+    status, _, _ = _response(asyncio.run(_call(asgi_app, post, [
+        {'type': 'http.request', 'body': form[:half], 'more_body': True},
+        {'type': 'http.request', 'body': form[half:], 'more_body': False},
+    ])))
+    assert status in (200, 302)
+    saved = annotation_app.annotation_store.read_all()
+    assert len(saved) == 1 and saved[0]['annotations'][0]['gaze'] == [0.5, 0.5]
+
+
+def test_streamed_response_keeps_its_request_context(asgi_app):
+    # Written as another process would, so the app re-reads the store
+    with AnnotationStore(annotation_app.annotation_store.path).edit(0) as entries:
+        entries.append({'index': 0, 'uid': 'someone', 'annotations': [dict(ANNOTATION, image_path=GF_PATHS[0])]})
+    scope = _http('GET', '/api/annotations', [('authorization', f'Bearer {TOKEN}')], query='limit=5')
+    sent = asyncio.run(_call(asgi_app, scope, [{'type': 'http.request', 'body': b''}]))
+    status, headers, body = _response(sent)
+    assert status == 200 and ('content-type', 'application/json') in headers
+    # stream_with_context chunks are sent as they are produced
+    assert len([m for m in sent if m.get('body')]) > 1
+    assert json.loads(body)['results'][0]['index'] == 0
+
+
+def test_disconnect_before_body_sends_nothing(asgi_app):
+    sent = asyncio.run(_call(asgi_app, _http('POST', '/label_image/0'), [
+        {'type': 'http.request', 'body': b'annotations=', 'more_body': True},
+        {'type': 'http.disconnect'},
+    ]))
+    assert sent == []
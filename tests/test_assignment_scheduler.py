@@ -0,0 +1,72 @@
+import json
+
+import app as annotation_app
+from conftest import GF_PATHS
+from assignment_scheduler import CoverageScheduler
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_least_covered_first_and_distinct_annotators():
+    sched = CoverageScheduler(3, target=2)
+    sched.record_existing(0, uid='a')
+    assert sched.lease('b', 3) == [1, 2, 0]
+    # 'a' already did image 0; active leases count towards the target
+    assert sched.lease('a', 3) == [1, 2]
+    assert sched.lease('c', 3) == []
+
+    sched.complete('b', 1)
+    sched.complete('b', 1)  # a repeat submit is not recounted
+    assert sched.done == [1, 1, 0]
+    assert sched.has_completed('b', 1) and not sched.has_completed('a', 1)
+
+
+def test_target_reached_leases_nothing():
+    sched = CoverageScheduler(2, target=1)
+    assert sched.lease('a', 5) == [0, 1]
+    sched.complete('a', 0)
+    sched.complete('a', 1)
+    assert sched.lease('b', 5) == []
+
+
+def test_expired_leases_are_reclaimed():
+    clock = Clock()
+    sched = CoverageScheduler(2, target=1, lease_seconds=10, clock=clock)
+    assert sched.lease('a', 2) == [0, 1]
+    assert sched.lease('b', 2) == []
+    sched.complete('a', 0)
+
+    clock.now = 11
+    assert sched.lease('b', 2) == [1]
+    assert sched.leased == [0, 1]
+    # The stale lease of 'a' no longer releases 'b's lease when it completes late
+    sched.complete('a', 1)
+    assert sched.leased == [0, 1] and sched.done == [1, 1]
+
+
+def test_seeding_counts_each_annotator_once():
+    sched = CoverageScheduler(2, target=2)
+    assert sched.record_existing(0, uid='a') == 1
+    assert sched.record_existing(0, uid='a') == 0
+    assert sched.record_existing(0) == 1  # legacy entries without a uid count individually
+    assert sched.done == [2, 0]
+
+
+def test_app_seeds_distinct_annotators_from_the_store(app_config, tmp_path):
+    config = app_config(paths=GF_PATHS[:2], ASSIGNMENT_MODE='coverage', ANNOTATIONS_PER_IMAGE=2, LEASE_BATCH=5)
+    path = GF_PATHS[0]
+    entries = [{'index': i, 'uid': 'a', 'annotations': [{'image_path': path, 'bbox': [0, 0, 1, 1]}]}
+               for i in range(3)]
+    with open(config['ANNOTATIONS_PATH'], 'w') as f:
+        json.dump(entries, f)
+
+    annotation_app.create_app(config)
+    # Three saves by one annotator count once, so image 0 is still below target
+    assert annotation_app.scheduler.done == [1, 0]
+    assert annotation_app.scheduler.lease('b', 5) == [1, 0]
@@ -0,0 +1,57 @@
+import json
+import os
+
+import pytest
+
+import audit_images
+from audit_images import AUDIT_CACHE_NAME, audit, check_entry
+from conftest import jpeg_bytes
+
+GF_PATH = 'train/00000001/00000000.jpg'
+
+
+@pytest.mark.parametrize('entry, problems', [
+    ({'path': GF_PATH, 'bbox': [0.1, 0.2, 0.3, 0.3], 'eye': [0.2, 0.3], 'gaze': [0.9, 0.9]}, 0),
+    # Negative width/height from a right-to-left drag, overhanging by less than the slack
+    ({'path': GF_PATH, 'bbox': [0.5, 0.5, -0.55, -0.3], 'eye': [0.2, 0.3]}, 0),
+    ({'path': GF_PATH, 'bbox': [0.1, 0.2, 0.3, 0.3], 'eye': [0.2, 0.3], 'gaze': [1.5, 0.5]}, 1),
+    ({'path': GF_PATH, 'bbox': [10, 20, 30, 30], 'eye': [20, 30]}, 2),  # pixels in a normalised dataset
+    ({'path': 'vat/show/1_9/frame1.jpg', 'bbox': [10, 20, 30, 30], 'eye': [20, 30], 'gaze': [630, 470]}, 0),
+    ({'path': 'vat/show/1_9/frame1.jpg', 'bbox': [10, 20, 30, 30], 'eye': [20, 30], 'gaze': [-1, -1]}, 0),
+    ({'path': 'vat/show/1_9/frame1.jpg', 'bbox': [10, 20, 30, 30], 'eye': [20, 30], 'gaze': [700, 100]}, 1),
+    ({'path': 'vat/show/1_9/frame1.jpg', 'bbox': 'n/a', 'eye': None}, 2),
+])
+def test_check_entry_scales(entry, problems):
+    assert len(check_entry(entry, 640, 480)) == problems
+
+
+def test_cache_is_reused_and_pruned(tmp_path, monkeypatch):
+    merged_root = tmp_path / 'merged_images'
+    paths = [f'train/00000001/0000000{i}.jpg' for i in range(2)]
+    for path in paths:
+        image_file = merged_root / 'gazefollow' / path
+        image_file.parent.mkdir(parents=True, exist_ok=True)
+        image_file.write_bytes(jpeg_bytes())
+    entries = [{'path': path, 'bbox': [0.1, 0.1, 0.2, 0.2], 'eye': [0.2, 0.2]} for path in paths]
+    assert audit(entries, str(merged_root), workers=1) == []
+
+    # Unchanged files are neither hashed nor decoded again
+    def no_pool(*args, **kwargs):
+        raise AssertionError("unchanged files were inspected again")
+    monkeypatch.setattr(audit_images, 'ProcessPoolExecutor', no_pool)
+    assert audit(entries, str(merged_root), workers=1) == []
+    monkeypatch.undo()
+
+    # A replaced image is decoded again and the old content's result is dropped
+    cache_path = merged_root / AUDIT_CACHE_NAME
+    old_hashes = set(json.loads(cache_path.read_text())['decoded'])
+    (merged_root / 'gazefollow' / paths[0]).write_bytes(b'broken')
+    problems = audit(entries, str(merged_root), workers=1)
+    assert [p['path'] for p in problems] == [paths[0]]
+    cache = json.loads(cache_path.read_text())
+    assert len(cache['decoded']) == 2 and len(old_hashes - set(cache['decoded'])) == 1
+
+    os.remove(merged_root / 'gazefollow' / paths[0])
+    audit(entries, str(merged_root), workers=1)
+    cache = json.loads(cache_path.read_text())
+    assert list(cache['files']) == [os.path.join('gazefollow', paths[1])] and len(cache['decoded']) == 1
@@ -0,0 +1,100 @@
+import json
+import os
+
+import pytest
+
+import app as annotation_app
+from clip_tracks import interpolate_clip, order_by_clip
+from conftest import jpeg_bytes
+
+MERGED = '/data/merged_images'
+
+
+def _vat(clip, frame):
+    return os.path.join(MERGED, 'vat', clip, f'{frame}.jpg')
+
+
+def test_order_by_clip_groups_frames_in_order():
+    images = [{'path': 'train/a.jpg'}, {'path': '3.jpg'}, {'path': '7.jpg'}, {'path': '1.jpg'},
+              {'path': '3.jpg'}, {'path': '5.jpg'}]
+    clips = {'3.jpg': 'show/1_4', '1.jpg': 'show/1_4', '5.jpg': 'show/5_9', '7.jpg': None}
+
+    def resolve(path):
+        if path.startswith('train/'):
+            return os.path.join(MERGED, 'gazefollow', path)
+        clip = clips[path]
+        return _vat(clip, path[:-4]) if clip else os.path.join(MERGED, 'vat', path)
+
+    ordered, ranges = order_by_clip(images, resolve, MERGED)
+    assert [item['path'] for item in ordered] == ['train/a.jpg', '1.jpg', '3.jpg', '7.jpg', '5.jpg']
+    assert ranges == [(0, 1), (1, 3), (3, 4), (4, 5)]
+
+
+def test_interpolate_clip():
+    key = [{'bbox': [0, 0, 0.2, 0.2], 'gaze': [0.0, 0.5], 'target_type': 'object'}]
+    later = [{'bbox': [0.4, 0, 0.2, 0.2], 'gaze': [1.0, 0.5], 'target_type': 'person'}]
+    filled = interpolate_clip([10, 11, 13, 14, 20], [None, key, None, later, None])
+    # Before the first keyframe and after the last one, the nearest keyframe is held
+    assert filled[0][0]['bbox'] == key[0]['bbox'] and filled[0][0]['interpolated']
+    assert filled[4][0]['gaze'] == later[0]['gaze']
+    # Frame 13 is two thirds of the way from frame 11 to frame 14
+    assert filled[2][0]['bbox'] == pytest.approx([0.4 * 2 / 3, 0, 0.2, 0.2])
+    assert filled[2][0]['gaze'] == pytest.approx([2 / 3, 0.5])
+    assert filled[2][0]['target_type'] == 'object'
+    assert filled[1] is key and 'interpolated' not in key[0]
+    assert interpolate_clip([1, 2], [None, None]) == [[], []]
+
+
+@pytest.fixture
+def clip_app(tmp_path):
+    merged_root = tmp_path / 'merged_images'
+    frames = [101, 102, 103]
+    for frame in frames:
+        path = merged_root / 'vat' / 'show' / '101_103' / f'{frame}.jpg'
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(jpeg_bytes())
+    dataset = tmp_path / 'dataset.json'
+    dataset.write_text(json.dumps([{'path': f'{frame}.jpg', 'bbox': [1, 1, 10, 10], 'gaze': [5, 5]}
+                                   for frame in frames]))
+    config = {
+        'TESTING': True, 'DATASET_JSON': str(dataset), 'MERGED_ROOT': str(merged_root),
+        'ANNOTATIONS_PATH': str(tmp_path / 'annotations.json'), 'ANNOTATION_SHARDS': 2,
+        'PROGRESS_DIR': str(tmp_path / 'progress'), 'TELEMETRY_DIR': str(tmp_path / 'telemetry'),
+        'ASSIGNMENT_MODE': 'clip', 'IMAGE_OFFLOAD': '', 'SNAPSHOT_TOKEN': '', 'ADMIN_TOKEN': '', 'SUGGESTION_MODEL': '',
+    }
+    return annotation_app.create_app(config)
+
+
+def _ann(x):
+    return {'bbox': [x, 0.1, 0.2, 0.2], 'gaze': [x, 0.5]}
+
+
+def test_save_clip_locks_and_writes_every_shard(clip_app, monkeypatch):
+    client = clip_app.test_client()
+    assert client.get('/label_image/0').status_code == 200
+    store = annotation_app.annotation_store
+    with client.session_transaction() as sess:
+        uid = sess['uid']
+        # Frame 2 already has an entry in the shard the annotator does not reserve in
+        other = 1 - store.shard_for_uid(uid)
+        sess['user_annotation_indices'] = {'k2': other}
+    locked = []
+    edit = store.edit
+    monkeypatch.setattr(store, 'edit', lambda shard: locked.append(shard) or edit(shard))
+
+    response = client.post('/api/save_clip/0', json={'annotations': {'0': [_ann(0.1)], '1': None, '2': [_ann(0.5)]}})
+    assert response.status_code == 200 and response.get_json()['saved'] == 3
+    assert locked == sorted(locked) == [0, 1]
+
+    entries = {e['index']: e for e in store.read_all()}
+    assert store.shard_for_index(other) == other and entries[other]['annotations'][0]['gaze'] == [0.5, 0.5]
+    middle = [e for e in entries.values() if e['annotations'][0]['image_path'] == '102.jpg'][0]
+    assert middle['annotations'][0]['interpolated'] and middle['annotations'][0]['gaze'] == pytest.approx([0.3, 0.5])
+
+    # Submitting again from a new session rewrites the same entries
+    client2 = clip_app.test_client()
+    client2.get('/label_image/0')
+    with client2.session_transaction() as sess:
+        sess['uid'] = uid
+    assert client2.post('/api/save_clip/0', json={'annotations': {'0': [_ann(0.2)]}}).status_code == 200
+    assert sorted(e['index'] for e in store.read_all()) == sorted(entries)
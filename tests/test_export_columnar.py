@@ -0,0 +1,35 @@
+import json
+
+import numpy as np
+
+from export_columnar import export_columnar, load_columnar
+
+
+def test_round_trip(tmp_path):
+    entries = [
+        {'index': 3, 'annotations': [
+            {'image_path': 'a.jpg', 'bbox': [0.1, 0.2, 0.3, 0.4], 'gaze': [0.5, 0.6], 'gaze_number': 2,
+             'target_type': 'object', 'annotator_id': 'u1'},
+            {'image_path': 'a.jpg', 'bbox': 'bad', 'gaze_3d': [1, 2, 3], 'target_type': 'person'},
+        ]},
+        {'index': None, 'image_path': 'b.jpg', 'annotations': [{'farther_closer': '', 'annotator_id': 'u1'}]},
+        'not an entry',
+    ]
+    source = tmp_path / 'annotations.json'
+    source.write_text(json.dumps(entries))
+
+    assert export_columnar(str(source), str(tmp_path / 'out')) == 3
+    columns = load_columnar(str(tmp_path / 'out'))
+    assert isinstance(columns['bbox'], np.memmap)
+
+    assert columns['entry_index'].tolist() == [3, 3, -1]
+    assert columns['image_paths'][columns['image_id']].tolist() == ['a.jpg', 'a.jpg', 'b.jpg']
+    np.testing.assert_allclose(columns['bbox'][0], [0.1, 0.2, 0.3, 0.4], rtol=1e-6)
+    assert np.isnan(columns['bbox'][1:]).all()
+    np.testing.assert_array_equal(columns['gaze_3d'][1], [1, 2, 3])
+    assert columns['gaze_number'].tolist() == [2, -1, -1]
+    assert columns['target_type_values'][columns['target_type'][:2]].tolist() == ['object', 'person']
+    assert columns['target_type'][2] == -1 and (columns['farther_closer'] == -1).all()
+    assert columns['annotator_id'].tolist() == [0, -1, 0]
+    with open(tmp_path / 'out' / 'meta.json') as f:
+        assert json.load(f)['rows'] == 3
@@ -0,0 +1,74 @@
+import json
+
+import numpy as np
+import pytest
+
+from conftest import GF_PATHS, jpeg_bytes
+
+torch = pytest.importorskip('torch')
+from gaze_dataset import GazeAnnotationDataset  # noqa: E402
+
+
+@pytest.fixture
+def source(tmp_path):
+    merged_root = tmp_path / 'merged_images'
+    for path in GF_PATHS[:3]:
+        image_file = merged_root / 'gazefollow' / path
+        image_file.parent.mkdir(parents=True, exist_ok=True)
+        image_file.write_bytes(jpeg_bytes())
+
+    def ann(path, x, **extra):
+        return dict({'image_path': path, 'bbox': [0.1, 0.1, 0.2, 0.2], 'gaze': [x, 0.5]}, **extra)
+
+    entries = [
+        {'index': 0, 'annotations': [ann(GF_PATHS[1], 0.1), ann(GF_PATHS[0], 0.2)]},
+        {'index': 1, 'annotations': [ann(GF_PATHS[0], 0.3), ann(GF_PATHS[2], 0.4),
+                                     ann(GF_PATHS[3], 0.5),  # image missing on disk
+                                     ann(GF_PATHS[2], 0.6, bbox=None),
+                                     ann(GF_PATHS[2], 0.7, gaze='bad')]},
+    ]
+    annotations = tmp_path / 'annotations.json'
+    annotations.write_text(json.dumps(entries))
+    return str(annotations), str(merged_root)
+
+
+def test_drops_unusable_rows_and_orders_by_image(source):
+    annotations, merged_root = source
+    dataset = GazeAnnotationDataset(annotations, merged_root=merged_root, image_size=(32, 32))
+    assert len(dataset) == 4
+    # Grouped by image in order of first appearance, then by row
+    assert [round(float(dataset[i]['gaze'][0]), 1) for i in range(4)] == [0.1, 0.2, 0.3, 0.4]
+    sample = dataset[0]
+    assert sample['image'].shape == (3, 32, 32)
+    assert 0 <= float(sample['image'].min()) and float(sample['image'].max()) <= 1
+
+
+def test_shards_partition_the_samples(source):
+    annotations, merged_root = source
+    full = GazeAnnotationDataset(annotations, merged_root=merged_root)
+    shards = [GazeAnnotationDataset(annotations, merged_root=merged_root, num_shards=3, shard_index=k)
+              for k in range(3)]
+    assert sorted(np.concatenate([s.rows for s in shards]).tolist()) == sorted(full.rows.tolist())
+    assert sum(len(s) for s in shards) == len(full)
+
+
+def test_heatmaps_follow_the_samples(source, tmp_path):
+    annotations, merged_root = source
+    dataset = GazeAnnotationDataset(annotations, merged_root=merged_root, heatmap_size=(16, 16),
+                                    heatmap_cache_dir=str(tmp_path / 'heatmaps'))
+    sample = dataset[0]
+    assert sample['heatmap'].shape == (16, 16) and sample['in_frame']
+    y, x = np.unravel_index(int(sample['heatmap'].argmax()), (16, 16))
+    assert x == 1 and y in (7, 8)  # gaze (0.1, 0.5)
+
+
+def test_export_directory_is_read_memory_mapped(source, tmp_path):
+    from export_columnar import export_columnar
+
+    annotations, merged_root = source
+    export_columnar(annotations, str(tmp_path / 'columns'))
+    exported = GazeAnnotationDataset(str(tmp_path / 'columns'), merged_root=merged_root)
+    parsed = GazeAnnotationDataset(annotations, merged_root=merged_root)
+    assert isinstance(exported.bbox, np.memmap)
+    assert exported.rows.tolist() == parsed.rows.tolist()
+    assert torch.equal(exported[1]['gaze'], parsed[1]['gaze'])
@@ -0,0 +1,36 @@
+import os
+
+import numpy as np
+
+from gaze_heatmaps import cached_heatmaps, gaze_heatmaps, heatmap_cache_key
+
+
+def test_peak_at_gaze_and_zeros_out_of_frame():
+    gaze = np.array([[0.25, 0.75], [-0.05, 0.5], [0.5, 1.2], [np.nan, np.nan]], dtype=np.float32)
+    heatmaps, in_frame = gaze_heatmaps(gaze, size=(8, 16), sigma=1.0)
+    assert heatmaps.shape == (4, 8, 16)
+    assert in_frame.tolist() == [True, False, False, False]
+    assert np.unravel_index(int(heatmaps[0].argmax()), (8, 16)) in {(5, 3), (5, 4), (6, 3), (6, 4)}
+    assert heatmaps[0].max() <= 1
+    assert not heatmaps[1:].any()
+
+
+def test_cache_is_reused_and_keyed_on_inputs(tmp_path):
+    gaze = np.random.default_rng(0).random((10, 2), dtype=np.float32)
+    cache_dir = str(tmp_path / 'heatmaps')
+    first, in_frame = cached_heatmaps(gaze, cache_dir, size=(8, 8), batch_size=3)
+    assert isinstance(first, np.memmap) and first.dtype == np.float16 and in_frame.all()
+    np.testing.assert_allclose(first, gaze_heatmaps(gaze, (8, 8))[0], atol=1e-3)
+    assert len(os.listdir(cache_dir)) == 1
+
+    again, _ = cached_heatmaps(gaze, cache_dir, size=(8, 8))
+    assert again.filename == first.filename and len(os.listdir(cache_dir)) == 1
+
+    edited = gaze.copy()
+    edited[3] = [0.9, 0.1]
+    cached_heatmaps(edited, cache_dir, size=(8, 8))
+    cached_heatmaps(gaze, cache_dir, size=(8, 8), sigma=2.0)
+    assert len(os.listdir(cache_dir)) == 3
+
+    assert heatmap_cache_key(gaze, (8, 8), 3.0, version=7) == heatmap_cache_key(edited, (8, 8), 3.0, version=7)
+    assert heatmap_cache_key(gaze, (8, 8), 3.0) != heatmap_cache_key(gaze, (8, 8), 3.0, version=7)
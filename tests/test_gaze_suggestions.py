@@ -0,0 +1,81 @@
+import os
+import time
+
+import pytest
+from PIL import Image
+
+from gaze_suggestions import CenterPriorModel, SuggestionService
+
+SPEC = 'gaze_suggestions:CenterPriorModel'
+
+
+@pytest.fixture
+def image_path(tmp_path):
+    path = tmp_path / 'frame.jpg'
+    Image.new('RGB', (200, 100), 'gray').save(path)
+    return str(path)
+
+
+@pytest.fixture
+def service(tmp_path):
+    service = SuggestionService(SPEC, str(tmp_path / 'cache'), workers=1, wait=30)
+    yield service
+    service.shutdown()
+
+
+def _wait_for_cache(service, image_path, timeout=10):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        cached = service.cached(image_path)
+        if cached is not None:
+            return cached
+        time.sleep(0.01)
+    return None
+
+
+def test_suggestion_shape(service, image_path):
+    result = service.get(image_path)
+    assert result == CenterPriorModel()(image_path)
+    assert len(result['bbox']) == 4 and len(result['gaze']) == 2
+    assert all(0 <= v <= 1 for v in result['bbox'] + result['gaze'])
+
+
+def test_suggestions_are_cached_by_content(service, image_path, monkeypatch):
+    first = service.get(image_path)
+    assert _wait_for_cache(service, image_path) == first
+    assert len(os.listdir(service.cache_dir)) == 1
+
+    # A cache hit never reaches the model
+    def fail(path):
+        raise AssertionError("model called for a cached image")
+    monkeypatch.setattr(service, '_submit', fail)
+    assert service.get(image_path) == first
+    monkeypatch.undo()
+
+    # New content under the same path is predicted again
+    Image.new('RGB', (100, 200), 'white').save(image_path)
+    os.utime(image_path, ns=(time.time_ns(), time.time_ns() + 10**9))
+    second = service.get(image_path)
+    assert second == CenterPriorModel()(image_path) != first
+    assert _wait_for_cache(service, image_path) == second
+    assert len(os.listdir(service.cache_dir)) == 2
+
+
+def test_prefetch_fills_the_cache(service, image_path):
+    service.prefetch([image_path, '/nonexistent.jpg'])
+    assert _wait_for_cache(service, image_path) == CenterPriorModel()(image_path)
+
+
+def test_label_page_prefetches_upcoming_images(app_config, tmp_path, monkeypatch):
+    import app as annotation_app
+
+    flask_app = annotation_app.create_app(app_config(SUGGESTION_MODEL=SPEC, SUGGESTION_LOOKAHEAD=2,
+                                                     SUGGESTION_CACHE_DIR=str(tmp_path / 'cache')))
+    queued = []
+    monkeypatch.setattr(annotation_app.suggestion_service, 'prefetch', lambda paths: queued.append(list(paths)))
+    try:
+        page = flask_app.test_client().get('/label_image/1')
+    finally:
+        annotation_app.suggestion_service.shutdown()
+    assert page.status_code == 200 and b'onclick="autoDetectGaze()"' in page.data
+    assert [os.path.basename(p) for p in queued[0]] == ['00000001.jpg', '00000002.jpg', '00000003.jpg']
@@ -0,0 +1,172 @@
+import asyncio
+import io
+import json
+
+import pytest
+from PIL import Image
+
+import app as annotation_app
+from asgi import AsgiApp
+
+IMAGE_PATH = 'train/00000001/00000001.jpg'
+
+
+@pytest.fixture
+def make_app(tmp_path):
+    image_file = tmp_path / 'merged_images' / 'gazefollow' / IMAGE_PATH
+    image_file.parent.mkdir(parents=True)
+    buffer = io.BytesIO()
+    Image.effect_noise((64, 48), 64).convert('RGB').save(buffer, 'JPEG')
+    image_file.write_bytes(buffer.getvalue())
+    dataset = tmp_path / 'dataset.json'
+    dataset.write_text(json.dumps([{'path': IMAGE_PATH, 'bbox': [0.1, 0.1, 0.2, 0.2], 'gaze': [0.5, 0.5]}]))
+
+    def make(**config):
+        return annotation_app.create_app(dict({
+            'TESTING': True,
+            'DATASET_JSON': str(dataset),
+            'MERGED_ROOT': str(tmp_path / 'merged_images'),
+            'ANNOTATIONS_PATH': str(tmp_path / 'annotations.json'),
+            'PROGRESS_DIR': str(tmp_path / 'progress'),
+            'TELEMETRY_DIR': str(tmp_path / 'telemetry'),
+            'IMAGE_OFFLOAD': '',
+        }, **config))
+
+    make.image_file = str(image_file)
+    return make
+
+
+@pytest.fixture
+def client(make_app):
+    client = make_app().test_client()
+    client.get('/label_image/0')
+    return client
+
+
+def _body(make_app):
+    with open(make_app.image_file, 'rb') as f:
+        return f.read()
+
+
+def test_flask_ranges(client, make_app):
+    body = _body(make_app)
+    full = client.get('/images/0')
+    assert full.status_code == 200 and full.data == body
+    assert full.headers['Accept-Ranges'] == 'bytes'
+
+    part = client.get('/images/0', headers={'Range': 'bytes=10-19'})
+    assert part.status_code == 206
+    assert part.headers['Content-Range'] == f'bytes 10-19/{len(body)}'
+    assert part.data == body[10:20]
+
+    bad = client.get('/images/0', headers={'Range': f'bytes={len(body) + 5}-'})
+    assert bad.status_code == 416
+
+    etag = full.headers['ETag']
+    fresh = client.get('/images/0', headers={'Range': 'bytes=-10', 'If-Range': etag})
+    assert fresh.status_code == 206 and fresh.data == body[-10:]
+    stale = client.get('/images/0', headers={'Range': 'bytes=-10', 'If-Range': '"stale"'})
+    assert stale.status_code == 200 and stale.data == body
+
+
+@pytest.mark.parametrize('mode', ['x-accel', 'x-sendfile'])
+def test_flask_offload_headers(make_app, mode):
+    client = make_app(IMAGE_OFFLOAD=mode, IMAGE_ACCEL_PREFIX='/_images/').test_client()
+    client.get('/label_image/0')
+    response = client.get('/images/0')
+    assert response.status_code == 200 and response.data == b''
+    if mode == 'x-accel':
+        assert response.headers['X-Accel-Redirect'] == '/_images/gazefollow/' + IMAGE_PATH
+    else:
+        assert response.headers['X-Sendfile'] == make_app.image_file
+
+
+def test_replaced_file_is_verified_again(client, make_app, monkeypatch):
+    assert client.get('/images/0').status_code == 200
+    calls = []
+    resolve = annotation_app.resolve_image_full_path
+    monkeypatch.setattr(annotation_app, 'resolve_image_full_path', lambda index: calls.append(index) or resolve(index))
+
+    assert client.get('/images/0').status_code == 200
+    assert calls == []
+
+    # Same path, new content: an unchanged (size, mtime) is the only thing trusted
+    with open(make_app.image_file, 'wb') as f:
+        f.write(b'not a jpeg')
+    assert client.get('/images/0').status_code == 400
+    assert calls == [0]
+
+
+async def _request(asgi_app, path, headers=()):
+    scope = {'type': 'http', 'method': 'GET', 'path': path, 'query_string': b'', 'root_path': '',
+             'scheme': 'http', 'http_version': '1.1', 'server': ('testserver', 80), 'client': ('127.0.0.1', 1),
+             'headers': [(k.lower().encode('latin-1'), v.encode('latin-1')) for k, v in headers]}
+    received = []
+
+    async def receive():
+        if received:
+            await asyncio.sleep(3600)
+        received.append(True)
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    response = {'body': b''}
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            response['status'] = message['status']
+            response['headers'] = [(k.decode('latin-1'), v.decode('latin-1')) for k, v in message['headers']]
+        else:
+            response['body'] += message.get('body', b'')
+
+    await asgi_app(scope, receive, send)
+    return response
+
+
+def _header(response, name):
+    return dict(response['headers']).get(name)
+
+
+def _asgi_session(asgi_app):
+    page = asyncio.run(_request(asgi_app, '/label_image/0'))
+    cookie = '; '.join(v.split(';')[0] for k, v in page['headers'] if k == 'set-cookie')
+    return lambda path, *headers: asyncio.run(_request(asgi_app, path, [('cookie', cookie), *headers]))
+
+
+def test_asgi_ranges(make_app):
+    asgi_app = AsgiApp(make_app(), threads=2)
+    get = _asgi_session(asgi_app)
+    body = _body(make_app)
+    try:
+        full = get('/images/0')
+        assert full['status'] == 200 and full['body'] == body
+
+        part = get('/images/0', ('range', 'bytes=10-19'))
+        assert part['status'] == 206
+        assert _header(part, 'content-range') == f'bytes 10-19/{len(body)}'
+        assert part['body'] == body[10:20]
+
+        bad = get('/images/0', ('range', f'bytes={len(body) + 5}-'))
+        assert bad['status'] == 416
+        assert _header(bad, 'content-range') == f'bytes */{len(body)}'
+
+        etag = _header(full, 'etag')
+        fresh = get('/images/0', ('range', 'bytes=-10'), ('if-range', etag))
+        assert fresh['status'] == 206 and fresh['body'] == body[-10:]
+        stale = get('/images/0', ('range', 'bytes=-10'), ('if-range', '"stale"'))
+        assert stale['status'] == 200 and stale['body'] == body
+    finally:
+        asgi_app.executor.shutdown()
+
+
+@pytest.mark.parametrize('mode', ['x-accel', 'x-sendfile'])
+def test_asgi_offload_headers(make_app, mode):
+    asgi_app = AsgiApp(make_app(IMAGE_OFFLOAD=mode, IMAGE_ACCEL_PREFIX='/_images/'), threads=2)
+    try:
+        response = _asgi_session(asgi_app)('/images/0')
+    finally:
+        asgi_app.executor.shutdown()
+    assert response['status'] == 200 and response['body'] == b''
+    if mode == 'x-accel':
+        assert _header(response, 'x-accel-redirect') == '/_images/gazefollow/' + IMAGE_PATH
+    else:
+        assert _header(response, 'x-sendfile') == make_app.image_file
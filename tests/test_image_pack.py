@@ -0,0 +1,96 @@
+import io
+import json
+
+from PIL import Image
+
+import app as annotation_app
+from image_pack import ImagePack, build_pack
+
+PATHS = ['train/00000001/00000001.jpg', 'train/00000001/00000002.jpg']
+
+
+def _write_images(merged_root):
+    bodies = {}
+    for i, path in enumerate(PATHS):
+        image_file = merged_root / 'gazefollow' / path
+        image_file.parent.mkdir(parents=True, exist_ok=True)
+        buffer = io.BytesIO()
+        Image.effect_noise((64 + i, 48), 64).convert('RGB').save(buffer, 'JPEG')
+        image_file.write_bytes(buffer.getvalue())
+        bodies[path] = buffer.getvalue()
+    return bodies
+
+
+def _entries():
+    return [{'path': path, 'bbox': [0.1, 0.1, 0.2, 0.2], 'gaze': [0.5, 0.5]} for path in PATHS]
+
+
+def test_build_pack_and_view(tmp_path):
+    merged_root = tmp_path / 'merged_images'
+    bodies = _write_images(merged_root)
+    pack_path = str(tmp_path / 'images.pack')
+    entries = _entries() + [{'path': PATHS[0]}, {'path': 'train/missing/00000009.jpg'}]
+    assert build_pack(entries, str(merged_root), pack_path) == 2
+
+    pack = ImagePack(pack_path)
+    assert len(pack) == 2 and PATHS[1] in pack and 'train/missing/00000009.jpg' not in pack
+    assert pack.info(PATHS[1])['width'] == 65
+    assert pack.info(PATHS[0])['file'] == 'gazefollow/' + PATHS[0]
+    for path, body in bodies.items():
+        assert bytes(pack.view(path)) == body
+        assert pack.read(path) == body
+    assert pack.view('nope') is None and pack.open('nope') is None
+
+    reader = pack.open(PATHS[0])
+    reader.seek(10)
+    assert reader.read(5) == bodies[PATHS[0]][10:15]
+    assert pack.verify() == []
+
+
+def test_verify_finds_corrupted_image(tmp_path):
+    merged_root = tmp_path / 'merged_images'
+    _write_images(merged_root)
+    pack_path = tmp_path / 'images.pack'
+    build_pack(_entries(), str(merged_root), str(pack_path))
+    offset = ImagePack(str(pack_path)).info(PATHS[1])['offset']
+
+    data = bytearray(pack_path.read_bytes())
+    data[offset + 20] ^= 0xFF
+    pack_path.write_bytes(bytes(data))
+    assert ImagePack(str(pack_path)).verify() == [PATHS[1]]
+
+
+def test_serve_from_pack(tmp_path):
+    merged_root = tmp_path / 'merged_images'
+    bodies = _write_images(merged_root)
+    pack_path = tmp_path / 'images.pack'
+    build_pack(_entries(), str(merged_root), str(pack_path))
+    # Only the pack is deployed
+    for path in PATHS:
+        (merged_root / 'gazefollow' / path).unlink()
+    dataset = tmp_path / 'dataset.json'
+    dataset.write_text(json.dumps(_entries()))
+    client = annotation_app.create_app({
+        'TESTING': True,
+        'DATASET_JSON': str(dataset),
+        'MERGED_ROOT': str(merged_root),
+        'IMAGE_PACK': str(pack_path),
+        'ANNOTATIONS_PATH': str(tmp_path / 'annotations.json'),
+        'PROGRESS_DIR': str(tmp_path / 'progress'),
+        'TELEMETRY_DIR': str(tmp_path / 'telemetry'),
+        'IMAGE_OFFLOAD': 'x-accel',
+    }).test_client()
+    client.get('/label_image/0')
+    body = bodies[PATHS[0]]
+
+    full = client.get('/images/0')
+    assert full.status_code == 200 and full.data == body
+    assert full.headers['Content-Length'] == str(len(body))
+    assert 'X-Accel-Redirect' not in full.headers
+
+    part = client.get('/images/0', headers={'Range': 'bytes=10-19'})
+    assert part.status_code == 206 and part.data == body[10:20]
+    assert part.headers['Content-Range'] == f'bytes 10-19/{len(body)}'
+
+    cached = client.get('/images/0', headers={'If-None-Match': full.headers['ETag']})
+    assert cached.status_code == 304 and cached.data == b''
@@ -0,0 +1,93 @@
+import json
+
+import pytest
+
+import merge_annotations
+from merge_annotations import merge_inputs, merge_inputs_streaming
+
+
+def _write(path, entries):
+    path.write_text(json.dumps(entries))
+    return str(path)
+
+
+def _ann(image_path, **extra):
+    return dict({'image_path': image_path, 'bbox': [0.1, 0.1, 0.2, 0.2], 'gaze': [0.5, 0.5]}, **extra)
+
+
+@pytest.fixture
+def inputs(tmp_path):
+    a = _write(tmp_path / 'a.json', [{'index': 0, 'annotations': [_ann('x.jpg'), _ann('y.jpg')]},
+                                     {'index': 1, 'annotations': [_ann('z.jpg')]}])
+    b = _write(tmp_path / 'b.json', [{'index': 0, 'annotations': [_ann('y.jpg'), _ann('w.jpg')]}])
+    truncated = tmp_path / 'c.json'
+    truncated.write_text(json.dumps([{'index': 0, 'annotations': [_ann('x.jpg')]}])[:-5])
+    return [a, b, str(truncated)]
+
+
+def test_streaming_matches_in_memory_merge(inputs, tmp_path):
+    expected = merge_inputs(inputs, add_annotator=True)
+    spilled = str(tmp_path / 'spilled.json')
+    assert merge_inputs_streaming(inputs, spilled, add_annotator=True, workers=2, buckets=3,
+                                  flush_records=1, in_memory_limit=0) == len(expected) == 4
+    with open(spilled) as f:
+        assert json.load(f) == expected
+
+
+def test_small_inputs_are_merged_in_memory(inputs, tmp_path, monkeypatch):
+    def no_pool(*args, **kwargs):
+        raise AssertionError("small inputs should not spill")
+    monkeypatch.setattr(merge_annotations, 'ProcessPoolExecutor', no_pool)
+    output = str(tmp_path / 'merged.json')
+    assert merge_inputs_streaming(inputs, output, add_annotator=True) == 4
+    with open(output) as f:
+        assert json.load(f) == merge_inputs(inputs, add_annotator=True)
+
+
+def test_failed_streaming_merge_keeps_previous_output(inputs, tmp_path, monkeypatch):
+    output = tmp_path / 'merged.json'
+    output.write_text('["previous"]')
+
+    def broken(path):
+        yield [0, 0, 'x.jpg', []]
+        raise OSError("disk full")
+    monkeypatch.setattr(merge_annotations, '_iter_grouped', broken)
+    with pytest.raises(OSError):
+        merge_inputs_streaming(inputs, str(output), workers=1, buckets=2, in_memory_limit=0)
+    assert output.read_text() == '["previous"]'
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['a.json', 'b.json', 'c.json', 'merged.json']
+
+
+def test_incremental_merge_tracks_inputs_in_the_checkpoint(tmp_path):
+    (tmp_path / 'a').mkdir()
+    (tmp_path / 'b').mkdir()
+    first = _write(tmp_path / 'a' / 'annotations.json', [{'index': 0, 'annotations': [_ann('x.jpg', scale='1')]}])
+    second = _write(tmp_path / 'b' / 'annotations.json', [{'index': 0, 'annotations': [_ann('x.jpg', scale='2')]}])
+    output, checkpoint = str(tmp_path / 'merged.json'), str(tmp_path / 'merged.json.checkpoint.json')
+
+    assert merge_annotations.merge_incremental([first, second], output, checkpoint) == (2, 0, 1)
+    with open(output) as f:
+        merged = json.load(f)
+    # Same-named inputs in different directories are both kept, and records are not annotated with their input
+    assert merged == merge_inputs([first, second])
+    with open(checkpoint) as f:
+        assert sorted(json.load(f)['inputs']) == ['a/annotations.json', 'b/annotations.json']
+
+    _write(tmp_path / 'b' / 'annotations.json', [{'index': 0, 'annotations': [_ann('x.jpg', scale='3')]}])
+    assert merge_annotations.merge_incremental([first, second], output, checkpoint) == (1, 0, 1)
+    with open(output) as f:
+        assert [a['scale'] for a in json.load(f)[0]['annotations']] == ['1', '3']
+
+
+def test_incremental_merge_rebuilds_when_output_was_edited(tmp_path):
+    first = _write(tmp_path / 'a.json', [{'index': 0, 'annotations': [_ann('x.jpg'), _ann('y.jpg')]}])
+    output, checkpoint = str(tmp_path / 'merged.json'), str(tmp_path / 'checkpoint.json')
+    merge_annotations.merge_incremental([first], output, checkpoint)
+    with open(output) as f:
+        merged = json.load(f)
+    merged[0]['annotations'].append(_ann('x.jpg', scale='stray'))
+    _write(tmp_path / 'merged.json', merged)
+
+    assert merge_annotations.merge_incremental([first], output, checkpoint) == (1, 0, 2)
+    with open(output) as f:
+        assert json.load(f) == merge_inputs([first])
@@ -0,0 +1,19 @@
+import os
+
+from merge_json import is_up_to_date, sync_file
+
+
+def test_edit_within_the_same_second_is_not_up_to_date(tmp_path):
+    src, dest = tmp_path / 'src.jpg', tmp_path / 'out' / 'dest.jpg'
+    src.write_bytes(b'first')
+    assert sync_file(str(src), str(dest)) == 'copied'
+    assert is_up_to_date(str(src), str(dest))
+    assert sync_file(str(src), str(dest)) == 'skipped'
+
+    # Same size, mtime moved by less than a second
+    mtime = os.stat(src).st_mtime_ns
+    src.write_bytes(b'other')
+    os.utime(src, ns=(mtime, mtime + 1000))
+    assert not is_up_to_date(str(src), str(dest))
+    assert sync_file(str(src), str(dest)) == 'copied'
+    assert dest.read_bytes() == b'other'
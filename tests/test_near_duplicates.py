@@ -0,0 +1,48 @@
+import random
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image, ImageDraw
+
+from near_duplicates import BKTree, dhash, find_duplicate_groups, hamming, select_unique
+
+
+def test_bk_tree_radius_queries_match_brute_force():
+    rng = random.Random(0)
+    values = [rng.getrandbits(64) for _ in range(300)]
+    # Near copies of a few values, a handful of bits away
+    values += [v ^ (1 << rng.randrange(64)) ^ (1 << rng.randrange(64)) for v in values[:30]]
+    tree = BKTree()
+    for i, v in enumerate(values):
+        tree.add(v, i)
+    assert tree.size == len(values)
+    for radius in (0, 2, 6, 20):
+        for query in values[:40] + [rng.getrandbits(64) for _ in range(10)]:
+            expected = sorted((hamming(query, v), i) for i, v in enumerate(values) if hamming(query, v) <= radius)
+            assert sorted(tree.find(query, radius)) == expected
+
+
+def _frame(path, seed=0, quality=95):
+    rng = random.Random(seed)
+    img = Image.new('RGB', (96, 72), 'white')
+    draw = ImageDraw.Draw(img)
+    for _ in range(12):
+        x, y = rng.randrange(90), rng.randrange(66)
+        draw.rectangle([x, y, x + rng.randrange(8, 30), y + rng.randrange(8, 30)],
+                       fill=tuple(rng.randrange(256) for _ in range(3)))
+    img.save(path, quality=quality)
+    return str(path)
+
+
+def test_near_identical_frames_are_grouped_and_skipped(tmp_path):
+    paths = [_frame(tmp_path / 'a0.jpg', seed=1), _frame(tmp_path / 'b0.jpg', seed=2),
+             _frame(tmp_path / 'a1.jpg', seed=1, quality=40), str(tmp_path / 'missing.jpg')]
+    assert hamming(dhash(paths[0]), dhash(paths[2])) <= 6 < hamming(dhash(paths[0]), dhash(paths[1]))
+    assert dhash(paths[3]) is None
+
+    cache = {}
+    with ThreadPoolExecutor(2) as pool:
+        picked, skipped = select_unique(paths, 3, cache=cache, pool=pool)
+    # The recompressed copy is skipped; the unreadable path is kept
+    assert picked == [0, 1, 3] and skipped == 1
+    assert sorted(cache) == sorted(paths[:3])
+    assert find_duplicate_groups(paths, cache=cache) == [[0, 2]]
@@ -0,0 +1,77 @@
+import json
+
+import pytest
+
+import app as annotation_app
+from conftest import GF_PATHS
+
+ANNOTATION = {'bbox': [0.1, 0.1, 0.2, 0.2], 'gaze': [0.5, 0.5]}
+
+
+def _save(client, index):
+    response = client.post(f'/label_image/{index}', data={'annotations': json.dumps([ANNOTATION])})
+    assert response.status_code in (200, 302)  # 200: the last image's completion page
+    return response
+
+
+def _identify(flask_app, annotator, passphrase='secret'):
+    client = flask_app.test_client()
+    return client, client.post('/identify', data={'annotator': annotator, 'passphrase': passphrase})
+
+
+def _entries():
+    return list(annotation_app._iter_stored_entries())
+
+
+def test_identify_resumes_without_duplicate_entries(app_config):
+    flask_app = annotation_app.create_app(app_config())
+    first, response = _identify(flask_app, 'ann-1')
+    assert response.status_code == 302 and response.location.endswith('/resume')
+    _save(first, 0)
+    _save(first, 1)
+
+    # A new browser: same ID and passphrase pick up at the first unsaved image
+    second, response = _identify(flask_app, 'ann-1')
+    assert response.status_code == 302
+    assert second.get('/').location.endswith('/label_image/2')
+
+    _save(second, 1)
+    entries = _entries()
+    assert len(entries) == 2 and {e['uid'] for e in entries} == {'ann-1'}
+
+
+def test_identify_needs_the_passphrase(app_config):
+    flask_app = annotation_app.create_app(app_config())
+    _identify(flask_app, 'ann-2', 'right one')
+    client, response = _identify(flask_app, 'ann-2', 'wrong one')
+    assert response.status_code == 403
+    with client.session_transaction() as sess:
+        assert sess.get('uid') != 'ann-2'
+    assert _identify(flask_app, 'ann-3', 'abc')[1].status_code == 400
+    assert _identify(flask_app, '../x')[1].status_code == 400
+    assert b'type=\'password\'' in flask_app.test_client().get('/identify?annotator=ann-2').data
+
+
+@pytest.mark.parametrize('mode', ['coverage', 'clip'])
+def test_progress_bitmaps_are_kept_per_mode(app_config, mode):
+    fixed = app_config(paths=GF_PATHS)
+    client, _ = _identify(annotation_app.create_app(fixed), 'ann-4')
+    for index in range(3):
+        _save(client, index)
+    assert client.get('/').location.endswith('/label_image/3')
+
+    # Same progress directory in another mode: fixed-mode bits are not read as its slots
+    other = annotation_app.create_app(dict(fixed, ASSIGNMENT_MODE=mode, ANNOTATIONS_PER_IMAGE=5))
+    assert annotation_app.progress.directory != fixed['PROGRESS_DIR']
+    client, _ = _identify(other, 'ann-4')
+    assert annotation_app.progress.completed_count('ann-4') == 0
+    assert client.get('/').location.endswith('/label_image/0')
+    _save(client, 0)
+    assert annotation_app.progress.completed_count('ann-4') == 1
+    if mode == 'coverage':
+        # The scheduler still knows from the store which images ann-4 did
+        assert annotation_app.USER_IMAGE_ASSIGNMENTS['ann-4'][0]['path'] == GF_PATHS[3]
+
+    # Back in fixed mode the original bitmap is untouched
+    annotation_app.create_app(fixed)
+    assert annotation_app.progress.completed_count('ann-4') == 3
@@ -0,0 +1,72 @@
+import json
+import os
+
+import pytest
+
+from annotation_store import AnnotationStore
+from snapshots import list_snapshots, restore_snapshot, take_snapshot, verify_snapshot
+
+
+def _store(tmp_path, shards=2):
+    store = AnnotationStore(str(tmp_path / 'annotations.json'), shards=shards)
+    store.init_files()
+    for uid in ('alice', 'bob', 'carol'):
+        store.reserve_index(uid)
+    return store
+
+
+def test_take_and_verify(tmp_path):
+    store = _store(tmp_path)
+    directory = str(tmp_path / 'snapshots')
+    manifest = take_snapshot(store, directory)
+    assert manifest['entries'] == 3 and manifest['shards'] == 2 and manifest['warnings'] == 0
+    assert sorted(manifest['files']) == sorted(os.path.basename(p) for p in store.paths())
+    assert os.listdir(directory) == [manifest['name']]
+    assert verify_snapshot(os.path.join(directory, manifest['name'])) == []
+
+
+def test_verify_reports_tampering(tmp_path):
+    store = _store(tmp_path)
+    manifest = take_snapshot(store, str(tmp_path / 'snapshots'))
+    path = tmp_path / 'snapshots' / manifest['name']
+    shard_file = path / os.path.basename(store.path_of(0))
+    shard_file.write_text(shard_file.read_text() + ' ')
+    assert verify_snapshot(str(path)) == [f"{shard_file.name}: sha256 mismatch"]
+    (path / 'manifest.json').unlink()
+    assert verify_snapshot(str(path))[0].startswith('unreadable manifest')
+
+
+def test_damaged_store_is_not_snapshotted(tmp_path):
+    store = _store(tmp_path, shards=1)
+    with open(store.path, 'w') as f:
+        f.write('[{"index": 0')
+    with pytest.raises(ValueError):
+        take_snapshot(store, str(tmp_path / 'snapshots'))
+    assert list_snapshots(store, str(tmp_path / 'snapshots')) == []
+
+
+def test_keep_prunes_old_snapshots(tmp_path):
+    store = _store(tmp_path)
+    directory = str(tmp_path / 'snapshots')
+    names = [take_snapshot(store, directory, keep=2)['name'] for _ in range(3)]
+    assert [m['name'] for m in list_snapshots(store, directory)] == names[:0:-1]
+
+
+def test_restore_snapshot(tmp_path):
+    store = _store(tmp_path)
+    before = store.read_all()
+    manifest = take_snapshot(store, str(tmp_path / 'snapshots'))
+    path = str(tmp_path / 'snapshots' / manifest['name'])
+    store.reserve_index('dave')
+    with open(store.path_of(1), 'w') as f:
+        f.write('garbage')
+
+    restore_snapshot(store, path)
+    assert store.read_all() == before
+
+    with pytest.raises(ValueError, match='shards'):
+        restore_snapshot(AnnotationStore(str(tmp_path / 'annotations.json'), shards=3), path)
+    with open(os.path.join(path, os.path.basename(store.path_of(0))), 'a') as f:
+        f.write(' ')
+    with pytest.raises(ValueError, match='not restoring'):
+        restore_snapshot(store, path)
@@ -0,0 +1,63 @@
+import os
+import subprocess
+import sys
+
+from telemetry import COMPACTED_NAME, TelemetryAggregator
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _flush_in_exited_process(directory, submit_ms):
+    """Record and flush events from a separate process, which has exited when this returns."""
+    code = ("import sys; from telemetry import TelemetryAggregator; "
+            "aggregator = TelemetryAggregator(sys.argv[1]); "
+            "aggregator.record('annotator', [('img.jpg', {'submit_ms': int(ms)}) for ms in sys.argv[2:]]); "
+            "aggregator.flush()")
+    subprocess.run([sys.executable, '-c', code, str(directory), *map(str, submit_ms)], cwd=ROOT_DIR, check=True)
+
+
+def _names(directory):
+    return sorted(n for n in os.listdir(directory) if n.endswith('.json'))
+
+
+def test_files_of_exited_processes_are_compacted(tmp_path):
+    for _ in range(3):
+        _flush_in_exited_process(tmp_path, [100, 2000])
+    # A worker that is still running (this process, started at another time)
+    live = TelemetryAggregator(str(tmp_path), clock=lambda: 1000)
+    live.record('annotator', [('img.jpg', {'submit_ms': 100})])
+    live.flush()
+
+    aggregator = TelemetryAggregator(str(tmp_path))
+    assert _names(tmp_path) == sorted([COMPACTED_NAME, os.path.basename(live.path)])
+
+    aggregator.record('annotator', [('img.jpg', {'submit_ms': 100})])
+    snapshot = aggregator.snapshot()
+    assert snapshot['events'] == 8
+    assert snapshot['overall']['submit_ms']['n'] == 8
+    assert snapshot['per_annotator']['annotator']['submit_ms']['n'] == 8
+    assert snapshot['slowest_images'][0]['image_path'] == 'img.jpg'
+
+
+def test_absorbed_files_are_not_counted_twice(tmp_path):
+    _flush_in_exited_process(tmp_path, [100])
+    name = next(n for n in _names(tmp_path) if n != COMPACTED_NAME)
+    saved = (tmp_path / name).read_text()
+    TelemetryAggregator(str(tmp_path))
+    assert _names(tmp_path) == [COMPACTED_NAME]
+    # As if the compaction had stopped before deleting the file
+    (tmp_path / name).write_text(saved)
+    assert TelemetryAggregator(str(tmp_path)).snapshot()['events'] == 1
+    assert not (tmp_path / name).exists()
+
+
+def test_out_of_range_values_are_not_counted(tmp_path):
+    aggregator = TelemetryAggregator(str(tmp_path))
+    accepted = aggregator.record('annotator', [
+        ('img.jpg', {'submit_ms': -1}),
+        ('img.jpg', {'submit_ms': True, 'resets': 'two'}),
+        ('img.jpg', {'submit_ms': 500, 'first_bbox_ms': float('nan')}),
+    ])
+    snapshot = aggregator.snapshot()
+    assert accepted == 1 and snapshot['events'] == 1
+    assert snapshot['overall']['submit_ms']['p50'] == 500 and snapshot['overall']['first_bbox_ms']['n'] == 0
@@ -0,0 +1,89 @@
+import base64
+import json
+
+import pytest
+
+import app as annotation_app
+from annotation_store import AnnotationStore
+from conftest import GF_PATHS
+
+TOKEN = 'let-me-in'
+
+
+def _ann(path, target_type='object'):
+    return {'image_path': path, 'bbox': [0.1, 0.1, 0.2, 0.2], 'gaze': [0.5, 0.5], 'target_type': target_type}
+
+
+@pytest.fixture
+def sharded(app_config):
+    config = app_config(ANNOTATION_SHARDS=2, ADMIN_TOKEN=TOKEN)
+    flask_app = annotation_app.create_app(config)
+    client = flask_app.test_client()
+    client.post('/identify', data={'annotator': 'worker-a', 'passphrase': 'secret'})
+    client.post('/label_image/0', data={'annotations': json.dumps([_ann(GF_PATHS[0])])})
+    # The same files as seen by another worker process
+    return client, AnnotationStore(config['ANNOTATIONS_PATH'], 2)
+
+
+def _get(client, path):
+    response = client.get(path, headers={'Authorization': f'Bearer {TOKEN}'})
+    assert response.status_code == 200
+    return response.get_json()
+
+
+def test_foreign_writes_reread_only_their_shard(sharded, monkeypatch):
+    client, other = sharded
+    assert _get(client, '/api/stats')['annotations'] == 1
+    own_shard = annotation_app.annotation_store.shard_for_uid('worker-a')
+    foreign = 1 - own_shard
+
+    with other.edit(foreign) as entries:
+        entries.append({'index': foreign, 'uid': 'worker-b', 'saved_at': 1,
+                        'annotations': [_ann(GF_PATHS[1], 'person'), _ann(GF_PATHS[2], 'person')]})
+    reads = []
+    read = annotation_app.annotation_store.read
+    monkeypatch.setattr(annotation_app.annotation_store, 'read', lambda shard: reads.append(shard) or read(shard))
+
+    stats = _get(client, '/api/stats')
+    assert reads == [foreign]
+    assert stats['annotations'] == 3
+
+    # Rewriting the foreign entry replaces its contribution instead of adding to it
+    with other.edit(foreign) as entries:
+        entries[-1]['annotations'] = [_ann(GF_PATHS[1], 'person')]
+    stats = _get(client, '/api/stats')
+    assert stats['annotations'] == 2 and reads == [foreign, foreign]
+    assert _get(client, '/api/annotations?annotator=worker-b')['results'][0]['annotations'] == [_ann(GF_PATHS[1], 'person')]
+    assert _get(client, '/api/annotations?image_path=' + GF_PATHS[2])['results'] == []
+
+    # Our own saves are applied in place and never trigger a re-read
+    client.post('/label_image/1', data={'annotations': json.dumps([_ann(GF_PATHS[1])])})
+    assert _get(client, '/api/stats')['annotations'] == 3 and reads == [foreign, foreign]
+
+
+@pytest.mark.parametrize('path', ['/stats', '/api/stats', '/api/annotations', '/api/telemetry'])
+def test_views_need_the_admin_token(app_config, path):
+    client = annotation_app.create_app(app_config()).test_client()
+    client.get('/label_image/0')
+    assert client.get(path).status_code == 403
+
+    client = annotation_app.create_app(app_config(ADMIN_TOKEN=TOKEN)).test_client()
+    client.get('/label_image/0')
+    missing = client.get(path)
+    assert missing.status_code == 401 and missing.headers['WWW-Authenticate'].startswith('Basic')
+    assert client.get(path, headers={'Authorization': 'Bearer nope'}).status_code == 401
+    assert client.get(path, headers={'Authorization': f'Bearer {TOKEN}'}).status_code == 200
+    basic = base64.b64encode(f'anyone:{TOKEN}'.encode()).decode()
+    assert client.get(path, headers={'Authorization': f'Basic {basic}'}).status_code == 200
+
+
+
+def test_telemetry_beacons_stay_open(app_config):
+    client = annotation_app.create_app(app_config(ADMIN_TOKEN=TOKEN)).test_client()
+    client.get('/label_image/0')
+    events = [{'image_path': GF_PATHS[2], 'submit_ms': 1200}, {'image_path': 'not/in/dataset.jpg', 'submit_ms': 5},
+              {'index': 0, 'submit_ms': 5}]
+    response = client.post('/api/telemetry', data=json.dumps({'events': events}))
+    assert response.status_code == 202 and response.get_json() == {'accepted': 1}
+    slowest = _get(client, '/api/telemetry')['slowest_images']
+    assert [image['image_path'] for image in slowest] == [GF_PATHS[2]]